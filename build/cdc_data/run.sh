@@ -76,6 +76,7 @@ cd $WORKSPACE_DIR
 python3 -m tools.nl.embeddings.build_embeddings \
     --embeddings_name=$CUSTOM_EMBEDDINGS_INDEX \
     --output_dir=$DC_NL_EMBEDDINGS_DIR \
-    --additional_catalog_path=$ADDITIONAL_CATALOG_PATH
+    --additional_catalog_path=$ADDITIONAL_CATALOG_PATH \
+    --incremental
 
 echo "Data loading completed."
@@ -0,0 +1,146 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Micro-batching of concurrent model calls.
+
+Model inference is much cheaper per input in large batches. A MicroBatcher
+combines the inputs of calls that arrive within a short window into a single
+model call, and splits the outputs back per caller.
+"""
+
+from concurrent.futures import Future
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+from nl_server.metrics import Histogram
+
+# How long to wait for more calls to add to a batch.
+_DEFAULT_WINDOW_MS = 5
+# Max number of inputs in a batch. A single call with more inputs than this is
+# run as its own batch.
+_DEFAULT_MAX_BATCH_SIZE = 64
+_WINDOW_MS_ENV = 'NL_BATCH_WINDOW_MS'
+_MAX_BATCH_SIZE_ENV = 'NL_MAX_BATCH_SIZE'
+
+# Upper bounds of the histogram buckets. The last bucket holds everything
+# above the last bound.
+_BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128]
+_QUEUE_DELAY_MS_BUCKETS = [1, 2, 5, 10, 20, 50, 100]
+
+
+class MicroBatcher:
+  """Runs a batch function over the combined inputs of concurrent calls."""
+
+  def __init__(self,
+               batch_fn: Callable[[List[Any]], Any],
+               window_ms: float = _DEFAULT_WINDOW_MS,
+               max_batch_size: int = _DEFAULT_MAX_BATCH_SIZE):
+    """
+    Args:
+      batch_fn: function that takes a list of inputs and returns a sliceable
+        sequence (eg. a list or an array) with one output per input.
+      window_ms: how long to wait for more calls after the first call of a
+        batch.
+      max_batch_size: a batch is run as soon as it has this many inputs.
+    """
+    self._batch_fn = batch_fn
+    self._window_s = window_ms / 1000
+    self._max_batch_size = max_batch_size
+    # Queue of (inputs, future, enqueue time).
+    self._queue = queue.Queue()
+    self._worker = None
+    self._worker_lock = threading.Lock()
+    self._stats_lock = threading.Lock()
+    self._batch_sizes = Histogram(_BATCH_SIZE_BUCKETS)
+    self._queue_delays_ms = Histogram(_QUEUE_DELAY_MS_BUCKETS)
+
+  def __call__(self, inputs: List[Any]) -> Any:
+    """Runs the batch function on inputs as part of a batch, and returns the
+    outputs for those inputs."""
+    if not inputs:
+      return self._batch_fn(inputs)
+    self._ensure_worker()
+    future = Future()
+    self._queue.put((inputs, future, time.perf_counter()))
+    return future.result()
+
+  def _ensure_worker(self):
+    if self._worker and self._worker.is_alive():
+      return
+    with self._worker_lock:
+      if not self._worker or not self._worker.is_alive():
+        self._worker = threading.Thread(target=self._run,
+                                        name='micro_batcher',
+                                        daemon=True)
+        self._worker.start()
+
+  def _next_batch(self) -> List[tuple]:
+    """Blocks until there is a call, then collects the calls that arrive within
+    the window (or until the batch is full)."""
+    batch = [self._queue.get()]
+    size = len(batch[0][0])
+    deadline = time.perf_counter() + self._window_s
+    while size < self._max_batch_size:
+      timeout = deadline - time.perf_counter()
+      if timeout <= 0:
+        break
+      try:
+        call = self._queue.get(timeout=timeout)
+      except queue.Empty:
+        break
+      batch.append(call)
+      size += len(call[0])
+    return batch
+
+  def _run(self):
+    while True:
+      batch = self._next_batch()
+      start = time.perf_counter()
+      inputs = []
+      for call_inputs, _, _ in batch:
+        inputs.extend(call_inputs)
+      with self._stats_lock:
+        self._batch_sizes.add(len(inputs))
+        for _, _, enqueued in batch:
+          self._queue_delays_ms.add((start - enqueued) * 1000)
+      try:
+        outputs = self._batch_fn(inputs)
+      except Exception as e:
+        for _, future, _ in batch:
+          future.set_exception(e)
+        continue
+      offset = 0
+      for call_inputs, future, _ in batch:
+        future.set_result(outputs[offset:offset + len(call_inputs)])
+        offset += len(call_inputs)
+
+  def stats(self) -> Dict:
+    with self._stats_lock:
+      return {
+          'batchSize': self._batch_sizes.to_dict(),
+          'queueDelayMs': self._queue_delays_ms.to_dict(),
+      }
+
+
+def create_from_env(batch_fn: Callable[[List[Any]], Any]) -> MicroBatcher:
+  """Creates a batcher configured by the NL_BATCH_WINDOW_MS and
+  NL_MAX_BATCH_SIZE env vars."""
+  return MicroBatcher(batch_fn,
+                      window_ms=float(
+                          os.environ.get(_WINDOW_MS_ENV, _DEFAULT_WINDOW_MS)),
+                      max_batch_size=int(
+                          os.environ.get(_MAX_BATCH_SIZE_ENV,
+                                         _DEFAULT_MAX_BATCH_SIZE)))
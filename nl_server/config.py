@@ -29,6 +29,19 @@ class StoreType(str, Enum):
 class ModelType(str, Enum):
   LOCAL = 'LOCAL'
   VERTEXAI = 'VERTEXAI'
+  ONNX = 'ONNX'
+
+
+class MemorySearchType(str, Enum):
+  # Brute-force search over all embeddings.
+  EXACT = 'EXACT'
+  # Approximate search with an inverted file (IVF) index.
+  IVF = 'IVF'
+
+
+class MemoryQuantization(str, Enum):
+  FLOAT16 = 'FLOAT16'
+  INT8 = 'INT8'
 
 
 class ModelUsage(str, Enum):
@@ -55,6 +68,18 @@ class LocalModelConfig(ModelConfig):
   gcs_folder: str = None
 
 
+@dataclass(kw_only=True)
+class OnnxModelConfig(LocalModelConfig):
+  # Whether to quantize the weights of the exported model to int8.
+  quantize: bool = True
+  # ONNX Runtime threads, or None for the ONNX Runtime defaults.
+  intra_op_threads: int = None
+  inter_op_threads: int = None
+  # Max difference from the torch model on load: (1 - cosine similarity) for
+  # embeddings models, and absolute score difference for reranking models.
+  tolerance: float = None
+
+
 @dataclass(kw_only=True)
 class IndexConfig:
   store_type: str = None
@@ -66,11 +91,30 @@ class IndexConfig:
 @dataclass(kw_only=True)
 class MemoryIndexConfig(IndexConfig):
   embeddings_path: str = None
+  search_type: str = MemorySearchType.EXACT
+  # Number of IVF lists. Defaults to 4 * sqrt(number of embeddings).
+  ivf_nlist: int = None
+  # Number of IVF lists to search per query.
+  ivf_nprobe: int = 16
+  # Scalar quantization (FLOAT16 or INT8) of the embeddings searched by EXACT
+  # search, or None to search the full precision embeddings.
+  quantization: str = None
+  # Number of quantized search candidates to rescore in full precision, as a
+  # multiple of top_k.
+  rescore_factor: int = 4
 
 
 @dataclass(kw_only=True)
 class LanceDBIndexConfig(IndexConfig):
   embeddings_path: str = None
+  # Number of partitions of the ANN index to search, or None for the LanceDB
+  # default. Ignored if the table has no ANN index.
+  nprobes: int = None
+  # Re-ranks refine_factor * top_k ANN candidates with exact distances, or
+  # None to not re-rank.
+  refine_factor: int = None
+  # Max number of query embeddings of a request to search at the same time.
+  search_concurrency: int = 8
 
 
 @dataclass(kw_only=True)
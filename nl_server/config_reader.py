@@ -29,6 +29,7 @@ from nl_server.config import MemoryIndexConfig
 from nl_server.config import ModelConfig
 from nl_server.config import ModelType
 from nl_server.config import ModelUsage
+from nl_server.config import OnnxModelConfig
 from nl_server.config import ServerConfig
 from nl_server.config import StoreType
 from nl_server.config import VertexAIIndexConfig
@@ -172,6 +173,8 @@ def read_catalog(catalog_paths: List[str] = _DEFAULT_CATALOG_PATHS,
             models[model_name] = LocalModelConfig(**model_config)
           case ModelType.VERTEXAI:
             models[model_name] = VertexAIModelConfig(**model_config)
+          case ModelType.ONNX:
+            models[model_name] = OnnxModelConfig(**model_config)
           case _:
             raise ValueError(f'Unknown model type: {model_type}')
 
@@ -20,6 +20,8 @@ from typing import Dict, List
 
 import torch
 
+from nl_server import metrics
+
 
 # A single match from Embeddings result.
 @dataclass
@@ -35,6 +37,9 @@ class EmbeddingsMatch:
 # Ordered list of matches.
 EmbeddingsResult = List[EmbeddingsMatch]
 
+# Score of a sentence that a query matches exactly.
+EXACT_MATCH_SCORE = 1.0
+
 
 #
 # Abstract class for an Embeddings model which takes a list of
@@ -67,6 +72,12 @@ class EmbeddingsStore(ABC):
                     top_k: int) -> List[EmbeddingsResult]:
     pass
 
+  # Returns, for each query, the matches of the indexed sentences equal to the
+  # query after normalization with a perfect score. Stores that cannot look up
+  # sentences return no matches.
+  def exact_match(self, queries: List[str]) -> List[EmbeddingsResult]:
+    return [[] for _ in queries]
+
 
 # Search result keyed by query.
 SearchVarsResult = Dict[str, EmbeddingsResult]
@@ -75,14 +86,31 @@ SearchVarsResult = Dict[str, EmbeddingsResult]
 # A simple wrapper around EmbeddingsModel + EmbeddingsStore.
 class Embeddings:
 
-  def __init__(self, model: EmbeddingsModel, store: EmbeddingsStore):
+  def __init__(self,
+               model: EmbeddingsModel,
+               store: EmbeddingsStore,
+               index_name: str = '',
+               model_name: str = ''):
     self.model: EmbeddingsModel = model
     self.store: EmbeddingsStore = store
-
-  # Given a list of queries, returns
-  def vector_search(self, queries: List[str], top_k: int) -> SearchVarsResult:
-    query_embeddings = self.model.encode(queries)
-
+    # Labels of the stage latency metrics.
+    self.index_name = index_name
+    self.model_name = model_name
+
+  def encode(
+      self,
+      queries: List[str],
+      timings: Dict[str, float] = None) -> List[List[float]] | torch.Tensor:
+    with metrics.timer('encode', self.model_name, timings):
+      return self.model.encode(queries)
+
+  # Given a list of queries and their embeddings from encode(), returns the
+  # matches keyed by query.
+  def search(self,
+             queries: List[str],
+             query_embeddings: List[List[float]] | torch.Tensor,
+             top_k: int,
+             timings: Dict[str, float] = None) -> SearchVarsResult:
     if self.model.returns_tensor and not self.store.needs_tensor:
       # Convert to List[List[float]]
       query_embeddings = query_embeddings.tolist()
@@ -91,7 +119,21 @@ class Embeddings:
       query_embeddings = torch.tensor(query_embeddings, dtype=torch.float)
 
     # Call the store.
-    results = self.store.vector_search(query_embeddings, top_k)
+    with metrics.timer('search', self.index_name, timings):
+      results = self.store.vector_search(query_embeddings, top_k)
 
     # Turn this into a map:
     return {k: v for k, v in zip(queries, results)}
+
+  # Given a list of queries, returns the exact matches of the queries that have
+  # any, keyed by query.
+  def exact_match(self, queries: List[str]) -> SearchVarsResult:
+    results = self.store.exact_match(queries)
+    return {k: v for k, v in zip(queries, results) if v}
+
+  # Given a list of queries, returns
+  def vector_search(self,
+                    queries: List[str],
+                    top_k: int,
+                    timings: Dict[str, float] = None) -> SearchVarsResult:
+    return self.search(queries, self.encode(queries, timings), top_k, timings)
@@ -0,0 +1,83 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Cache of query embeddings."""
+
+from typing import List
+
+import numpy as np
+import torch
+
+from nl_server.embeddings import EmbeddingsModel
+from nl_server.query_cache import normalize_query
+from nl_server.query_cache import QueryCache
+
+
+class EmbeddingsCache(QueryCache):
+  """LRU cache of float32 query embeddings keyed by (model name, query), with
+  an optional on-disk tier.
+  """
+
+  DEFAULT_MAX_SIZE = 10000
+  MAX_SIZE_ENV = 'NL_EMBEDDINGS_CACHE_SIZE'
+  DISK_DIR_ENV = 'NL_EMBEDDINGS_CACHE_DIR'
+  DISK_FILE = 'query_embeddings.sqlite'
+
+  def _disk_value(self, value: np.ndarray) -> bytes:
+    return value.astype(np.float32).tobytes()
+
+  def _from_disk_value(self, value: bytes) -> np.ndarray:
+    return np.frombuffer(value, dtype=np.float32)
+
+
+def create_from_env() -> EmbeddingsCache:
+  """Creates a cache configured by the NL_EMBEDDINGS_CACHE_* env vars."""
+  return EmbeddingsCache.from_env()
+
+
+class CachedEmbeddingsModel(EmbeddingsModel):
+  """Wraps an EmbeddingsModel to only encode queries that are not cached."""
+
+  def __init__(self, model: EmbeddingsModel, model_name: str,
+               cache: EmbeddingsCache):
+    super().__init__(model.score_threshold, returns_tensor=model.returns_tensor)
+    self.model = model
+    self.model_name = model_name
+    self.cache = cache
+    # Dimension of the embeddings, once known.
+    self._dim: int = None
+
+  def encode(self, queries: List[str]) -> List[List[float]] | torch.Tensor:
+    keys = [normalize_query(q) for q in queries]
+    cached = self.cache.get(self.model_name, list(dict.fromkeys(keys)))
+    missing = [k for k in dict.fromkeys(keys) if k not in cached]
+    if missing:
+      encoded = self.model.encode(missing)
+      if isinstance(encoded, torch.Tensor):
+        encoded = encoded.cpu().numpy()
+      encoded = np.asarray(encoded, dtype=np.float32)
+      new_embeddings = {k: e for k, e in zip(missing, encoded)}
+      self.cache.put(self.model_name, new_embeddings)
+      cached.update(new_embeddings)
+    embeddings = [cached[k] for k in keys]
+    if embeddings:
+      self._dim = len(embeddings[0])
+    if self.returns_tensor:
+      if embeddings:
+        return torch.from_numpy(np.stack(embeddings))
+      if self._dim is None:
+        # Returns what the model returns for no queries, which has its
+        # dimension.
+        return torch.as_tensor(self.model.encode([]), dtype=torch.float)
+      return torch.zeros((0, self._dim), dtype=torch.float)
+    return [e.tolist() for e in embeddings]
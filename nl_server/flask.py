@@ -23,6 +23,7 @@ import torch
 from nl_server import registry
 from nl_server import routes
 from nl_server import search
+from nl_server import shared_memory
 from shared.lib import gcp as lib_gcp
 from shared.lib import utils as lib_utils
 
@@ -49,6 +50,10 @@ def create_app():
   if sys.version_info >= (3, 8) and sys.platform == "darwin":
     torch.set_num_threads(1)
 
+  if shared_memory.enabled():
+    # Files left over by previous servers, eg. of embeddings that changed.
+    shared_memory.remove_unused()
+
   try:
     # Build the registry before creating the Flask app to make sure all resources
     # are loaded.
@@ -61,13 +66,17 @@ def create_app():
       idx_type = server_config.default_indexes[0]
       embeddings = reg.get_index(idx_type)
       query = server_config.indexes[idx_type].healthcheck_query
-      result = search.search_vars([embeddings], [query]).get(query)
+      # Vector search even if the query matches a sentence exactly, to check
+      # the model too.
+      result = search.search_vars([embeddings], [query],
+                                  fill_exact_matches=True).get(query)
       if not result or not result.svs:
         raise Exception(f'Registry does not have default index {idx_type}')
 
     app = Flask(__name__)
     app.register_blueprint(routes.bp)
     app.config[registry.REGISTRY_KEY] = reg
+    app.config[registry.RELOADER_KEY] = registry.Reloader()
 
     logging.info('NL Server Flask app initialized')
     return app
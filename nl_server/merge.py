@@ -12,14 +12,14 @@
 # see the license for the specific language governing permissions and
 # limitations under the license.
 
-from itertools import chain
+import heapq
 from typing import Dict, List
 
 from nl_server.embeddings import EmbeddingsResult
 from nl_server.embeddings import SearchVarsResult
 
 
-# This function merges the lists and sorts by score.
+# This function merges the lists (each sorted by descending score) by score.
 #
 # Note that the resulting list can have multiple entries for the
 # same "sentence", and for the same variable.  This will get grouped
@@ -47,7 +47,6 @@ def merge_search_results(inputs: List[SearchVarsResult]) -> SearchVarsResult:
 
 def _merge_search_results_for_one_query(
     inputs: List[EmbeddingsResult]) -> EmbeddingsResult:
-  # Given the inputs are sorted, this maybe a bit less efficient than
-  # merge sort, but lets the library do the sorting.
-  flattened_list = chain.from_iterable(inputs)
-  return sorted(flattened_list, key=lambda x: x.score, reverse=True)
+  # The inputs are already sorted, so merge them with a heap. Matches with the
+  # same score keep the order of the inputs.
+  return list(heapq.merge(*inputs, key=lambda x: x.score, reverse=True))
@@ -0,0 +1,104 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Latency histograms of the stages of serving a request.
+
+Each stage (eg. "encode" or "search") is timed separately per label (eg. the
+model or index name), and the histograms are exposed by /api/metrics/.
+"""
+
+from bisect import bisect_left
+import contextlib
+import threading
+import time
+from typing import Dict, List
+
+# Upper bounds of the stage latency buckets, in ms.
+_LATENCY_MS_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+class Histogram:
+  """Counts of values in buckets. The last bucket holds everything above the
+  last bound."""
+
+  def __init__(self, bounds: List[float]):
+    self._bounds = bounds
+    self._counts = [0] * (len(bounds) + 1)
+    self._total = 0
+    self._num = 0
+
+  def add(self, value: float):
+    self._counts[bisect_left(self._bounds, value)] += 1
+    self._total += value
+    self._num += 1
+
+  def to_dict(self) -> Dict:
+    labels = ['<={}'.format(b) for b in self._bounds]
+    labels.append('>{}'.format(self._bounds[-1]))
+    return {
+        'count': self._num,
+        'mean': self._total / self._num if self._num else 0,
+        'buckets': dict(zip(labels, self._counts)),
+    }
+
+
+class StageMetrics:
+  """Latency histograms keyed by stage and label."""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._histograms: Dict[str, Dict[str, Histogram]] = {}
+
+  def record(self, stage: str, label: str, ms: float):
+    with self._lock:
+      histograms = self._histograms.setdefault(stage, {})
+      if label not in histograms:
+        histograms[label] = Histogram(_LATENCY_MS_BUCKETS)
+      histograms[label].add(ms)
+
+  def stats(self) -> Dict[str, Dict[str, Dict]]:
+    with self._lock:
+      return {
+          stage: {
+              label: h.to_dict() for label, h in histograms.items()
+          } for stage, histograms in self._histograms.items()
+      }
+
+
+# Metrics of all the requests served by this process.
+_metrics = StageMetrics()
+
+
+@contextlib.contextmanager
+def timer(stage: str, label: str = '', timings: Dict[str, float] = None):
+  """Times a block as a stage.
+
+  Args:
+    stage: the stage of the block.
+    label: the model or index the stage ran for, if any.
+    timings: per request timings to also add the latency (in ms) to, keyed by
+      "<stage>" or "<stage>:<label>".
+  """
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    ms = (time.perf_counter() - start) * 1000
+    _metrics.record(stage, label, ms)
+    if timings is not None:
+      timings[f'{stage}:{label}' if label else stage] = round(ms, 3)
+
+
+def stats() -> Dict[str, Dict[str, Dict]]:
+  """Gets the latency histogram of each stage, keyed by stage and label."""
+  return _metrics.stats()
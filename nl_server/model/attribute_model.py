@@ -13,34 +13,91 @@
 # limitations under the License.
 """Model to detect query attributes."""
 
+from collections import OrderedDict
+import os
+import threading
 from typing import List
 
 import en_core_web_sm
 
+# Components of the pipeline that verb detection does not use. It only needs
+# the POS tags (tok2vec, tagger and attribute_ruler) and the dependency labels
+# (parser).
+_UNUSED_COMPONENTS = ['ner', 'lemmatizer']
+
+# Max number of queries to keep the verbs of.
+_DEFAULT_CACHE_SIZE = 10000
+_CACHE_SIZE_ENV = 'NL_VERBS_CACHE_SIZE'
+
+
+def _normalize(query: str) -> str:
+  return ' '.join(query.split())
+
 
 class AttributeModel:
 
-  def __init__(self) -> None:
-    self.spacy_model_ = en_core_web_sm.load()
+  def __init__(self, full_pipeline: bool = False) -> None:
+    """
+    Args:
+      full_pipeline: loads all the components of the spaCy pipeline, to compare
+        with the default lean pipeline.
+    """
+    exclude = [] if full_pipeline else _UNUSED_COMPONENTS
+    self.spacy_model_ = en_core_web_sm.load(exclude=exclude)
+    # Normalized query -> verbs, least recently used first.
+    self._cache: OrderedDict[str, List[str]] = OrderedDict()
+    self._cache_size = int(os.environ.get(_CACHE_SIZE_ENV, _DEFAULT_CACHE_SIZE))
+    self._lock = threading.Lock()
 
   def detect_verbs(self, query: str) -> List[str]:
-    try:
-      doc = self.spacy_model_(query)
-    except Exception as e:
-      raise Exception(e)
-    result = []
-    for token in doc:
-      if 'VERB' in token.pos_:
-        # checks the dependency relation of the token. Skip if the token is not
-        # action related.
-        #
-        # 'auxpass': passive auxiliary of a clause is a non-main verb like
-        # 'was observed', "were seen".
-        #
-        # 'amod': adjectival modifier which should not be treated as verb.
-        if token.dep_ in ['auxpass', 'amod']:
-          continue
-        result.append(token.text)
-    # TODO: consider drop stats related verbs: vary, correlate, compare, rank,
-    # have ...
-    return result
+    return self.detect_verbs_batch([query])[0]
+
+  def detect_verbs_batch(self, queries: List[str]) -> List[List[str]]:
+    """Detects the verbs of each query. Queries that are not cached are run
+    through the pipeline together."""
+    keys = [_normalize(q) for q in queries]
+    key2verbs = {}
+    with self._lock:
+      for key in keys:
+        if key in self._cache:
+          self._cache.move_to_end(key)
+          key2verbs[key] = self._cache[key]
+    # The first query of each missing key, in order.
+    missing = {}
+    for key, query in zip(keys, queries):
+      if key not in key2verbs:
+        missing.setdefault(key, query)
+    if missing:
+      try:
+        docs = list(self.spacy_model_.pipe(missing.values()))
+      except Exception as e:
+        raise Exception(e)
+      new_verbs = {key: _verbs(doc) for key, doc in zip(missing, docs)}
+      key2verbs.update(new_verbs)
+      with self._lock:
+        for key, verbs in new_verbs.items():
+          self._cache[key] = verbs
+          self._cache.move_to_end(key)
+        while len(self._cache) > self._cache_size:
+          self._cache.popitem(last=False)
+    # Copies, so callers cannot change the cached lists.
+    return [list(key2verbs[key]) for key in keys]
+
+
+def _verbs(doc) -> List[str]:
+  result = []
+  for token in doc:
+    if 'VERB' in token.pos_:
+      # checks the dependency relation of the token. Skip if the token is not
+      # action related.
+      #
+      # 'auxpass': passive auxiliary of a clause is a non-main verb like
+      # 'was observed', "were seen".
+      #
+      # 'amod': adjectival modifier which should not be treated as verb.
+      if token.dep_ in ['auxpass', 'amod']:
+        continue
+      result.append(token.text)
+  # TODO: consider drop stats related verbs: vary, correlate, compare, rank,
+  # have ...
+  return result
@@ -16,6 +16,8 @@ from nl_server.config import ModelConfig
 from nl_server.config import ModelType
 from nl_server.config import ModelUsage
 from nl_server.embeddings import EmbeddingsModel
+from nl_server.model.onnx_model import OnnxCrossEncoderModel
+from nl_server.model.onnx_model import OnnxSentenceTransformerModel
 from nl_server.model.sentence_transformer import LocalSentenceTransformerModel
 from nl_server.model.vertexai import VertexAIEmbeddingsModel
 from nl_server.model.vertexai import VertexAIRerankingModel
@@ -29,4 +31,9 @@ def create_embeddings_model(model_config: ModelConfig) -> EmbeddingsModel:
       return VertexAIRerankingModel(model_config)
   elif model_config.type == ModelType.LOCAL:
     return LocalSentenceTransformerModel(model_config)
+  elif model_config.type == ModelType.ONNX:
+    if model_config.usage == ModelUsage.EMBEDDINGS:
+      return OnnxSentenceTransformerModel(model_config)
+    elif model_config.usage == ModelUsage.RERANKING:
+      return OnnxCrossEncoderModel(model_config)
   raise ValueError(f'Unknown model type: {model_config.type}')
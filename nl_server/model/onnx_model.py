@@ -0,0 +1,265 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""ONNX Runtime models.
+
+A local sentence transformer (or cross encoder) is exported to ONNX on first
+load, optionally with dynamic int8 quantization of its weights, and then run
+with ONNX Runtime. The exported files are kept next to the downloaded model.
+
+On load, the outputs of the ONNX model are checked against the torch model on a
+few sample inputs, and loading fails if they differ by more than the configured
+tolerance.
+"""
+
+import logging
+import os
+from typing import Dict, List
+
+import numpy as np
+import onnxruntime as ort
+from onnxruntime.quantization import quantize_dynamic
+from onnxruntime.quantization import QuantType
+from sentence_transformers import CrossEncoder
+from sentence_transformers import SentenceTransformer
+import torch
+
+from nl_server import batcher
+from nl_server import embeddings
+from nl_server import ranking
+from nl_server.cache import get_cache_root
+from nl_server.config import OnnxModelConfig
+from shared.lib import gcs
+
+_ONNX_DIR = 'onnx'
+_OPSET_VERSION = 14
+# Default max (1 - cosine similarity) between torch and ONNX embeddings.
+_DEFAULT_EMBEDDINGS_TOLERANCE = 0.02
+# Default max absolute difference between torch and ONNX rerank scores.
+_DEFAULT_RERANKING_TOLERANCE = 0.05
+
+# Sample inputs to compare the torch and ONNX models on.
+_SAMPLE_QUERIES = [
+    'health',
+    'Life expectancy in California',
+    'what is the median income of households in counties of texas',
+    'number of people without health insurance',
+    'emissions',
+]
+_SAMPLE_SENTENCES = [
+    'life expectancy',
+    'median household income',
+    'uninsured population',
+    'greenhouse gas emissions',
+    'number of farms',
+]
+
+
+def _download(model_config: OnnxModelConfig) -> str:
+  return gcs.maybe_download(model_config.gcs_folder,
+                            get_cache_root(),
+                            use_anonymous_client=True)
+
+
+def _session_options(model_config: OnnxModelConfig) -> ort.SessionOptions:
+  options = ort.SessionOptions()
+  if model_config.intra_op_threads:
+    options.intra_op_num_threads = model_config.intra_op_threads
+  if model_config.inter_op_threads:
+    options.inter_op_num_threads = model_config.inter_op_threads
+  options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+  return options
+
+
+def _export(module: torch.nn.Module, sample_inputs: Dict[str, torch.Tensor],
+            output_name: str, model_dir: str, quantize: bool) -> str:
+  """Exports a module to ONNX (and quantizes it) unless already exported.
+
+  Returns:
+    The path of the ONNX model to run.
+  """
+  onnx_dir = os.path.join(model_dir, _ONNX_DIR)
+  os.makedirs(onnx_dir, exist_ok=True)
+  fp32_path = os.path.join(onnx_dir, 'model.onnx')
+  int8_path = os.path.join(onnx_dir, 'model.int8.onnx')
+  path = int8_path if quantize else fp32_path
+  if os.path.exists(path):
+    return path
+
+  # Exported to tmp files suffixed with the pid, since several server processes
+  # can load the same model at the same time.
+  tmp_suffix = '.{}.tmp'.format(os.getpid())
+  if not os.path.exists(fp32_path):
+    input_names = list(sample_inputs.keys())
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes[output_name] = {0: 'batch'}
+    torch.onnx.export(module,
+                      tuple(sample_inputs.values()),
+                      fp32_path + tmp_suffix,
+                      input_names=input_names,
+                      output_names=[output_name],
+                      dynamic_axes=dynamic_axes,
+                      opset_version=_OPSET_VERSION)
+    os.replace(fp32_path + tmp_suffix, fp32_path)
+    logging.info('Exported ONNX model to %s', fp32_path)
+  if quantize:
+    quantize_dynamic(fp32_path,
+                     int8_path + tmp_suffix,
+                     weight_type=QuantType.QInt8)
+    os.replace(int8_path + tmp_suffix, int8_path)
+    logging.info('Quantized ONNX model to %s', int8_path)
+  return path
+
+
+class _SentenceEmbedding(torch.nn.Module):
+  """Runs a sentence transformer on positional inputs, for export."""
+
+  def __init__(self, model: SentenceTransformer, input_names: List[str]):
+    super().__init__()
+    self.model = model
+    self.input_names = input_names
+
+  def forward(self, *inputs):
+    features = dict(zip(self.input_names, inputs))
+    return self.model(features)['sentence_embedding']
+
+
+class _Logits(torch.nn.Module):
+  """Runs a sequence classification model on positional inputs, for export."""
+
+  def __init__(self, model: torch.nn.Module, input_names: List[str]):
+    super().__init__()
+    self.model = model
+    self.input_names = input_names
+
+  def forward(self, *inputs):
+    features = dict(zip(self.input_names, inputs))
+    return self.model(**features, return_dict=True).logits
+
+
+class OnnxSentenceTransformerModel(embeddings.EmbeddingsModel):
+
+  def __init__(self, model_config: OnnxModelConfig, model_path: str = None):
+    super().__init__(model_config.score_threshold, returns_tensor=True)
+    model_path = model_path or _download(model_config)
+    model = SentenceTransformer(model_path, device='cpu')
+    model.eval()
+    self.tokenizer = model.tokenizer
+    self.max_length = model.max_seq_length
+    self.input_names = list(self._tokenize(_SAMPLE_QUERIES).keys())
+
+    sample_inputs = {
+        k: torch.from_numpy(v)
+        for k, v in self._tokenize(_SAMPLE_QUERIES).items()
+    }
+    path = _export(_SentenceEmbedding(model, self.input_names), sample_inputs,
+                   'sentence_embedding', model_path, model_config.quantize)
+    self.session = ort.InferenceSession(path,
+                                        _session_options(model_config),
+                                        providers=['CPUExecutionProvider'])
+
+    tolerance = model_config.tolerance
+    if tolerance is None:
+      tolerance = _DEFAULT_EMBEDDINGS_TOLERANCE
+    want = model.encode(_SAMPLE_QUERIES, convert_to_tensor=True)
+    got = torch.from_numpy(self._encode_batch(_SAMPLE_QUERIES))
+    diff = float(
+        (1 - torch.nn.functional.cosine_similarity(want, got, dim=1)).max())
+    if diff > tolerance:
+      raise ValueError(
+          f'ONNX embeddings of {path} differ from the torch model by {diff} '
+          f'(tolerance {tolerance})')
+    logging.info('Loaded ONNX model %s (max 1 - cosine vs torch: %.5f)', path,
+                 diff)
+
+    # Combines the queries of concurrent requests into one forward pass.
+    self.batcher = batcher.create_from_env(self._encode_batch)
+
+  def _tokenize(self, texts: List[str]) -> Dict[str, np.ndarray]:
+    tokens = self.tokenizer(texts,
+                            padding=True,
+                            truncation='longest_first',
+                            max_length=self.max_length,
+                            return_tensors='np')
+    return {k: v.astype(np.int64) for k, v in tokens.items()}
+
+  def _encode_batch(self, queries: List[str]) -> np.ndarray:
+    if not queries:
+      return np.zeros((0, 0), dtype=np.float32)
+    inputs = self._tokenize(queries)
+    return self.session.run(None, {k: inputs[k] for k in self.input_names})[0]
+
+  def encode(self, queries: List[str], show_progress_bar=False) -> torch.Tensor:
+    if show_progress_bar:
+      # Offline encoding of large lists, which does not need batching.
+      return torch.from_numpy(self._encode_batch(queries))
+    return torch.from_numpy(self.batcher(queries))
+
+
+class OnnxCrossEncoderModel(ranking.RerankingModel):
+
+  def __init__(self, model_config: OnnxModelConfig, model_path: str = None):
+    model_path = model_path or _download(model_config)
+    model = CrossEncoder(model_path, device='cpu')
+    model.model.eval()
+    self.tokenizer = model.tokenizer
+    self.max_length = model.max_length
+    self.activation = model.default_activation_function
+    sample_pairs = [[q, s] for q, s in zip(_SAMPLE_QUERIES, _SAMPLE_SENTENCES)]
+    self.input_names = list(self._tokenize(sample_pairs).keys())
+
+    sample_inputs = {
+        k: torch.from_numpy(v) for k, v in self._tokenize(sample_pairs).items()
+    }
+    path = _export(_Logits(model.model, self.input_names), sample_inputs,
+                   'logits', model_path, model_config.quantize)
+    self.session = ort.InferenceSession(path,
+                                        _session_options(model_config),
+                                        providers=['CPUExecutionProvider'])
+
+    tolerance = model_config.tolerance
+    if tolerance is None:
+      tolerance = _DEFAULT_RERANKING_TOLERANCE
+    want = np.asarray(model.predict(sample_pairs, show_progress_bar=False))
+    got = np.asarray(self._predict_batch(sample_pairs))
+    diff = float(np.abs(want - got).max())
+    if diff > tolerance:
+      raise ValueError(
+          f'ONNX scores of {path} differ from the torch model by {diff} '
+          f'(tolerance {tolerance})')
+    logging.info('Loaded ONNX model %s (max score diff vs torch: %.5f)', path,
+                 diff)
+
+    # Combines the pairs of concurrent requests into one forward pass.
+    self.batcher = batcher.create_from_env(self._predict_batch)
+
+  def _tokenize(self, pairs: List[List[str]]) -> Dict[str, np.ndarray]:
+    tokens = self.tokenizer([p[0] for p in pairs], [p[1] for p in pairs],
+                            padding=True,
+                            truncation='longest_first',
+                            max_length=self.max_length,
+                            return_tensors='np')
+    return {k: v.astype(np.int64) for k, v in tokens.items()}
+
+  def _predict_batch(self, pairs: List[List[str]]) -> List[float]:
+    if not pairs:
+      return []
+    inputs = self._tokenize(pairs)
+    logits = self.session.run(None, {k: inputs[k] for k in self.input_names})[0]
+    scores = self.activation(torch.from_numpy(logits))
+    if scores.shape[1] == 1:
+      return scores[:, 0].tolist()
+    return scores.tolist()
+
+  def predict(self, query_sentence_pairs: List[tuple[str, str]]) -> List[float]:
+    return self.batcher(query_sentence_pairs)
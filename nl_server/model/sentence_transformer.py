@@ -18,7 +18,9 @@ from typing import List
 from sentence_transformers import SentenceTransformer
 import torch
 
+from nl_server import batcher
 from nl_server import embeddings
+from nl_server import shared_memory
 from nl_server.cache import get_cache_root
 from nl_server.config import LocalModelConfig
 from shared.lib import gcs
@@ -34,6 +36,14 @@ class LocalSentenceTransformerModel(embeddings.EmbeddingsModel):
                                     get_cache_root(),
                                     use_anonymous_client=True)
     self.model = SentenceTransformer(model_path)
+    if shared_memory.enabled():
+      shared_memory.share_weights(
+          self.model, f'model_{shared_memory.source_key(model_path)}')
+    # Combines the queries of concurrent requests into one forward pass.
+    self.batcher = batcher.create_from_env(self.model.encode)
 
   def encode(self, queries: List[str], show_progress_bar=False) -> torch.Tensor:
-    return self.model.encode(queries, show_progress_bar=show_progress_bar)
+    if show_progress_bar:
+      # Offline encoding of large lists, which does not need batching.
+      return self.model.encode(queries, show_progress_bar=show_progress_bar)
+    return self.batcher(queries)
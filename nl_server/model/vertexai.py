@@ -17,6 +17,7 @@ from typing import List
 
 from google.cloud import aiplatform
 
+from nl_server import batcher
 from nl_server import embeddings
 from nl_server import ranking
 from nl_server.config import VertexAIModelConfig
@@ -36,8 +37,14 @@ class VertexAIRerankingModel(ranking.RerankingModel):
 
   def __init__(self, model_config: VertexAIModelConfig):
     self.prediction_client = _init_client(model_config)
+    # Combines the pairs of concurrent requests into one prediction call.
+    self.batcher = batcher.create_from_env(self._predict_batch)
 
   def predict(self, query_sentence_pairs: List[tuple[str, str]]) -> List[float]:
+    return self.batcher(query_sentence_pairs)
+
+  def _predict_batch(
+      self, query_sentence_pairs: List[tuple[str, str]]) -> List[float]:
     return self.prediction_client.predict(
         instances=query_sentence_pairs).predictions
 
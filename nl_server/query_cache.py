@@ -0,0 +1,176 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""LRU cache of per model query results, with an optional on-disk tier.
+
+The caches of query embeddings (embeddings_cache.py) and of reranking scores
+(rerank_cache.py) are subclasses that only define their keys and values, and
+how they are stored on disk.
+"""
+
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Hashable, List
+
+
+def normalize_query(query: str) -> str:
+  """Normalizes a query for cache lookups by collapsing whitespace."""
+  return ' '.join(query.split())
+
+
+def model_key(model_name: str, model_config: Any) -> str:
+  """Gets the name that the entries of a model are cached under: the model name
+  and a hash of its config, so that entries on disk are not used after a
+  restart with a changed config (eg. gcs_folder) under the same model name.
+  """
+  fingerprint = hashlib.sha256(repr(model_config).encode()).hexdigest()[:16]
+  return f'{model_name}:{fingerprint}'
+
+
+class QueryCache:
+  """LRU cache of values keyed by (model name, key), with an optional on-disk
+  tier in a sqlite file.
+  """
+
+  # Set by subclasses.
+  # Default max number of entries to keep in memory.
+  DEFAULT_MAX_SIZE: int = 0
+  # Env var to override the max number of entries kept in memory.
+  MAX_SIZE_ENV: str = ''
+  # Env var with a folder to keep entries on disk across restarts.
+  DISK_DIR_ENV: str = ''
+  # Name of the sqlite file in that folder.
+  DISK_FILE: str = ''
+
+  def __init__(self, max_size: int = None, disk_dir: str = ''):
+    self._max_size = self.DEFAULT_MAX_SIZE if max_size is None else max_size
+    self._disk_dir = disk_dir
+    # (model name, key) -> value, least recently used first.
+    self._entries: OrderedDict[tuple[str, Hashable], Any] = OrderedDict()
+    self._lock = threading.Lock()
+    self._db = None
+    if disk_dir:
+      os.makedirs(disk_dir, exist_ok=True)
+      self._db = sqlite3.connect(os.path.join(disk_dir, self.DISK_FILE),
+                                 check_same_thread=False)
+      self._db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                       'model TEXT, key TEXT, value BLOB, '
+                       'PRIMARY KEY (model, key))')
+      self._db.commit()
+    self.hits = 0
+    self.disk_hits = 0
+    self.misses = 0
+
+  @classmethod
+  def from_env(cls) -> 'QueryCache':
+    """Creates a cache configured by the MAX_SIZE_ENV and DISK_DIR_ENV env
+    vars."""
+    return cls(max_size=int(
+        os.environ.get(cls.MAX_SIZE_ENV, cls.DEFAULT_MAX_SIZE)),
+               disk_dir=os.environ.get(cls.DISK_DIR_ENV, ''))
+
+  def carry_over(self, model_names: List[str]) -> 'QueryCache':
+    """Creates a cache with the same configuration and the entries of
+    model_names, for a registry that replaces the one using this cache.
+
+    The entries of other models (eg. removed, or with a changed config) are
+    also deleted from the disk tier.
+    """
+    cache = type(self)(max_size=self._max_size, disk_dir=self._disk_dir)
+    kept = set(model_names)
+    with self._lock:
+      cache._entries = OrderedDict(
+          (k, v) for k, v in self._entries.items() if k[0] in kept)
+    if cache._db:
+      try:
+        cache._db.execute(
+            'DELETE FROM entries WHERE model NOT IN '
+            f'({",".join("?" * len(kept))})', list(kept))
+        cache._db.commit()
+      except sqlite3.Error as e:
+        logging.warning('Could not delete from %s: %s', self.DISK_FILE, e)
+    return cache
+
+  def _disk_key(self, key: Hashable) -> str:
+    """Converts a key to the text stored on disk."""
+    return key
+
+  def _disk_value(self, value: Any) -> Any:
+    """Converts a value to what is stored on disk."""
+    return value
+
+  def _from_disk_value(self, value: Any) -> Any:
+    """Converts a value stored on disk back to a value."""
+    return value
+
+  def get(self, model_name: str, keys: List[Hashable]) -> Dict[Hashable, Any]:
+    """Gets the cached values of keys, keyed by key."""
+    result = {}
+    with self._lock:
+      for key in keys:
+        entry_key = (model_name, key)
+        if entry_key in self._entries:
+          self._entries.move_to_end(entry_key)
+          result[key] = self._entries[entry_key]
+      self.hits += len(result)
+      missing = [k for k in keys if k not in result]
+      if self._db and missing:
+        for key in missing:
+          row = self._db.execute(
+              'SELECT value FROM entries WHERE model = ? AND key = ?',
+              (model_name, self._disk_key(key))).fetchone()
+          if row:
+            value = self._from_disk_value(row[0])
+            result[key] = value
+            self._put_in_memory(model_name, key, value)
+            self.disk_hits += 1
+      self.misses += len(keys) - len(result)
+    return result
+
+  def put(self, model_name: str, key2value: Dict[Hashable, Any]):
+    """Adds the values of keys to the cache."""
+    with self._lock:
+      for key, value in key2value.items():
+        self._put_in_memory(model_name, key, value)
+      if self._db and key2value:
+        try:
+          self._db.executemany(
+              'INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+              [(model_name, self._disk_key(k), self._disk_value(v))
+               for k, v in key2value.items()])
+          self._db.commit()
+        except sqlite3.Error as e:
+          logging.warning('Could not write to %s: %s', self.DISK_FILE, e)
+
+  def _put_in_memory(self, model_name: str, key: Hashable, value: Any):
+    entry_key = (model_name, key)
+    self._entries[entry_key] = value
+    self._entries.move_to_end(entry_key)
+    while len(self._entries) > self._max_size:
+      self._entries.popitem(last=False)
+
+  def stats(self) -> Dict:
+    with self._lock:
+      lookups = self.hits + self.disk_hits + self.misses
+      return {
+          'size': len(self._entries),
+          'maxSize': self._max_size,
+          'hits': self.hits,
+          'diskHits': self.disk_hits,
+          'misses': self.misses,
+          'hitRate': (self.hits + self.disk_hits) / lookups if lookups else 0,
+      }
@@ -12,10 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 import logging
-from typing import Dict
+import os
+import threading
+import time
+from typing import Callable, Dict
 
 from nl_server import config_reader
+from nl_server import embeddings_cache
+from nl_server import query_cache
+from nl_server import rerank_cache
 from nl_server.config import IndexConfig
 from nl_server.config import ModelConfig
 from nl_server.config import ModelUsage
@@ -23,6 +31,7 @@ from nl_server.config import ServerConfig
 from nl_server.config import StoreType
 from nl_server.embeddings import Embeddings
 from nl_server.embeddings import EmbeddingsModel
+from nl_server.embeddings import EmbeddingsStore
 from nl_server.model.attribute_model import AttributeModel
 from nl_server.model.create import create_embeddings_model
 from nl_server.ranking import RerankingModel
@@ -31,6 +40,36 @@ from nl_server.store.vertexai import VertexAIStore
 from shared.lib.custom_dc_util import is_custom_dc
 
 REGISTRY_KEY: str = 'REGISTRY'
+RELOADER_KEY: str = 'REGISTRY_RELOADER'
+
+# Max number of models and indexes to load at the same time.
+_DEFAULT_LOAD_WORKERS = 4
+_LOAD_WORKERS_ENV = 'NL_REGISTRY_LOAD_WORKERS'
+# Env var to load the enabled indexes that are not default indexes at startup
+# (when "false") instead of on their first use.
+_LAZY_INDEXES_ENV = 'NL_LAZY_INDEXES'
+
+
+def _load_workers() -> int:
+  return int(os.environ.get(_LOAD_WORKERS_ENV, _DEFAULT_LOAD_WORKERS))
+
+
+def _lazy_indexes() -> bool:
+  return os.environ.get(_LAZY_INDEXES_ENV, 'true').lower() != 'false'
+
+
+def _unwrap(model: EmbeddingsModel | RerankingModel):
+  if isinstance(model, (embeddings_cache.CachedEmbeddingsModel,
+                        rerank_cache.CachedRerankingModel)):
+    return model.model
+  return model
+
+
+def _can_reuse(previous: 'Registry', model_name: str,
+               model_config: ModelConfig) -> bool:
+  """Whether the model of a previous registry can be reused."""
+  return bool(previous and model_name in previous.name_to_model and
+              previous.server_config().models.get(model_name) == model_config)
 
 
 class Registry:
@@ -38,15 +77,51 @@ class Registry:
   A class to hold runtime model handle/client objects and embeddings stores.
   """
 
-  def __init__(self, server_config: ServerConfig):
+  def __init__(self, server_config: ServerConfig, previous: 'Registry' = None):
+    """
+    Args:
+      server_config: the config of the models and indexes to load.
+      previous: a registry being replaced, whose models are reused when their
+        config did not change. Indexes are always reloaded, since their data
+        can change with the same config.
+    """
     self.name_to_emb: dict[str, Embeddings] = {}
     self.name_to_model: Dict[str, EmbeddingsModel | RerankingModel] = {}
-    self._attribute_model = AttributeModel()
-    self.load(server_config)
+    # Seconds taken to load each component, keyed by "model:<name>",
+    # "index:<name>" and "attribute_model".
+    self.load_seconds: Dict[str, float] = {}
+    # Guards the loading of indexes on first use.
+    self._index_locks: Dict[str, threading.Lock] = {}
+    self._index_locks_lock = threading.Lock()
+    # Caches of query embeddings shared by all the embeddings models, and of
+    # (query, sentence) scores shared by all the reranking models.
+    if previous:
+      # Only the entries of the models that are reused are still valid.
+      reused = [
+          query_cache.model_key(name, config)
+          for name, config in server_config.models.items()
+          if _can_reuse(previous, name, config)
+      ]
+      self.embeddings_cache = previous.embeddings_cache.carry_over(reused)
+      self.rerank_cache = previous.rerank_cache.carry_over(reused)
+      self._attribute_model = previous._attribute_model
+      self.load(server_config, previous=previous)
+    else:
+      self.embeddings_cache = embeddings_cache.create_from_env()
+      self.rerank_cache = rerank_cache.create_from_env()
+      self._attribute_model = None
+      self.load(server_config, load_attribute_model=True)
 
   # Note: The caller takes care of exceptions.
   # TODO: consider consistent naming among index and embedding.
   def get_index(self, index_type: str) -> Embeddings:
+    emb = self.name_to_emb.get(index_type)
+    if emb or index_type not in self._server_config.indexes:
+      return emb
+    # An enabled index that is loaded on first use.
+    with self._index_lock(index_type):
+      if index_type not in self.name_to_emb:
+        self._load_index(index_type, self._server_config.indexes[index_type])
     return self.name_to_emb.get(index_type)
 
   def get_reranking_model(self, model_name: str) -> RerankingModel:
@@ -64,37 +139,126 @@ class Registry:
       raise ValueError(f'Invalid model name: {model_name}')
     return self.name_to_model.get(model_name)
 
+  def batching_stats(self) -> Dict[str, Dict]:
+    """Gets the micro-batching stats of each model that batches its calls."""
+    result = {}
+    for model_name, model in self.name_to_model.items():
+      model_batcher = getattr(_unwrap(model), 'batcher', None)
+      if model_batcher:
+        result[model_name] = model_batcher.stats()
+    return result
+
+  def load_stats(self) -> Dict:
+    """Gets the load time of each component and the indexes not loaded yet."""
+    return {
+        'loadSeconds':
+            dict(self.load_seconds),
+        'notLoadedIndexes': [
+            idx for idx in self._server_config.indexes
+            if idx not in self.name_to_emb
+        ],
+    }
+
   def server_config(self) -> ServerConfig:
     return self._server_config
 
   # Load the registry from the server config
-  def load(self, server_config: ServerConfig):
+  def load(self,
+           server_config: ServerConfig,
+           previous: 'Registry' = None,
+           load_attribute_model: bool = False):
+    """Loads the models and indexes of a server config.
+
+    Models and default indexes are loaded concurrently. Unless disabled by the
+    NL_LAZY_INDEXES env var, the other enabled indexes are loaded on first use.
+    """
     self._server_config = server_config
-    self._load_models(server_config.models)
+    models = {
+        name: config
+        for name, config in server_config.models.items()
+        if name not in self.name_to_model
+    }
+    lazy = _lazy_indexes()
+    indexes = {}
     for idx_name, idx_info in server_config.indexes.items():
-      self._set_embeddings(idx_name, idx_info)
-
-  # Loads a dict of model name -> model info
-  def _load_models(self, models: dict[str, ModelConfig]):
-    for model_name, model_config in models.items():
-      # if model has already been loaded, continue
-      if model_name in self.name_to_model:
-        continue
-
-      # try creating a model object from the model info
-      try:
-        self.name_to_model[model_name] = create_embeddings_model(model_config)
-      except Exception as e:
-        logging.error(f'error loading model {model_name}: {str(e)} ')
-        raise e
+      # Indexes are reloaded since their data can change with the same config.
+      self.name_to_emb.pop(idx_name, None)
+      if not lazy or idx_name in server_config.default_indexes:
+        indexes[idx_name] = idx_info
 
-  # Sets an index to the name_to_emb
-  def _set_embeddings(self, idx_name: str, idx_info: IndexConfig):
-    # try creating a store object from the index info
-    store = None
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=_load_workers(),
+                            thread_name_prefix='registry_load') as executor:
+      model_futures = {
+          name:
+              executor.submit(self._timed, f'model:{name}', self._create_model,
+                              name, config, previous)
+          for name, config in models.items()
+      }
+      store_futures = {
+          name:
+              executor.submit(self._timed, f'index:{name}', self._create_store,
+                              name, config) for name, config in indexes.items()
+      }
+      attribute_model_future = None
+      if load_attribute_model:
+        attribute_model_future = executor.submit(self._timed, 'attribute_model',
+                                                 AttributeModel)
+      for name, future in model_futures.items():
+        self.name_to_model[name] = future.result()
+      for name, future in store_futures.items():
+        self._set_embeddings(name, indexes[name], future.result())
+      if attribute_model_future:
+        self._attribute_model = attribute_model_future.result()
+    logging.info('Loaded %d models and %d indexes in %.2f seconds: %s',
+                 len(models), len(indexes),
+                 time.time() - start, self.load_seconds)
+
+  def _timed(self, component: str, fn: Callable, *args):
+    start = time.time()
+    result = fn(*args)
+    self.load_seconds[component] = round(time.time() - start, 3)
+    logging.info('Loaded %s in %.2f seconds', component,
+                 self.load_seconds[component])
+    return result
+
+  def _index_lock(self, idx_name: str) -> threading.Lock:
+    with self._index_locks_lock:
+      return self._index_locks.setdefault(idx_name, threading.Lock())
+
+  def _load_index(self, idx_name: str, idx_info: IndexConfig):
+    store = self._timed(f'index:{idx_name}', self._create_store, idx_name,
+                        idx_info)
+    self._set_embeddings(idx_name, idx_info, store)
+
+  # Creates a model object from the model info
+  def _create_model(self,
+                    model_name: str,
+                    model_config: ModelConfig,
+                    previous: 'Registry' = None):
+    try:
+      if _can_reuse(previous, model_name, model_config):
+        model = _unwrap(previous.name_to_model[model_name])
+      else:
+        model = create_embeddings_model(model_config)
+      cache_key = query_cache.model_key(model_name, model_config)
+      if model_config.usage == ModelUsage.EMBEDDINGS:
+        model = embeddings_cache.CachedEmbeddingsModel(model, cache_key,
+                                                       self.embeddings_cache)
+      elif model_config.usage == ModelUsage.RERANKING:
+        model = rerank_cache.CachedRerankingModel(model, cache_key,
+                                                  self.rerank_cache)
+      return model
+    except Exception as e:
+      logging.error(f'error loading model {model_name}: {str(e)} ')
+      raise e
+
+  # Creates a store object from the index info
+  def _create_store(self, idx_name: str,
+                    idx_info: IndexConfig) -> EmbeddingsStore:
     try:
       if idx_info.store_type == StoreType.MEMORY:
-        store = MemoryEmbeddingsStore(idx_info)
+        return MemoryEmbeddingsStore(idx_info)
       elif idx_info.store_type == StoreType.LANCEDB:
         # Lance DB's X86_64 lib doesn't run on MacOS Silicon, and
         # this causes trouble for NL Server in Custom DC docker
@@ -102,24 +266,31 @@ class Registry:
         # TODO: Drop this once Custom DC docker is fixed.
         if not is_custom_dc():
           from nl_server.store.lancedb import LanceDBStore
-          store = LanceDBStore(idx_info)
+          return LanceDBStore(idx_info)
         else:
           logging.info('Not loading LanceDB in Custom DC environment!')
-          return
       elif idx_info.store_type == StoreType.VERTEXAI:
-        store = VertexAIStore(idx_info)
+        return VertexAIStore(idx_info)
     except Exception as e:
       logging.error(f'error loading index {idx_name}: {str(e)} ')
       raise e
+    return None
 
+  # Sets an index to the name_to_emb
+  def _set_embeddings(self, idx_name: str, idx_info: IndexConfig,
+                      store: EmbeddingsStore):
     # if store successfully created, set it in name_to_emb
     if store and idx_info.model in self.name_to_model:
       self.name_to_emb[idx_name] = Embeddings(
-          model=self.name_to_model[idx_info.model], store=store)
+          model=self.name_to_model[idx_info.model],
+          store=store,
+          index_name=idx_name,
+          model_name=idx_info.model)
 
 
 def build(additional_catalog: dict = None,
-          additional_catalog_path: str = None) -> Registry:
+          additional_catalog_path: str = None,
+          previous: Registry = None) -> Registry:
   """
   Build the registry based on available catalog and environment config files.
   This also get all the model/index resources downloaded and ready to use.
@@ -127,10 +298,64 @@ def build(additional_catalog: dict = None,
   Args:
     additional_catalog: additional catalog config to be merged with the default
     catalog.
+    previous: a registry being replaced, whose unchanged models are reused.
   """
   catalog = config_reader.read_catalog(
       catalog_dict=additional_catalog,
       additional_catalog_path=additional_catalog_path)
   env = config_reader.read_env()
   server_config = config_reader.get_server_config(catalog, env)
-  return Registry(server_config)
+  return Registry(server_config, previous=previous)
+
+
+class Reloader:
+  """Builds a new registry in the background and swaps it in when ready.
+
+  Requests keep being served by the current registry while the new one loads,
+  and each request reads the registry once, so it never sees a half replaced
+  config. Reloads run one at a time, in the order they are requested.
+  """
+
+  def __init__(self):
+    self._executor = ThreadPoolExecutor(max_workers=1,
+                                        thread_name_prefix='registry_reload')
+    self._lock = threading.Lock()
+    self._status = {'state': 'idle'}
+
+  def reload(self,
+             app_config: Dict,
+             additional_catalog_path: str = None) -> Future:
+    """Schedules a reload into app_config[REGISTRY_KEY].
+
+    Returns:
+      A future with the new registry.
+    """
+    with self._lock:
+      self._status = {'state': 'pending'}
+    return self._executor.submit(self._reload, app_config,
+                                 additional_catalog_path)
+
+  def _reload(self, app_config: Dict, additional_catalog_path: str):
+    start = time.time()
+    with self._lock:
+      self._status = {'state': 'loading'}
+    try:
+      new_registry = build(additional_catalog_path=additional_catalog_path,
+                           previous=app_config.get(REGISTRY_KEY))
+    except Exception as e:
+      logging.error(f'Server registry not built due to error: {str(e)}')
+      with self._lock:
+        self._status = {'state': 'failed', 'error': str(e)}
+      raise e
+    # A single assignment, so requests see either the old or the new registry.
+    app_config[REGISTRY_KEY] = new_registry
+    with self._lock:
+      self._status = {
+          'state': 'done',
+          'seconds': round(time.time() - start, 3),
+      }
+    return new_registry
+
+  def status(self) -> Dict:
+    with self._lock:
+      return dict(self._status)
@@ -12,8 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import time
 from typing import Callable, Dict, List
 
+from nl_server import metrics
 from nl_server.ranking import RerankingModel
 import shared.lib.detected_variables as vars
 
@@ -21,10 +24,31 @@ import shared.lib.detected_variables as vars
 # a corresponding list of scores.
 RerankCallable = Callable[[List[tuple[str, str]]], List[float]]
 
+# Number of top SVs of each query to rerank. The other SVs keep their order,
+# after the reranked SVs.
+MAX_CANDIDATES = int(os.environ.get('NL_RERANK_MAX_CANDIDATES', 20))
+# Number of top sentences of each SV to rerank.
+MAX_SENTENCES = int(os.environ.get('NL_RERANK_MAX_SENTENCES', 5))
+
 
 def rerank(rerank_model: RerankingModel,
            query2candidates: Dict[str, vars.VarCandidates],
-           debug_logs: Dict) -> Dict[str, vars.VarCandidates]:
+           debug_logs: Dict,
+           max_candidates: int = MAX_CANDIDATES,
+           max_sentences: int = MAX_SENTENCES,
+           timings: Dict[str, float] = None) -> Dict[str, vars.VarCandidates]:
+  # The reranking model name (of models loaded by the registry) labels the
+  # latency metrics.
+  model_name = getattr(rerank_model, 'model_name', '')
+  with metrics.timer('rerank', model_name, timings):
+    return _rerank(rerank_model, model_name, query2candidates, debug_logs,
+                   max_candidates, max_sentences, timings)
+
+
+def _rerank(rerank_model: RerankingModel, model_name: str,
+            query2candidates: Dict[str, vars.VarCandidates], debug_logs: Dict,
+            max_candidates: int, max_sentences: int,
+            timings: Dict[str, float]) -> Dict[str, vars.VarCandidates]:
   # 1. Prepare indexes and inputs
 
   # List of query-sentence pairs.
@@ -33,14 +57,18 @@ def rerank(rerank_model: RerankingModel,
   query2sentence2idx: Dict[str, Dict[str, int]] = {}
   for query, var_candidates in query2candidates.items():
     sentence2idx = query2sentence2idx.setdefault(query, {})
-    for idx, sv in enumerate(var_candidates.svs):
-      for s in var_candidates.sv2sentences.get(sv, []):
+    for idx, sv in enumerate(var_candidates.svs[:max_candidates]):
+      for s in var_candidates.sv2sentences.get(sv, [])[:max_sentences]:
         if s.sentence not in sentence2idx:
           sentence2idx[s.sentence] = idx
         qs_pairs.append([query, s.sentence])
 
   # 2. Perform the re-ranking
-  scores = rerank_model.predict(qs_pairs)
+  start = time.time()
+  with metrics.timer('rerank_predict', model_name, timings):
+    scores = rerank_model.predict(qs_pairs)
+  debug_logs['reranking_num_pairs'] = len(qs_pairs)
+  debug_logs['time_rerank_predict'] = time.time() - start
 
   # 3. Group Sentence-Score pairs by query.
   query2sentence2score: Dict[str, Dict[str, float]] = {}
@@ -49,7 +77,8 @@ def rerank(rerank_model: RerankingModel,
 
   # TODO: Consider factoring this into a different function
   query2rerankedcandidates: Dict[str, vars.VarCandidates] = {}
-  for query, sentence2score in query2sentence2score.items():
+  for query, var_candidates in query2candidates.items():
+    sentence2score = query2sentence2score.get(query, {})
     # 4. Per query, sort the Sentence-Score pairs based on scores.
     reranked_ss_pairs = sorted(sentence2score.items(),
                                key=lambda ss: ss[1],
@@ -64,7 +93,6 @@ def rerank(rerank_model: RerankingModel,
 
     added_idxs = set()
     sentence2idx = query2sentence2idx[query]
-    var_candidates = query2candidates[query]
     for sentence, _ in reranked_ss_pairs:
       idx = sentence2idx[sentence]
       if idx in added_idxs:
@@ -80,11 +108,23 @@ def rerank(rerank_model: RerankingModel,
         sentences_with_rerank_score.append(
             vars.SentenceScore(sentence=s.sentence,
                                score=s.score,
-                               rerank_score=sentence2score[s.sentence]))
-      sentences_with_rerank_score.sort(key=lambda s: s.rerank_score,
-                                       reverse=True)
+                               rerank_score=sentence2score.get(s.sentence)))
+      # Sentences that were not reranked go last.
+      sentences_with_rerank_score.sort(
+          key=lambda s: s.rerank_score
+          if s.rerank_score is not None else float('-inf'),
+          reverse=True)
       reranked_var_candidates.sv2sentences[sv] = sentences_with_rerank_score
 
+    # 6. Add the SVs that were not reranked, in their original order.
+    for idx, sv in enumerate(var_candidates.svs):
+      if idx in added_idxs:
+        continue
+      reranked_var_candidates.svs.append(sv)
+      reranked_var_candidates.scores.append(var_candidates.scores[idx])
+      reranked_var_candidates.sv2sentences[
+          sv] = var_candidates.sv2sentences.get(sv, [])
+
     query_log = debug_logs.setdefault("reranking", {}).setdefault(query, {})
     query_log['pre_reranking'] = var_candidates.svs
     query_log['post_reranking'] = reranked_var_candidates.svs
@@ -0,0 +1,69 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Cache of reranking scores of (query, sentence) pairs."""
+
+import json
+from typing import List
+
+from nl_server.query_cache import normalize_query
+from nl_server.query_cache import QueryCache
+from nl_server.ranking import RerankingModel
+
+# (query, sentence)
+Pair = tuple[str, str]
+
+
+class RerankScoreCache(QueryCache):
+  """LRU cache of pair scores keyed by (model name, (query, sentence)), with an
+  optional on-disk tier.
+  """
+
+  DEFAULT_MAX_SIZE = 100000
+  MAX_SIZE_ENV = 'NL_RERANK_CACHE_SIZE'
+  DISK_DIR_ENV = 'NL_RERANK_CACHE_DIR'
+  DISK_FILE = 'rerank_scores.sqlite'
+
+  def _disk_key(self, key: Pair) -> str:
+    return json.dumps(key)
+
+
+def create_from_env() -> RerankScoreCache:
+  """Creates a cache configured by the NL_RERANK_CACHE_* env vars."""
+  return RerankScoreCache.from_env()
+
+
+class CachedRerankingModel(RerankingModel):
+  """Wraps a RerankingModel to only score pairs that are not cached.
+
+  The pairs that are not cached are scored in one call, which the micro-batcher
+  of the model combines with concurrent calls (see batcher.py).
+  """
+
+  def __init__(self, model: RerankingModel, model_name: str,
+               cache: RerankScoreCache):
+    self.model = model
+    self.model_name = model_name
+    self.cache = cache
+
+  def predict(self, query_sentence_pairs: List[Pair]) -> List[float]:
+    keys = [(normalize_query(q), s) for q, s in query_sentence_pairs]
+    unique_keys = list(dict.fromkeys(keys))
+    cached = self.cache.get(self.model_name, unique_keys)
+    missing = [k for k in unique_keys if k not in cached]
+    if missing:
+      scores = self.model.predict([list(k) for k in missing])
+      new_scores = {k: float(s) for k, s in zip(missing, scores)}
+      self.cache.put(self.model_name, new_scores)
+      cached.update(new_scores)
+    return [cached[k] for k in keys]
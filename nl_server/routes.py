@@ -15,6 +15,7 @@
 from dataclasses import asdict
 import json
 import logging
+import os
 from typing import List
 
 from flask import Blueprint
@@ -22,8 +23,10 @@ from flask import current_app
 from flask import request
 from markupsafe import escape
 
+from nl_server import metrics
 from nl_server import registry
 from nl_server import search
+from nl_server import shared_memory
 from nl_server.embeddings import Embeddings
 from nl_server.registry import Registry
 from nl_server.registry import REGISTRY_KEY
@@ -81,6 +84,11 @@ def search_vars():
   if request.args.get('skip_topics'):
     skip_topics = True
 
+  # By default, queries with exact matches are not vector searched.
+  fill_exact_matches = bool(request.args.get('fill_exact_matches'))
+  # Whether to return the latency of each stage in the debug logs.
+  timing = bool(request.args.get('timing'))
+
   reg: Registry = current_app.config[REGISTRY_KEY]
 
   reranker_name = str(escape(request.args.get('reranker', '')))
@@ -100,8 +108,16 @@ def search_vars():
   embeddings = _get_indexes(reg, idx_types)
 
   debug_logs = {'sv_detection_query_index_types': idx_types}
-  results = search.search_vars(embeddings, queries, skip_topics, reranker_model,
-                               debug_logs)
+  timings = {} if timing else None
+  results = search.search_vars(embeddings,
+                               queries,
+                               skip_topics,
+                               reranker_model,
+                               debug_logs,
+                               fill_exact_matches=fill_exact_matches,
+                               timings=timings)
+  if timing:
+    debug_logs['time_stages_ms'] = timings
   q2result = {q: var_candidates_to_dict(result) for q, result in results.items()}
   return json.dumps({
       'queryResults': q2result,
@@ -121,6 +137,19 @@ def detect_verbs():
   return json.dumps(reg.get_attribute_model().detect_verbs(query.strip()))
 
 
+@bp.route('/api/detect_verbs/', methods=['POST'])
+def detect_verbs_batch():
+  """Returns the tokens detected as verbs for each input query.
+
+  Dict[str, List[str]]
+  """
+  queries = request.json.get('queries', [])
+  queries = [str(escape(q)).strip() for q in queries]
+  reg: Registry = current_app.config[REGISTRY_KEY]
+  verbs = reg.get_attribute_model().detect_verbs_batch(queries)
+  return json.dumps(dict(zip(queries, verbs)))
+
+
 @bp.route('/api/server_config/', methods=['GET'])
 def embeddings_version_map():
   reg: Registry = current_app.config[REGISTRY_KEY]
@@ -128,19 +157,71 @@ def embeddings_version_map():
   return json.dumps(asdict(server_config))
 
 
+@bp.route('/api/embeddings_cache_stats/', methods=['GET'])
+def embeddings_cache_stats():
+  """Returns the size and hit counters of the query embeddings cache."""
+  reg: Registry = current_app.config[REGISTRY_KEY]
+  return json.dumps(reg.embeddings_cache.stats())
+
+
+@bp.route('/api/rerank_cache_stats/', methods=['GET'])
+def rerank_cache_stats():
+  """Returns the size and hit counters of the rerank score cache."""
+  reg: Registry = current_app.config[REGISTRY_KEY]
+  return json.dumps(reg.rerank_cache.stats())
+
+
+@bp.route('/api/batching_stats/', methods=['GET'])
+def batching_stats():
+  """Returns the batch size and queueing delay distributions of each model
+  that batches concurrent requests."""
+  reg: Registry = current_app.config[REGISTRY_KEY]
+  return json.dumps(reg.batching_stats())
+
+
+@bp.route('/api/memory_stats/', methods=['GET'])
+def memory_stats():
+  """Returns the memory usage (in kB) of the worker serving the request."""
+  return json.dumps({'pid': os.getpid(), **shared_memory.memory_stats()})
+
+
+@bp.route('/api/metrics/', methods=['GET'])
+def stage_metrics():
+  """Returns the latency histogram (in ms) of each stage of serving requests,
+  keyed by stage and then by model or index name."""
+  return json.dumps(metrics.stats())
+
+
 @bp.route('/api/load/', methods=['POST'])
 def load():
+  """Reloads the registry in the background.
+
+  Requests are served by the current registry until the new one is loaded. With
+  "wait" set in the request, returns the new server config once loaded.
+  """
   additional_catalog_path = request.json.get('additional_catalog_path', None)
+  reloader: registry.Reloader = current_app.config[registry.RELOADER_KEY]
+  future = reloader.reload(current_app.config, additional_catalog_path)
+  if not request.json.get('wait', False):
+    return json.dumps(reloader.status()), 202
   try:
-    current_app.config[REGISTRY_KEY] = registry.build(
-        additional_catalog_path=additional_catalog_path)
-  except Exception as e:
-    logging.error(f'Server registry not built due to error: {str(e)}')
+    future.result()
+  except Exception:
+    # Already logged by the reloader, and the current registry is kept.
+    pass
   reg: Registry = current_app.config[REGISTRY_KEY]
   server_config = reg.server_config()
   return json.dumps(asdict(server_config))
 
 
+@bp.route('/api/load_stats/', methods=['GET'])
+def load_stats():
+  """Returns the load time of each model and index and the reload status."""
+  reg: Registry = current_app.config[REGISTRY_KEY]
+  reloader: registry.Reloader = current_app.config[registry.RELOADER_KEY]
+  return json.dumps({**reg.load_stats(), 'reload': reloader.status()})
+
+
 def _get_indexes(reg: Registry, idx_types: List[str]) -> List[Embeddings]:
   embeddings: List[Embeddings] = []
   for idx in idx_types:
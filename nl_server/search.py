@@ -13,13 +13,17 @@
 # limitations under the License.
 """Library that exposes search_vars"""
 
+from concurrent.futures import ThreadPoolExecutor
+import os
 import time
 from typing import Dict, List
 
+from nl_server import metrics
 from nl_server import ranking
 from nl_server import rerank
 from nl_server.embeddings import Embeddings
 from nl_server.embeddings import EmbeddingsResult
+from nl_server.embeddings import SearchVarsResult
 from nl_server.merge import merge_search_results
 import shared.lib.detected_variables as dvars
 
@@ -32,40 +36,131 @@ _NUM_SV_INDEX_MATCHES = 40
 # try to retrieve more from vector DB.
 _NUM_SV_INDEX_MATCHES_WITHOUT_TOPICS = 60
 
+# Max number of indexes to encode for / search at the same time.
+_MAX_CONCURRENT_SEARCHES = 8
+_executor = ThreadPoolExecutor(max_workers=_MAX_CONCURRENT_SEARCHES,
+                               thread_name_prefix='index_search')
+
+# Env var to turn off (when "false") the exact match lookup before vector
+# search.
+_EXACT_MATCH_ENV = 'NL_EXACT_MATCH'
+
+
+def _exact_match_enabled() -> bool:
+  return os.environ.get(_EXACT_MATCH_ENV, 'true').lower() != 'false'
+
 
 #
 # Given a list of query embeddings, searches the embeddings index
 # and returns a list of candidates in the same order as original queries.
 #
-def search_vars(embeddings_list: List[Embeddings],
-                queries: List[str],
-                skip_topics: bool = False,
-                rerank_model: ranking.RerankingModel = None,
-                debug_logs: dict = {}) -> Dict[str, dvars.VarCandidates]:
+# Queries that exactly match (after normalization) indexed sentences get those
+# sentences with a perfect score, without being encoded. With
+# fill_exact_matches, they are also vector searched to fill the rest of the
+# candidates.
+#
+# If timings is set, it gets the latency (in ms) of each stage of this call.
+#
+def search_vars(
+    embeddings_list: List[Embeddings],
+    queries: List[str],
+    skip_topics: bool = False,
+    rerank_model: ranking.RerankingModel = None,
+    debug_logs: dict = {},
+    fill_exact_matches: bool = False,
+    timings: Dict[str, float] = None) -> Dict[str, dvars.VarCandidates]:
   if not embeddings_list:
     return {}
 
-  topk = _get_topk(skip_topics)
+  with metrics.timer('search_vars', timings=timings):
+    topk = _get_topk(skip_topics)
+
+    # Look up exact matches in each index.
+    exact_matches_list: List[SearchVarsResult] = [{} for _ in embeddings_list]
+    if _exact_match_enabled():
+      with metrics.timer('exact_match', timings=timings):
+        exact_matches_list = [e.exact_match(queries) for e in embeddings_list]
+    matched = set(q for exact in exact_matches_list for q in exact)
+    debug_logs['sv_detection_exact_match_queries'] = [
+        q for q in queries if q in matched
+    ]
+
+    # Call vector search for each index.
+    vector_queries = [
+        q for q in queries if fill_exact_matches or q not in matched
+    ]
+    query2candidates_list = [{} for _ in embeddings_list]
+    if vector_queries:
+      with metrics.timer('vector_search', timings=timings):
+        query2candidates_list = _vector_search(embeddings_list, vector_queries,
+                                               topk, timings)
+    query2candidates_list = [
+        _add_exact_matches(exact, candidates, queries)
+        for exact, candidates in zip(exact_matches_list, query2candidates_list)
+    ]
+
+    # Merge the results.
+    with metrics.timer('merge', timings=timings):
+      query2candidates = merge_search_results(query2candidates_list)
+
+    # Rank merged results by vars.
+    results: Dict[str, dvars.VarCandidates] = {}
+    with metrics.timer('rank_vars', timings=timings):
+      for query, candidates in query2candidates.items():
+        results[query] = _rank_vars(candidates, skip_topics)
+
+    if rerank_model:
+      start = time.time()
+      results = rerank.rerank(rerank_model,
+                              results,
+                              debug_logs,
+                              timings=timings)
+      debug_logs['time_var_reranking'] = time.time() - start
 
-  # Call vector search for each index.
-  query2candidates_list: List[EmbeddingsResult] = []
-  for embeddings in embeddings_list:
-    query2candidates_list.append(embeddings.vector_search(queries, topk))
+  return results
 
-  # Merge the results.
-  query2candidates = merge_search_results(query2candidates_list)
 
-  # Rank merged results by vars.
-  results: Dict[str, dvars.VarCandidates] = {}
-  for query, candidates in query2candidates.items():
-    results[query] = _rank_vars(candidates, skip_topics)
+#
+# Searches the indexes concurrently, and returns their results in the order of
+# embeddings_list. Indexes that share a model share the query embeddings.
+#
+def _vector_search(embeddings_list: List[Embeddings],
+                   queries: List[str],
+                   topk: int,
+                   timings: Dict[str, float] = None) -> List[SearchVarsResult]:
+  if len(embeddings_list) == 1:
+    return [embeddings_list[0].vector_search(queries, topk, timings)]
+
+  # Encode the queries once per distinct model.
+  model_to_embeddings: Dict[int, Embeddings] = {}
+  for embeddings in embeddings_list:
+    model_to_embeddings.setdefault(id(embeddings.model), embeddings)
+  encoded = _executor.map(lambda e: e.encode(queries, timings),
+                          model_to_embeddings.values())
+  model_to_query_embeddings = dict(zip(model_to_embeddings.keys(), encoded))
 
-  if rerank_model:
-    start = time.time()
-    results = rerank.rerank(rerank_model, results, debug_logs)
-    debug_logs['time_var_reranking'] = time.time() - start
+  return list(
+      _executor.map(
+          lambda e: e.search(queries, model_to_query_embeddings[id(e.model)],
+                             topk, timings), embeddings_list))
 
-  return results
+
+#
+# Puts the exact matches of each query before its vector search matches of other
+# sentences.
+#
+def _add_exact_matches(exact_matches: SearchVarsResult,
+                       query2candidates: SearchVarsResult,
+                       queries: List[str]) -> SearchVarsResult:
+  result: SearchVarsResult = {}
+  for query in queries:
+    exact = exact_matches.get(query, [])
+    sentences = set(m.sentence for m in exact)
+    result[query] = exact + [
+        m for m in query2candidates.get(query, [])
+        if m.sentence not in sentences
+    ]
+  return result
 
 
 def _rank_vars(candidates: EmbeddingsResult,
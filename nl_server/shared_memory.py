@@ -0,0 +1,242 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Sharing of embeddings and model weights across server processes.
+
+With NL_SHARED_MEMORY=true, the first process to load an embeddings matrix or a
+local model writes it to a file under the shared folder, and every process
+(including the first) memory maps that file read-only. The pages are then held
+once in the OS page cache for all the gunicorn workers, instead of once per
+worker.
+
+Each process holds a shared lock on the shared files it uses for as long as it
+runs. The files of a source that was modified are removed when the files of its
+new version are written, and files that no process holds are removed when a
+server starts (see remove_unused). Processes that still map a removed file keep
+reading it, and its memory is freed once they unmap it.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import shutil
+from typing import Callable, Dict, IO
+import warnings
+
+import numpy as np
+import torch
+
+from nl_server.cache import get_cache_root
+
+_ENABLED_ENV = 'NL_SHARED_MEMORY'
+# Env var to override the folder of the shared files.
+_DIR_ENV = 'NL_SHARED_MEMORY_DIR'
+_DEFAULT_DIR_NAME = 'shared_memory'
+
+# Matches the source key in the name of a shared file.
+_SOURCE_KEY_RE = re.compile(r'([0-9a-f]{16})-([0-9a-f]{16})')
+
+# Lock files of the shared files used by this process, which are held with a
+# shared lock, keyed by the path of the shared file.
+_held: Dict[str, IO] = {}
+
+# Fields of /proc/<pid>/status to report, in kB.
+_STATUS_FIELDS = ['VmRSS', 'RssAnon', 'RssFile', 'RssShmem']
+
+
+def enabled() -> bool:
+  return os.environ.get(_ENABLED_ENV, '').lower() == 'true'
+
+
+def shared_dir() -> str:
+  return os.environ.get(_DIR_ENV,
+                        os.path.join(get_cache_root(), _DEFAULT_DIR_NAME))
+
+
+def source_key(path: str) -> str:
+  """Gets a key of a file or folder that changes when it is modified.
+
+  The key is "<hash of the path>-<hash of the version>", so the shared files of
+  previous versions of the same path can be found.
+  """
+  realpath = os.path.realpath(path)
+  stat = os.stat(path)
+  version = f'{realpath}:{stat.st_size}:{stat.st_mtime_ns}'
+  return '-'.join(
+      hashlib.sha256(k.encode()).hexdigest()[:16] for k in [realpath, version])
+
+
+@contextlib.contextmanager
+def _file_lock(path: str):
+  """Holds an exclusive lock across processes while writing a shared file."""
+  with open(path + '.lock', 'w') as f:
+    fcntl.flock(f, fcntl.LOCK_EX)
+    try:
+      yield
+    finally:
+      fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _hold(path: str):
+  """Takes a shared lock on a shared file until the process exits, so it is not
+  removed as unused."""
+  if path not in _held:
+    f = open(path + '.lock', 'w')
+    fcntl.flock(f, fcntl.LOCK_SH)
+    _held[path] = f
+
+
+def _release(path: str):
+  f = _held.pop(path, None)
+  if f:
+    f.close()
+
+
+def _remove(path: str):
+  _release(path)
+  if os.path.isdir(path):
+    shutil.rmtree(path, ignore_errors=True)
+  else:
+    with contextlib.suppress(FileNotFoundError):
+      os.remove(path)
+  logging.info('Removed shared file %s', path)
+
+
+def _remove_previous_versions(name: str):
+  """Removes the shared files of the previous versions of the source of a
+  shared file, which have the same name but another source version."""
+  match = _SOURCE_KEY_RE.search(name)
+  if not match:
+    return
+  previous_re = re.compile(
+      re.escape(name[:match.start()] + match.group(1) + '-') + '[0-9a-f]{16}' +
+      re.escape(name[match.end():]))
+  for entry in os.listdir(shared_dir()):
+    if entry != name and previous_re.fullmatch(entry):
+      _remove(os.path.join(shared_dir(), entry))
+
+
+def get_or_create(name: str, create: Callable[[str], None]) -> str:
+  """Gets the path of a shared file or folder, creating it if missing.
+
+  Args:
+    name: the name of the shared file or folder. If it has a source_key, the
+      shared files of the previous versions of that source are removed when it
+      is created.
+    create: writes the file or folder to the given path. Only called by the
+      first process to get it.
+  """
+  os.makedirs(shared_dir(), exist_ok=True)
+  path = os.path.join(shared_dir(), name)
+  while True:
+    if not os.path.exists(path):
+      with _file_lock(path):
+        if not os.path.exists(path):
+          # Written under a tmp name, so a partly written file is never used.
+          tmp_path = f'{path}.{os.getpid()}.tmp'
+          create(tmp_path)
+          os.replace(tmp_path, path)
+          logging.info('Wrote shared file %s', path)
+          _remove_previous_versions(name)
+    _hold(path)
+    # The file may have been removed as unused before it was held.
+    if os.path.exists(path):
+      return path
+    _release(path)
+
+
+def remove_unused():
+  """Removes the shared files that no running process holds, and the tmp files
+  of writes that did not complete. Called when a server starts."""
+  if not os.path.isdir(shared_dir()):
+    return
+  for entry in os.listdir(shared_dir()):
+    if entry.endswith('.lock'):
+      continue
+    path = os.path.join(shared_dir(), entry)
+    # Tmp files are written under the exclusive lock of the file they are
+    # written for, so there is no write in progress while it is held.
+    target = path.rsplit('.', 2)[0] if entry.endswith('.tmp') else path
+    if target in _held:
+      if target != path:
+        _remove(path)
+      continue
+    with open(target + '.lock', 'w') as f:
+      try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+      except BlockingIOError:
+        # In use, or being written.
+        continue
+      try:
+        _remove(path)
+      finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def share_matrix(
+    name: str, matrix: Callable[[], np.ndarray | torch.Tensor]) -> torch.Tensor:
+  """Gets a float32 matrix memory mapped from a shared file.
+
+  Args:
+    name: the name of the shared file.
+    matrix: computes the matrix, if it is not shared yet.
+  """
+
+  def _create(path: str):
+    with open(path, 'wb') as f:
+      np.save(f, np.ascontiguousarray(matrix(), dtype=np.float32))
+
+  path = get_or_create(name + '.npy', _create)
+  with warnings.catch_warnings():
+    # The matrix is read-only, and is never written to.
+    warnings.simplefilter('ignore', UserWarning)
+    return torch.from_numpy(np.load(path, mmap_mode='r'))
+
+
+def share_weights(module: torch.nn.Module, name: str):
+  """Replaces the weights of a module with ones memory mapped from a shared
+  file. Pages are only copied by a process if it writes to them, which
+  inference does not.
+  """
+  module.eval()
+  path = get_or_create(name + '.pt',
+                       lambda p: torch.save(module.state_dict(), p))
+  state_dict = torch.load(path, mmap=True, weights_only=True)
+  module.load_state_dict(state_dict, assign=True)
+
+
+def memory_stats(pid: int | str = 'self') -> Dict[str, int]:
+  """Gets the memory usage of a process in kB.
+
+  Pss (proportional set size) counts each shared page divided by the number of
+  processes sharing it, so the Pss of the workers sums to their total memory.
+  """
+  result = {}
+  with open(f'/proc/{pid}/status') as f:
+    for line in f:
+      field, _, value = line.partition(':')
+      if field in _STATUS_FIELDS:
+        result[field] = int(value.split()[0])
+  try:
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+      for line in f:
+        field, _, value = line.partition(':')
+        if field in ['Pss', 'Shared_Clean', 'Private_Dirty']:
+          result[field] = int(value.split()[0])
+  except OSError:
+    # Not available on older kernels.
+    pass
+  return result
@@ -0,0 +1,252 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Binary embeddings format.
+
+A binary embeddings folder has:
+  - vectors.npy: the (N, dim) float32 or float16 embeddings matrix.
+  - dcids.txt: the ';' joined dcids of each embedding, one JSON string per line.
+  - sentences.txt: the sentence of each embedding, one JSON string per line.
+  - manifest.json: the number of embeddings, their dimension and type, and the
+    sha256 of each of the files above.
+  - verified.json: written once the files were checked against their sha256s
+    (on save, or on the first load after a download), with the size, mtime and
+    inode of each file. Later loads skip the checksums while those still match.
+
+The matrix is memory mapped on load, so loading is fast and processes that map
+the same file share its pages. Saves and updates write new files and move them
+into place, so the files that processes have mapped are never modified.
+"""
+
+from dataclasses import dataclass
+import hashlib
+import io
+import json
+import logging
+import os
+from typing import Dict, List
+
+import numpy as np
+
+MANIFEST_FILE = 'manifest.json'
+VECTORS_FILE = 'vectors.npy'
+DCIDS_FILE = 'dcids.txt'
+SENTENCES_FILE = 'sentences.txt'
+VERIFIED_FILE = 'verified.json'
+
+_FORMAT_VERSION = 1
+_DTYPES = ['float32', 'float16']
+_HASH_BLOCK_SIZE = 1 << 22
+# Number of rows copied at a time when updating the embeddings matrix.
+_COPY_BLOCK_ROWS = 1 << 16
+
+
+@dataclass
+class BinaryEmbeddings:
+  # (N, dim) embeddings. Memory mapped read-only when loaded from disk.
+  vectors: np.ndarray
+  dcids: List[str]
+  sentences: List[str]
+
+
+def is_binary_embeddings(path: str) -> bool:
+  return os.path.isdir(path) and os.path.exists(
+      os.path.join(path, MANIFEST_FILE))
+
+
+def _sha256(path: str) -> str:
+  h = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b''):
+      h.update(block)
+  return h.hexdigest()
+
+
+def _write_table(path: str, values: List[str]):
+  with open(path, 'w') as f:
+    for value in values:
+      f.write(json.dumps(value))
+      f.write('\n')
+
+
+def _read_table(path: str) -> List[str]:
+  with open(path) as f:
+    return [json.loads(line) for line in f]
+
+
+def save(folder: str,
+         vectors: np.ndarray,
+         dcids: List[str],
+         sentences: List[str],
+         dtype: str = 'float32'):
+  """Saves embeddings as a binary embeddings folder."""
+  if dtype not in _DTYPES:
+    raise ValueError(f'Unsupported embeddings dtype: {dtype}')
+  if not (len(vectors) == len(dcids) == len(sentences)):
+    raise ValueError('Embeddings, dcids and sentences differ in length')
+  os.makedirs(folder, exist_ok=True)
+  vectors = np.ascontiguousarray(vectors, dtype=dtype)
+  with open(_tmp_path(folder, VECTORS_FILE), 'wb') as f:
+    np.save(f, vectors)
+  _write_table(_tmp_path(folder, DCIDS_FILE), dcids)
+  _write_table(_tmp_path(folder, SENTENCES_FILE), sentences)
+  _replace_files(folder,
+                 count=vectors.shape[0],
+                 dim=vectors.shape[1] if vectors.ndim == 2 else 0,
+                 dtype=dtype)
+
+
+def _tmp_path(folder: str, name: str) -> str:
+  return os.path.join(folder, name + '.tmp')
+
+
+def _replace_files(folder: str, count: int, dim: int, dtype: str):
+  """Moves the files written to their temporary paths into place.
+
+  The files are replaced rather than overwritten, so processes that have the
+  previous embeddings matrix memory mapped keep reading it until they reload.
+  """
+  manifest_path = os.path.join(folder, MANIFEST_FILE)
+  # The folder is incomplete until the new manifest is written.
+  for path in [manifest_path, os.path.join(folder, VERIFIED_FILE)]:
+    if os.path.exists(path):
+      os.remove(path)
+  for name in [VECTORS_FILE, DCIDS_FILE, SENTENCES_FILE]:
+    os.replace(_tmp_path(folder, name), os.path.join(folder, name))
+  manifest = {
+      'version': _FORMAT_VERSION,
+      'count': count,
+      'dim': dim,
+      'dtype': dtype,
+      'sha256': {
+          name: _sha256(os.path.join(folder, name))
+          for name in [VECTORS_FILE, DCIDS_FILE, SENTENCES_FILE]
+      },
+  }
+  with open(_tmp_path(folder, MANIFEST_FILE), 'w') as f:
+    json.dump(manifest, f, indent=2)
+  os.replace(_tmp_path(folder, MANIFEST_FILE), manifest_path)
+  # The files were just hashed.
+  _write_verified(folder)
+
+
+def _file_stats(folder: str) -> Dict[str, List[int]]:
+  stats = {}
+  for name in [MANIFEST_FILE, VECTORS_FILE, DCIDS_FILE, SENTENCES_FILE]:
+    stat = os.stat(os.path.join(folder, name))
+    stats[name] = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+  return stats
+
+
+def _write_verified(folder: str):
+  try:
+    with open(_tmp_path(folder, VERIFIED_FILE), 'w') as f:
+      json.dump(_file_stats(folder), f)
+    os.replace(_tmp_path(folder, VERIFIED_FILE),
+               os.path.join(folder, VERIFIED_FILE))
+  except OSError as e:
+    # The checksums are verified again on the next load.
+    logging.warning('Could not write %s in %s: %s', VERIFIED_FILE, folder, e)
+
+
+def _is_verified(folder: str) -> bool:
+  try:
+    with open(os.path.join(folder, VERIFIED_FILE)) as f:
+      return json.load(f) == _file_stats(folder)
+  except (OSError, ValueError):
+    return False
+
+
+def _npy_header(count: int, dim: int, dtype: str) -> bytes:
+  header = io.BytesIO()
+  np.lib.format.write_array_header_1_0(
+      header, {
+          'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+          'fortran_order': False,
+          'shape': (count, dim),
+      })
+  return header.getvalue()
+
+
+def update(folder: str, delete_rows: List[int], dcid_updates: Dict[int, str],
+           vectors: np.ndarray, dcids: List[str], sentences: List[str]):
+  """Updates a binary embeddings folder.
+
+  The rows that are kept are copied in order from the current matrix, without
+  loading it into memory, and the new embeddings are appended after them.
+
+  Args:
+    folder: the binary embeddings folder.
+    delete_rows: the rows to delete.
+    dcid_updates: the new dcids of some of the rows that are kept.
+    vectors: the (M, dim) new embeddings to add, with their dcids and sentences.
+  """
+  if not (len(vectors) == len(dcids) == len(sentences)):
+    raise ValueError('Embeddings, dcids and sentences differ in length')
+  with open(os.path.join(folder, MANIFEST_FILE)) as f:
+    manifest = json.load(f)
+  count, dim, dtype = manifest['count'], manifest['dim'], manifest['dtype']
+  all_dcids = _read_table(os.path.join(folder, DCIDS_FILE))
+  all_sentences = _read_table(os.path.join(folder, SENTENCES_FILE))
+  for row, dcid in dcid_updates.items():
+    all_dcids[row] = dcid
+
+  deleted = set(delete_rows)
+  keep = [r for r in range(count) if r not in deleted]
+  new_count = len(keep) + len(vectors)
+  vectors = np.ascontiguousarray(vectors, dtype=dtype)
+  with open(_tmp_path(folder, VECTORS_FILE), 'wb') as f:
+    f.write(_npy_header(new_count, dim, dtype))
+    if keep:
+      matrix = np.load(os.path.join(folder, VECTORS_FILE), mmap_mode='r')
+      for i in range(0, len(keep), _COPY_BLOCK_ROWS):
+        f.write(matrix[keep[i:i + _COPY_BLOCK_ROWS]].tobytes())
+      del matrix
+    f.write(vectors.tobytes())
+  _write_table(_tmp_path(folder, DCIDS_FILE),
+               [all_dcids[r] for r in keep] + dcids)
+  _write_table(_tmp_path(folder, SENTENCES_FILE),
+               [all_sentences[r] for r in keep] + sentences)
+  _replace_files(folder, count=new_count, dim=dim, dtype=dtype)
+
+
+def load(folder: str, verify_checksums: bool = True) -> BinaryEmbeddings:
+  """Loads a binary embeddings folder, memory mapping the embeddings matrix.
+
+  Args:
+    folder: the binary embeddings folder.
+    verify_checksums: whether to check the files against the sha256s of the
+      manifest, unless they were already checked and have not changed since.
+
+  Raises:
+    ValueError: if the folder is incomplete or does not match its manifest.
+  """
+  with open(os.path.join(folder, MANIFEST_FILE)) as f:
+    manifest = json.load(f)
+  if manifest.get('version') != _FORMAT_VERSION:
+    raise ValueError(
+        f'Unsupported embeddings format version: {manifest.get("version")}')
+  if verify_checksums and not _is_verified(folder):
+    for name, checksum in manifest['sha256'].items():
+      if _sha256(os.path.join(folder, name)) != checksum:
+        raise ValueError(f'Checksum mismatch for {os.path.join(folder, name)}')
+    _write_verified(folder)
+  vectors = np.load(os.path.join(folder, VECTORS_FILE), mmap_mode='r')
+  dcids = _read_table(os.path.join(folder, DCIDS_FILE))
+  sentences = _read_table(os.path.join(folder, SENTENCES_FILE))
+  expected_shape = (manifest['count'], manifest['dim'])
+  if vectors.shape != expected_shape or str(vectors.dtype) != manifest['dtype']:
+    raise ValueError(f'Embeddings in {folder} do not match the manifest')
+  if len(dcids) != manifest['count'] or len(sentences) != manifest['count']:
+    raise ValueError(f'Tables in {folder} do not match the manifest')
+  return BinaryEmbeddings(vectors=vectors, dcids=dcids, sentences=sentences)
@@ -0,0 +1,190 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Inverted file (IVF) approximate nearest neighbour index.
+
+Embeddings are clustered with spherical k-means into `nlist` lists. A search
+only scores the embeddings in the `nprobe` lists whose centroids are closest
+to the query, instead of every embedding.
+
+All embeddings (and queries) are expected to be L2-normalized, so that the dot
+product is the cosine similarity.
+"""
+
+import hashlib
+import logging
+import math
+import os
+from typing import Dict, List
+
+import torch
+
+# Number of k-means iterations when building an index.
+_NUM_ITERS = 10
+# Max number of training points per list for k-means.
+_MAX_TRAIN_POINTS_PER_LIST = 256
+# Number of rows to score at a time when assigning embeddings to lists.
+_ASSIGN_CHUNK_SIZE = 65536
+
+
+def default_nlist(num_vectors: int) -> int:
+  return max(1, int(4 * math.sqrt(num_vectors)))
+
+
+def _assign(vectors: torch.Tensor, centroids: torch.Tensor) -> torch.Tensor:
+  """Gets the index of the closest centroid of each vector."""
+  assignments = []
+  for start in range(0, len(vectors), _ASSIGN_CHUNK_SIZE):
+    chunk = vectors[start:start + _ASSIGN_CHUNK_SIZE]
+    assignments.append(torch.argmax(chunk @ centroids.T, dim=1))
+  if not assignments:
+    return torch.zeros(0, dtype=torch.long)
+  return torch.cat(assignments)
+
+
+class IVFIndex:
+
+  def __init__(self, centroids: torch.Tensor, order: torch.Tensor,
+               offsets: torch.Tensor):
+    """
+    Args:
+      centroids: (nlist, dim) normalized list centroids.
+      order: ids of the embeddings, sorted by list.
+      offsets: (nlist + 1) offsets of each list in order.
+    """
+    self.centroids = centroids
+    self.order = order
+    self.offsets = offsets
+
+  @property
+  def nlist(self) -> int:
+    return len(self.centroids)
+
+  @staticmethod
+  def build(embeddings: torch.Tensor, nlist: int, seed: int = 0) -> 'IVFIndex':
+    """Builds an index over normalized embeddings."""
+    num_vectors = len(embeddings)
+    nlist = max(1, min(nlist, num_vectors))
+    generator = torch.Generator().manual_seed(seed)
+    train = embeddings[torch.randperm(
+        num_vectors, generator=generator)[:nlist * _MAX_TRAIN_POINTS_PER_LIST]]
+    centroids = train[torch.randperm(len(train),
+                                     generator=generator)[:nlist]].clone()
+    for _ in range(_NUM_ITERS):
+      assignments = _assign(train, centroids)
+      sums = torch.zeros_like(centroids).index_add_(0, assignments, train)
+      counts = torch.bincount(assignments, minlength=nlist)
+      # Lists without any training point keep their previous centroid.
+      non_empty = counts > 0
+      centroids[non_empty] = torch.nn.functional.normalize(sums[non_empty],
+                                                           dim=1)
+    assignments = _assign(embeddings, centroids)
+    order = torch.argsort(assignments, stable=True)
+    offsets = torch.zeros(nlist + 1, dtype=torch.long)
+    offsets[1:] = torch.cumsum(torch.bincount(assignments, minlength=nlist), 0)
+    return IVFIndex(centroids, order, offsets)
+
+  def search(self, embeddings: torch.Tensor, queries: torch.Tensor, top_k: int,
+             nprobe: int) -> List[List[Dict]]:
+    """Searches the index.
+
+    Args:
+      embeddings: the normalized embeddings the index was built over.
+      queries: (num queries, dim) normalized query embeddings.
+      top_k: number of results per query.
+      nprobe: number of lists to search per query.
+
+    Returns:
+      For each query, a list of {corpus_id, score} sorted by descending score,
+      the same as sentence_transformers.util.semantic_search.
+    """
+    nprobe = min(nprobe, self.nlist)
+    probes = torch.topk(queries @ self.centroids.T, nprobe, dim=1).indices
+    results = []
+    for query, query_probes in zip(queries, probes.tolist()):
+      ids = torch.cat([
+          self.order[self.offsets[l]:self.offsets[l + 1]] for l in query_probes
+      ])
+      scores = embeddings[ids] @ query
+      top = torch.topk(scores, min(top_k, len(ids)))
+      results.append([{
+          'corpus_id': corpus_id,
+          'score': score
+      } for corpus_id, score in zip(ids[top.indices].tolist(),
+                                    top.values.tolist())])
+    return results
+
+  def save(self, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    torch.save(
+        {
+            'centroids': self.centroids,
+            'order': self.order,
+            'offsets': self.offsets,
+        }, tmp_path)
+    os.replace(tmp_path, path)
+
+  @staticmethod
+  def load(path: str) -> 'IVFIndex':
+    data = torch.load(path)
+    return IVFIndex(data['centroids'], data['order'], data['offsets'])
+
+
+def load_or_build(embeddings: torch.Tensor, nlist: int,
+                  cache_dir: str) -> IVFIndex:
+  """Loads a prebuilt index for the embeddings from the cache folder, or
+  builds the index and caches it."""
+  digest = hashlib.sha256(embeddings.numpy().tobytes()).hexdigest()[:16]
+  path = os.path.join(cache_dir, f'ivf_{digest}_{nlist}.pt')
+  if os.path.exists(path):
+    try:
+      index = IVFIndex.load(path)
+      if int(index.offsets[-1]) == len(embeddings):
+        logging.info('Loaded IVF index from %s', path)
+        return index
+    except Exception as e:
+      logging.warning('Could not load IVF index from %s: %s', path, e)
+  index = IVFIndex.build(embeddings, nlist)
+  try:
+    index.save(path)
+  except OSError as e:
+    logging.warning('Could not cache IVF index to %s: %s', path, e)
+  return index
+
+
+def recall_at_k(index: IVFIndex,
+                embeddings: torch.Tensor,
+                top_k: int,
+                nprobe: int,
+                num_queries: int = 100,
+                noise: float = 0.05,
+                seed: int = 0) -> float:
+  """Estimates the recall@k of an index against exact search.
+
+  The queries are random embeddings from the index with some noise added, as a
+  stand-in for real queries that are close to (but not exactly) one of the
+  indexed sentences.
+  """
+  generator = torch.Generator().manual_seed(seed)
+  ids = torch.randperm(len(embeddings), generator=generator)[:num_queries]
+  queries = embeddings[ids] + noise * torch.randn(
+      len(ids), embeddings.shape[1], generator=generator)
+  queries = torch.nn.functional.normalize(queries, dim=1)
+  k = min(top_k, len(embeddings))
+  exact = torch.topk(queries @ embeddings.T, k, dim=1).indices.tolist()
+  approx = index.search(embeddings, queries, k, nprobe)
+  found = 0
+  for exact_ids, approx_hits in zip(exact, approx):
+    found += len(set(exact_ids) & set(h['corpus_id'] for h in approx_hits))
+  return found / (k * len(ids)) if ids.numel() else 1.0
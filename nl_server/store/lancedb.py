@@ -13,6 +13,7 @@
 # limitations under the License.
 """LanceDB Embeddings store."""
 
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
 import lancedb
@@ -32,7 +33,6 @@ SENTENCE_COL = 'sentence'
 DISTANCE_COL = '_distance'
 
 
-# TODO: Switch to async API for concurrent lookups.
 class LanceDBStore(EmbeddingsStore):
   """Manages the embeddings."""
 
@@ -56,22 +56,35 @@ class LanceDBStore(EmbeddingsStore):
 
     self.db = lancedb.connect(lance_db_dir)
     self.table = self.db.open_table(TABLE_NAME)
+    self.nprobes = idx_info.nprobes
+    self.refine_factor = idx_info.refine_factor
+    # LanceDB searches in native code without holding the GIL, so the queries
+    # of a request are searched concurrently on a thread pool.
+    self._executor = ThreadPoolExecutor(max_workers=idx_info.search_concurrency,
+                                        thread_name_prefix='lancedb_search')
+
+  def _search(self, emb: List[float], top_k: int) -> EmbeddingsResult:
+    query = self.table.search(emb).metric('cosine').select(
+        [DCID_COL, SENTENCE_COL]).limit(top_k)
+    if self.nprobes:
+      query = query.nprobes(self.nprobes)
+    if self.refine_factor:
+      query = query.refine_factor(self.refine_factor)
+    matches: List[EmbeddingsMatch] = []
+    for c in query.to_list():
+      # We want to return cosine-similarity, but LanceDB
+      # returns distance.
+      score = 1 - c[DISTANCE_COL]
+      dcid = c[DCID_COL]
+      sentence = c[SENTENCE_COL]
+      matches.append(
+          EmbeddingsMatch(sentence=sentence, score=score, vars=[dcid]))
+    return matches
 
   def vector_search(self, query_embeddings: List[List[float]],
                     top_k: int) -> List[EmbeddingsResult]:
-    results: List[EmbeddingsResult] = []
-    for emb in query_embeddings:
-      matches: List[EmbeddingsMatch] = []
-      candidates = self.table.search(emb).metric('cosine').limit(
-          top_k).to_list()
-      for c in candidates:
-        # We want to return cosine-similarity, but LanceDB
-        # returns distance.
-        score = 1 - c[DISTANCE_COL]
-        dcid = c[DCID_COL]
-        sentence = c[SENTENCE_COL]
-        matches.append(
-            EmbeddingsMatch(sentence=sentence, score=score, vars=[dcid]))
-      results.append(matches)
-
-    return results
+    if len(query_embeddings) == 1:
+      return [self._search(query_embeddings[0], top_k)]
+    return list(
+        self._executor.map(lambda emb: self._search(emb, top_k),
+                           query_embeddings))
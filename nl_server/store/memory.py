@@ -14,17 +14,27 @@
 """In-memory Embeddings store."""
 
 import logging
+import os
 from typing import List
+import warnings
 
 from datasets import load_dataset
+import numpy as np
 from sentence_transformers.util import semantic_search
 import torch
 
+from nl_server import shared_memory
 from nl_server.cache import get_cache_root
 from nl_server.config import MemoryIndexConfig
+from nl_server.config import MemorySearchType
 from nl_server.embeddings import EmbeddingsMatch
 from nl_server.embeddings import EmbeddingsResult
 from nl_server.embeddings import EmbeddingsStore
+from nl_server.embeddings import EXACT_MATCH_SCORE
+from nl_server.store import binary_embeddings
+from nl_server.store import ivf
+from nl_server.store import quantize
+from nl_server.store import sentence_index
 from shared.lib.custom_dc_util import use_anonymous_gcs_client
 from shared.lib.gcs import is_gcs_path
 from shared.lib.gcs import maybe_download
@@ -57,7 +67,61 @@ class MemoryEmbeddingsStore(EmbeddingsStore):
     self.dcids: List[str] = []
     self.sentences: List[str] = []
 
+    is_binary = binary_embeddings.is_binary_embeddings(embeddings_path)
+    if idx_info.quantization and idx_info.search_type == MemorySearchType.IVF:
+      raise ValueError('Quantization is only supported with EXACT search')
+    if idx_info.quantization and not is_binary:
+      # The full precision embeddings of a CSV file would all be in memory,
+      # next to the quantized copy.
+      raise ValueError(
+          'Quantization is only supported for binary embeddings folders')
+
     logging.info('Loading embeddings file: %s', embeddings_path)
+    # Key of the embeddings files shared by the server processes, if enabled.
+    self.shared_key: str = None
+    if shared_memory.enabled():
+      self.shared_key = shared_memory.source_key(embeddings_path)
+    if is_binary:
+      # Quantized search only reads the rescored rows of the full precision
+      # embeddings, so they are kept memory mapped in their stored dtype.
+      self._load_binary(embeddings_path, keep_dtype=bool(idx_info.quantization))
+    elif self.shared_key:
+      self._load_shared_csv(embeddings_path)
+    else:
+      self._load_csv(embeddings_path)
+
+    # Finds the sentences that queries match exactly.
+    self.sentence_index = sentence_index.SentenceIndex(self.sentences)
+
+    self.ivf_index: ivf.IVFIndex = None
+    self.normalized_embeddings: torch.Tensor = None
+    self.ivf_nprobe = idx_info.ivf_nprobe
+    if idx_info.search_type == MemorySearchType.IVF:
+      self._load_ivf_index(idx_info)
+
+    self.quantized: quantize.QuantizedEmbeddings = None
+    self.rescore_factor = idx_info.rescore_factor
+    if idx_info.quantization:
+      self.quantized = quantize.QuantizedEmbeddings(self.dataset_embeddings,
+                                                    idx_info.quantization)
+      logging.info('Quantized embeddings to %s (%d bytes)',
+                   idx_info.quantization, self.quantized.nbytes)
+
+  def _load_binary(self, embeddings_path: str, keep_dtype: bool = False):
+    embeddings = binary_embeddings.load(embeddings_path)
+    self.dcids = embeddings.dcids
+    self.sentences = embeddings.sentences
+    if keep_dtype or embeddings.vectors.dtype == np.float32:
+      # Use the memory mapped matrix as is, so processes share its pages.
+      with warnings.catch_warnings():
+        # The matrix is read-only, and is never written to.
+        warnings.simplefilter('ignore', UserWarning)
+        self.dataset_embeddings = torch.from_numpy(embeddings.vectors)
+    else:
+      self.dataset_embeddings = torch.from_numpy(
+          embeddings.vectors.astype(np.float32))
+
+  def _load_csv(self, embeddings_path: str):
     try:
       ds = load_dataset('csv', data_files=embeddings_path)
     except:
@@ -76,15 +140,59 @@ class MemoryEmbeddingsStore(EmbeddingsStore):
 
     self.dataset_embeddings = torch.from_numpy(df.to_numpy()).to(torch.float)
 
+  def _load_shared_csv(self, embeddings_path: str):
+    """Loads a CSV file through a binary copy shared by the server processes,
+    so only the first process parses it."""
+
+    def _create(folder: str):
+      self._load_csv(embeddings_path)
+      sentences = self.sentences or [''] * len(self.dcids)
+      binary_embeddings.save(folder, self.dataset_embeddings.numpy(),
+                             self.dcids, sentences)
+
+    self._load_binary(
+        shared_memory.get_or_create(f'embeddings_{self.shared_key}', _create))
+
+  def _load_ivf_index(self, idx_info: MemoryIndexConfig):
+    # The IVF index searches by dot product, so keep normalized embeddings.
+    def _normalize():
+      return torch.nn.functional.normalize(self.dataset_embeddings, dim=1)
+
+    if self.shared_key:
+      self.normalized_embeddings = shared_memory.share_matrix(
+          f'normalized_{self.shared_key}', _normalize)
+    else:
+      self.normalized_embeddings = _normalize()
+    nlist = idx_info.ivf_nlist or ivf.default_nlist(
+        len(self.normalized_embeddings))
+    self.ivf_index = ivf.load_or_build(self.normalized_embeddings, nlist,
+                                       os.path.join(get_cache_root(), 'ivf'))
+    recall = ivf.recall_at_k(self.ivf_index,
+                             self.normalized_embeddings,
+                             top_k=10,
+                             nprobe=self.ivf_nprobe)
+    logging.info('IVF index with %s lists (nprobe=%s) has recall@10 of %.3f',
+                 self.ivf_index.nlist, self.ivf_nprobe, recall)
+
   #
   # Given a list of query embeddings, searches the in-memory embeddings index
   # and returns a list of candidates in the same order as original queries.
   #
   def vector_search(self, query_embeddings: torch.Tensor,
                     top_k: int) -> List[EmbeddingsResult]:
-    hits = semantic_search(query_embeddings,
-                           self.dataset_embeddings,
-                           top_k=top_k)
+    if self.ivf_index is not None:
+      queries = torch.as_tensor(query_embeddings, dtype=torch.float)
+      queries = torch.nn.functional.normalize(queries, dim=1)
+      hits = self.ivf_index.search(self.normalized_embeddings, queries, top_k,
+                                   self.ivf_nprobe)
+    elif self.quantized is not None:
+      queries = torch.as_tensor(query_embeddings, dtype=torch.float)
+      hits = self.quantized.search(self.dataset_embeddings, queries, top_k,
+                                   self.rescore_factor)
+    else:
+      hits = semantic_search(query_embeddings,
+                             self.dataset_embeddings,
+                             top_k=top_k)
     results: List[EmbeddingsResult] = []
     for hit in hits:
       matches: List[EmbeddingsMatch] = []
@@ -99,3 +207,14 @@ class MemoryEmbeddingsStore(EmbeddingsStore):
       results.append(matches)
 
     return results
+
+  def exact_match(self, queries: List[str]) -> List[EmbeddingsResult]:
+    results: List[EmbeddingsResult] = []
+    for query in queries:
+      results.append([
+          EmbeddingsMatch(score=EXACT_MATCH_SCORE,
+                          vars=self.dcids[row].split(';'),
+                          sentence=self.sentences[row])
+          for row in self.sentence_index.lookup(query)
+      ])
+    return results
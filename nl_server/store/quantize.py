@@ -0,0 +1,117 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Scalar quantized embeddings with full precision rescoring.
+
+Candidates are scored against a compact copy of the normalized embeddings
+(float16, or int8 with a per-dimension scale), and the best `top_k *
+rescore_factor` candidates are rescored against the full precision embeddings.
+Only the rows of those candidates are read from the full precision embeddings,
+so when they are memory mapped (see binary_embeddings.py) most of them never
+need to be in memory.
+"""
+
+from typing import Dict, List
+
+import torch
+
+from nl_server.config import MemoryQuantization
+
+# Number of rows to convert to a compute type at a time when quantizing or
+# scoring int8 embeddings.
+_CHUNK_SIZE = 16384
+
+
+def _normalized_chunks(embeddings: torch.Tensor):
+  """Yields the normalized float32 embeddings, a chunk of rows at a time, so
+  there is never a full precision copy of all the embeddings in memory."""
+  for start in range(0, len(embeddings), _CHUNK_SIZE):
+    chunk = embeddings[start:start + _CHUNK_SIZE].to(torch.float)
+    yield start, torch.nn.functional.normalize(chunk, dim=1)
+
+
+class QuantizedEmbeddings:
+
+  def __init__(self, embeddings: torch.Tensor, quantization: str):
+    """
+    Args:
+      embeddings: (N, dim) full precision embeddings, eg. memory mapped from a
+          binary embeddings folder.
+      quantization: a MemoryQuantization.
+    """
+    self.quantization = quantization
+    if quantization == MemoryQuantization.FLOAT16:
+      self.vectors = torch.empty(embeddings.shape, dtype=torch.float16)
+      self.scale = None
+      for start, chunk in _normalized_chunks(embeddings):
+        self.vectors[start:start + len(chunk)] = chunk.to(torch.float16)
+    elif quantization == MemoryQuantization.INT8:
+      # Symmetric per-dimension scale, so that each dimension uses the full
+      # int8 range.
+      amax = torch.zeros(embeddings.shape[1])
+      for _, chunk in _normalized_chunks(embeddings):
+        amax = torch.maximum(amax, chunk.abs().amax(dim=0))
+      self.scale = amax.clamp(min=1e-12) / 127
+      self.vectors = torch.empty(embeddings.shape, dtype=torch.int8)
+      for start, chunk in _normalized_chunks(embeddings):
+        self.vectors[start:start + len(chunk)] = torch.round(
+            chunk / self.scale).to(torch.int8)
+    else:
+      raise ValueError(f'Unsupported quantization: {quantization}')
+
+  @property
+  def nbytes(self) -> int:
+    return self.vectors.element_size() * self.vectors.nelement()
+
+  def scores(self, queries: torch.Tensor) -> torch.Tensor:
+    """Gets the approximate cosine similarity of normalized queries with every
+    embedding, as a (num queries, N) tensor."""
+    if self.quantization == MemoryQuantization.FLOAT16:
+      return (queries.to(torch.float16) @ self.vectors.T).to(torch.float)
+    # There are no int8 matmul kernels on CPU, so convert chunks of rows to
+    # bfloat16, with the scale folded into the queries.
+    scaled_queries = (queries * self.scale).to(torch.bfloat16)
+    scores = []
+    for start in range(0, len(self.vectors), _CHUNK_SIZE):
+      chunk = self.vectors[start:start + _CHUNK_SIZE].to(torch.bfloat16)
+      scores.append(scaled_queries @ chunk.T)
+    return torch.cat(scores, dim=1).to(torch.float)
+
+  def search(self, embeddings: torch.Tensor, queries: torch.Tensor, top_k: int,
+             rescore_factor: int) -> List[List[Dict]]:
+    """Searches the quantized embeddings, and rescores the best candidates.
+
+    Args:
+      embeddings: the full precision embeddings that were quantized.
+      queries: (num queries, dim) query embeddings.
+      top_k: number of results per query.
+      rescore_factor: number of candidates to rescore, as a multiple of top_k.
+
+    Returns:
+      For each query, a list of {corpus_id, score} sorted by descending score,
+      the same as sentence_transformers.util.semantic_search.
+    """
+    queries = torch.nn.functional.normalize(queries.to(torch.float), dim=1)
+    num_candidates = min(top_k * rescore_factor, len(self.vectors))
+    candidates = torch.topk(self.scores(queries), num_candidates, dim=1).indices
+    results = []
+    for query, ids in zip(queries, candidates):
+      rows = torch.nn.functional.normalize(embeddings[ids].to(torch.float),
+                                           dim=1)
+      top = torch.topk(rows @ query, min(top_k, len(ids)))
+      results.append([{
+          'corpus_id': corpus_id,
+          'score': score
+      } for corpus_id, score in zip(ids[top.indices].tolist(),
+                                    top.values.tolist())])
+    return results
@@ -0,0 +1,53 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Hash index of the sentences of an embeddings index, to find the sentences
+that a query matches exactly without encoding it."""
+
+import html
+import re
+from typing import Dict, List
+
+# Punctuation that only separates words.
+_SEPARATOR_RE = re.compile(r'[\s.,;:!?\'"`()\[\]{}/\\_-]+')
+# Other symbols (eg. "<", "%", "$", "+") change the meaning of a sentence, so
+# they are kept as words.
+_SYMBOL_RE = re.compile(r'([^\w\s])')
+
+
+def normalize(text: str) -> str:
+  """Lower cases a text, replaces runs of separating punctuation and whitespace
+  with a single space, and separates other symbols from words.
+
+  The text is unescaped first, since queries are html escaped by the routes.
+  """
+  text = _SEPARATOR_RE.sub(' ', html.unescape(text).lower())
+  return ' '.join(_SYMBOL_RE.sub(r' \1 ', text).split())
+
+
+class SentenceIndex:
+
+  def __init__(self, sentences: List[str]):
+    # Normalized sentence -> rows of the sentence.
+    self._rows: Dict[str, List[int]] = {}
+    for row, sentence in enumerate(sentences):
+      key = normalize(sentence)
+      if key:
+        self._rows.setdefault(key, []).append(row)
+
+  def __len__(self) -> int:
+    return len(self._rows)
+
+  def lookup(self, query: str) -> List[int]:
+    """Gets the rows of the sentences equal to the query once normalized."""
+    return self._rows.get(normalize(query), [])
@@ -0,0 +1,72 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for micro-batching of model calls."""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import unittest
+
+from nl_server.batcher import MicroBatcher
+
+
+class TestMicroBatcher(unittest.TestCase):
+
+  def setUp(self):
+    self.batches = []
+    self.lock = threading.Lock()
+
+  def _batch_fn(self, inputs):
+    with self.lock:
+      self.batches.append(list(inputs))
+    return [x * 10 for x in inputs]
+
+  def test_concurrent_calls(self):
+    batcher = MicroBatcher(self._batch_fn, window_ms=200, max_batch_size=100)
+    calls = [[1, 2], [3], [4, 5, 6]]
+    with ThreadPoolExecutor(max_workers=len(calls)) as executor:
+      results = list(executor.map(batcher, calls))
+    # Every caller gets the outputs of its own inputs.
+    assert results == [[10, 20], [30], [40, 50, 60]]
+    # The calls were combined into one batch.
+    assert len(self.batches) == 1
+    assert sorted(self.batches[0]) == [1, 2, 3, 4, 5, 6]
+    stats = batcher.stats()
+    assert stats['batchSize']['count'] == 1
+    assert stats['batchSize']['buckets']['<=8'] == 1
+    assert stats['queueDelayMs']['count'] == 3
+
+  def test_max_batch_size(self):
+    batcher = MicroBatcher(self._batch_fn, window_ms=1000, max_batch_size=2)
+    # A full batch does not wait for the window.
+    assert batcher([1, 2]) == [10, 20]
+    # Calls bigger than the max batch size run on their own.
+    assert batcher([1, 2, 3]) == [10, 20, 30]
+    assert self.batches == [[1, 2], [1, 2, 3]]
+
+  def test_error(self):
+
+    def batch_fn(inputs):
+      raise ValueError('model error')
+
+    batcher = MicroBatcher(batch_fn, window_ms=1)
+    with self.assertRaises(ValueError):
+      batcher(['a'])
+    # The batcher keeps serving calls after an error.
+    with self.assertRaises(ValueError):
+      batcher(['b'])
+
+  def test_empty(self):
+    batcher = MicroBatcher(self._batch_fn, window_ms=1)
+    assert batcher([]) == []
+    assert batcher.stats()['batchSize']['count'] == 0
@@ -0,0 +1,173 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the binary embeddings format."""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import torch
+
+from nl_server.config import MemoryIndexConfig
+from nl_server.store import binary_embeddings
+from nl_server.store.memory import MemoryEmbeddingsStore
+
+_TEST_DATA = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'test_data',
+    'custom.ft_final_v20230717230459.all-MiniLM-L6-v2.csv')
+
+
+class TestBinaryEmbeddings(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.folder = os.path.join(self.tmp_dir.name, 'embeddings_bin')
+    self.vectors = np.arange(12, dtype=np.float32).reshape(3, 4) / 10
+    self.dcids = ['dc/1', 'dc/2;dc/3', 'dc/4']
+    self.sentences = ['first', 'with "quotes", commas', 'multi\nline']
+
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+
+  def test_round_trip(self):
+    binary_embeddings.save(self.folder, self.vectors, self.dcids,
+                           self.sentences)
+    assert binary_embeddings.is_binary_embeddings(self.folder)
+    loaded = binary_embeddings.load(self.folder)
+    assert isinstance(loaded.vectors, np.memmap)
+    np.testing.assert_array_equal(loaded.vectors, self.vectors)
+    assert loaded.dcids == self.dcids
+    assert loaded.sentences == self.sentences
+
+  def test_float16(self):
+    binary_embeddings.save(self.folder,
+                           self.vectors,
+                           self.dcids,
+                           self.sentences,
+                           dtype='float16')
+    loaded = binary_embeddings.load(self.folder)
+    assert loaded.vectors.dtype == np.float16
+    np.testing.assert_allclose(loaded.vectors, self.vectors, atol=1e-3)
+
+  def test_checksum_mismatch(self):
+    binary_embeddings.save(self.folder, self.vectors, self.dcids,
+                           self.sentences)
+    with open(os.path.join(self.folder, binary_embeddings.DCIDS_FILE),
+              'a') as f:
+      f.write('"dc/5"\n')
+    with self.assertRaises(ValueError):
+      binary_embeddings.load(self.folder)
+
+  def test_checksums_verified_once(self):
+    binary_embeddings.save(self.folder, self.vectors, self.dcids,
+                           self.sentences)
+    # Like a folder that was downloaded.
+    os.remove(os.path.join(self.folder, binary_embeddings.VERIFIED_FILE))
+    with mock.patch.object(binary_embeddings,
+                           '_sha256',
+                           wraps=binary_embeddings._sha256) as sha256:
+      binary_embeddings.load(self.folder)
+      assert sha256.call_count == 3
+      binary_embeddings.load(self.folder)
+      assert sha256.call_count == 3
+    # Files that changed since are verified again.
+    with open(os.path.join(self.folder, binary_embeddings.DCIDS_FILE),
+              'a') as f:
+      f.write('"dc/5"\n')
+    with self.assertRaises(ValueError):
+      binary_embeddings.load(self.folder)
+
+  def _updated(self, delete_rows, dcid_updates, vectors, dcids, sentences):
+    binary_embeddings.save(self.folder, self.vectors, self.dcids,
+                           self.sentences)
+    binary_embeddings.update(self.folder, delete_rows, dcid_updates,
+                             np.array(vectors, dtype=np.float32), dcids,
+                             sentences)
+    loaded = binary_embeddings.load(self.folder)
+    return {
+        s: (d, v.tolist())
+        for s, d, v in zip(loaded.sentences, loaded.dcids, loaded.vectors)
+    }
+
+  def test_update_append(self):
+    got = self._updated([], {1: 'dc/5'}, [[9, 9, 9, 9]], ['dc/6'], ['new'])
+    want = {
+        s: (d, v.tolist())
+        for s, d, v in zip(self.sentences, self.dcids, self.vectors)
+    }
+    want['with "quotes", commas'] = ('dc/5', want['with "quotes", commas'][1])
+    want['new'] = ('dc/6', [9, 9, 9, 9])
+    assert got == want
+
+  def test_update_replace(self):
+    got = self._updated([0], {}, [[9, 9, 9, 9], [8, 8, 8, 8]], ['dc/6', 'dc/7'],
+                        ['new', 'newer'])
+    assert sorted(got) == sorted(self.sentences[1:] + ['new', 'newer'])
+    assert got['new'] == ('dc/6', [9, 9, 9, 9])
+    assert got['newer'] == ('dc/7', [8, 8, 8, 8])
+    assert got['multi\nline'] == ('dc/4', self.vectors[2].tolist())
+
+  def test_update_delete(self):
+    got = self._updated([0, 1], {}, [], [], [])
+    assert got == {'multi\nline': ('dc/4', self.vectors[2].tolist())}
+    got = self._updated([0, 1, 2], {}, [], [], [])
+    assert got == {}
+
+  def test_update_keeps_loaded_vectors(self):
+    binary_embeddings.save(self.folder, self.vectors, self.dcids,
+                           self.sentences)
+    loaded = binary_embeddings.load(self.folder)
+    binary_embeddings.update(self.folder, [0, 1], {},
+                             np.full((2, 4), 9, dtype=np.float32),
+                             ['dc/6', 'dc/7'], ['new', 'newer'])
+    # The matrix mapped before the update is not modified.
+    np.testing.assert_array_equal(loaded.vectors, self.vectors)
+    np.testing.assert_array_equal(
+        binary_embeddings.load(self.folder).vectors,
+        [self.vectors[2], [9, 9, 9, 9], [9, 9, 9, 9]])
+    assert sorted(os.listdir(self.folder)) == sorted([
+        binary_embeddings.MANIFEST_FILE, binary_embeddings.VECTORS_FILE,
+        binary_embeddings.DCIDS_FILE, binary_embeddings.SENTENCES_FILE,
+        binary_embeddings.VERIFIED_FILE
+    ])
+
+  def test_incomplete_folder(self):
+    os.makedirs(self.folder)
+    assert not binary_embeddings.is_binary_embeddings(self.folder)
+    assert not binary_embeddings.is_binary_embeddings(_TEST_DATA)
+
+
+class TestMemoryStoreBinary(unittest.TestCase):
+
+  def test_same_as_csv(self):
+    csv_store = MemoryEmbeddingsStore(
+        MemoryIndexConfig(embeddings_path=_TEST_DATA))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      folder = os.path.join(tmp_dir, 'embeddings_bin')
+      binary_embeddings.save(folder, csv_store.dataset_embeddings.numpy(),
+                             csv_store.dcids, csv_store.sentences)
+      binary_store = MemoryEmbeddingsStore(
+          MemoryIndexConfig(embeddings_path=folder))
+      assert torch.equal(binary_store.dataset_embeddings,
+                         csv_store.dataset_embeddings)
+      assert binary_store.dcids == csv_store.dcids
+      assert binary_store.sentences == csv_store.sentences
+      queries = csv_store.dataset_embeddings[:1]
+      got = binary_store.vector_search(queries, top_k=5)
+    want = csv_store.vector_search(queries, top_k=5)
+    assert [[m.vars for m in r] for r in got
+           ] == [[m.vars for m in r] for r in want]
+    self.assertAlmostEqual(got[0][0].score, want[0][0].score, places=5)
@@ -0,0 +1,127 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the query embeddings cache."""
+
+import tempfile
+from typing import List
+import unittest
+
+import numpy as np
+import torch
+
+from nl_server.embeddings import EmbeddingsModel
+from nl_server.embeddings_cache import CachedEmbeddingsModel
+from nl_server.embeddings_cache import EmbeddingsCache
+
+
+class FakeModel(EmbeddingsModel):
+  """Encodes a query as [length of query, number of words]."""
+
+  def __init__(self, returns_tensor: bool):
+    super().__init__(score_threshold=0.5, returns_tensor=returns_tensor)
+    self.encoded: List[List[str]] = []
+
+  def encode(self, queries: List[str]):
+    self.encoded.append(queries)
+    embeddings = [[len(q), len(q.split())] for q in queries]
+    if self.returns_tensor:
+      return torch.tensor(embeddings, dtype=torch.float).reshape(-1, 2)
+    return embeddings
+
+
+class TestEmbeddingsCache(unittest.TestCase):
+
+  def test_lru(self):
+    cache = EmbeddingsCache(max_size=2)
+    cache.put('m', {'a': np.array([1.0]), 'b': np.array([2.0])})
+    # Look up a so that b is the least recently used.
+    assert list(cache.get('m', ['a'])) == ['a']
+    cache.put('m', {'c': np.array([3.0])})
+    assert sorted(cache.get('m', ['a', 'b', 'c'])) == ['a', 'c']
+    # Entries are per model.
+    assert cache.get('other', ['a']) == {}
+    assert cache.stats() == {
+        'size': 2,
+        'maxSize': 2,
+        'hits': 3,
+        'diskHits': 0,
+        'misses': 2,
+        'hitRate': 0.6,
+    }
+
+  def test_disk(self):
+    with tempfile.TemporaryDirectory() as disk_dir:
+      cache = EmbeddingsCache(max_size=1, disk_dir=disk_dir)
+      cache.put('m', {'a': np.array([1.0, 2.0]), 'b': np.array([3.0, 4.0])})
+      # a was evicted from memory but is still on disk.
+      result = cache.get('m', ['a'])
+      np.testing.assert_array_equal(result['a'], [1.0, 2.0])
+      assert cache.stats()['diskHits'] == 1
+
+      # The disk tier survives restarts.
+      restarted = EmbeddingsCache(max_size=1, disk_dir=disk_dir)
+      result = restarted.get('m', ['b'])
+      np.testing.assert_array_equal(result['b'], [3.0, 4.0])
+
+  def test_carry_over(self):
+    with tempfile.TemporaryDirectory() as disk_dir:
+      cache = EmbeddingsCache(max_size=2, disk_dir=disk_dir)
+      cache.put('m', {'a': np.array([1.0])})
+      cache.put('other', {'a': np.array([2.0])})
+
+      carried = cache.carry_over(['m'])
+      assert carried.stats()['size'] == 1
+      np.testing.assert_array_equal(carried.get('m', ['a'])['a'], [1.0])
+      # The entries of other models are also deleted from disk.
+      assert carried.get('other', ['a']) == {}
+      assert EmbeddingsCache(disk_dir=disk_dir).get('other', ['a']) == {}
+
+
+class TestCachedEmbeddingsModel(unittest.TestCase):
+
+  def test_tensor_model(self):
+    model = FakeModel(returns_tensor=True)
+    cached_model = CachedEmbeddingsModel(model, 'm', EmbeddingsCache())
+    assert cached_model.returns_tensor
+    assert cached_model.score_threshold == 0.5
+
+    result = cached_model.encode(['poverty', 'poverty in  ca', 'poverty'])
+    assert isinstance(result, torch.Tensor)
+    np.testing.assert_array_equal(result, [[7, 1], [13, 3], [7, 1]])
+    assert model.encoded == [['poverty', 'poverty in ca']]
+
+    # Only queries that are not cached (after normalizing) get encoded.
+    result = cached_model.encode([' poverty in ca', 'obesity'])
+    np.testing.assert_array_equal(result, [[13, 3], [7, 1]])
+    assert model.encoded == [['poverty', 'poverty in ca'], ['obesity']]
+
+    cached_model.encode(['obesity'])
+    assert len(model.encoded) == 2
+
+    assert cached_model.encode([]).shape == (0, 2)
+
+  def test_tensor_model_no_queries(self):
+    model = FakeModel(returns_tensor=True)
+    cached_model = CachedEmbeddingsModel(model, 'm', EmbeddingsCache())
+    # The dimension is not known yet, so the model encodes no queries.
+    result = cached_model.encode([])
+    assert isinstance(result, torch.Tensor)
+    assert result.shape == (0, 2)
+
+  def test_list_model(self):
+    model = FakeModel(returns_tensor=False)
+    cached_model = CachedEmbeddingsModel(model, 'm', EmbeddingsCache())
+    assert cached_model.encode(['a b']) == [[3.0, 2.0]]
+    assert cached_model.encode(['a b', 'c']) == [[3.0, 2.0], [1.0, 1.0]]
+    assert model.encoded == [['a b'], ['c']]
@@ -0,0 +1,149 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the exact match lookup before vector search."""
+
+import os
+from typing import List
+import unittest
+from unittest import mock
+
+from parameterized import parameterized
+
+from nl_server.config import MemoryIndexConfig
+from nl_server.embeddings import Embeddings
+from nl_server.embeddings import EmbeddingsMatch
+from nl_server.embeddings import EmbeddingsModel
+from nl_server.embeddings import EmbeddingsStore
+from nl_server.search import search_vars
+from nl_server.store.memory import MemoryEmbeddingsStore
+from nl_server.store.sentence_index import normalize
+from nl_server.store.sentence_index import SentenceIndex
+
+_TEST_DATA = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'test_data',
+    'custom.ft_final_v20230717230459.all-MiniLM-L6-v2.csv')
+
+
+class FakeModel(EmbeddingsModel):
+
+  def __init__(self):
+    super().__init__(score_threshold=0.5)
+    self.calls = []
+
+  def encode(self, queries: List[str]) -> List[List[float]]:
+    self.calls.append(queries)
+    return [[float(len(q))] for q in queries]
+
+
+class FakeStore(EmbeddingsStore):
+  """Has the sentences "poverty" (Count_Poverty) and "median income"
+  (Median_Income), and returns them for any query embedding."""
+
+  def __init__(self):
+    super().__init__(healthcheck_query='health')
+    self.sentences = ['poverty', 'median income']
+    self.dcids = ['Count_Poverty', 'Median_Income']
+    self.index = SentenceIndex(self.sentences)
+
+  def vector_search(self, query_embeddings, top_k):
+    return [[
+        EmbeddingsMatch(sentence='poverty', score=0.99, vars=['Count_Poverty']),
+        EmbeddingsMatch(sentence='median income',
+                        score=0.7,
+                        vars=['Median_Income']),
+    ] for _ in query_embeddings]
+
+  def exact_match(self, queries):
+    return [[
+        EmbeddingsMatch(sentence=self.sentences[row],
+                        score=1.0,
+                        vars=[self.dcids[row]]) for row in self.index.lookup(q)
+    ] for q in queries]
+
+
+class TestSentenceIndex(unittest.TestCase):
+
+  @parameterized.expand([
+      ('Life Expectancy', 'life expectancy'),
+      ('  life   expectancy?  ', 'life expectancy'),
+      ('Women-owned firms', 'women owned firms'),
+      ('(a) Food loss index', 'a food loss index'),
+      ('Population < 5', 'population < 5'),
+      ('population<5%', 'population < 5 %'),
+      ('Income in $', 'income in $'),
+      ('Food &amp; drinks', 'food & drinks'),
+  ])
+  def test_normalize(self, text, want):
+    assert normalize(text) == want
+
+  def test_lookup(self):
+    index = SentenceIndex(['Life expectancy', 'poverty', 'life expectancy.'])
+    assert len(index) == 2
+    assert index.lookup('LIFE EXPECTANCY') == [0, 2]
+    assert index.lookup('life expectancy in california') == []
+
+  def test_lookup_symbols(self):
+    index = SentenceIndex(['population < 5', 'population > 5', 'food & drinks'])
+    assert len(index) == 3
+    assert index.lookup('Population > 5') == [1]
+    assert index.lookup('population 5') == []
+    # Queries are html escaped by the routes.
+    assert index.lookup('population &lt; 5') == [0]
+    assert index.lookup('Food &amp; Drinks') == [2]
+
+
+class TestSearchVars(unittest.TestCase):
+
+  def test_exact_match(self):
+    model = FakeModel()
+    embeddings = Embeddings(model=model, store=FakeStore())
+    debug_logs = {}
+    got = search_vars([embeddings], ['Poverty', 'poor people'],
+                      debug_logs=debug_logs)
+
+    # Only the query without an exact match is encoded.
+    assert model.calls == [['poor people']]
+    assert debug_logs['sv_detection_exact_match_queries'] == ['Poverty']
+    assert got['Poverty'].svs == ['Count_Poverty']
+    assert got['Poverty'].scores == [1.0]
+    assert got['poor people'].svs == ['Count_Poverty', 'Median_Income']
+
+  def test_fill_exact_matches(self):
+    model = FakeModel()
+    embeddings = Embeddings(model=model, store=FakeStore())
+    got = search_vars([embeddings], ['poverty'], fill_exact_matches=True)
+    assert model.calls == [['poverty']]
+    assert got['poverty'].svs == ['Count_Poverty', 'Median_Income']
+    # The exact match is kept over the vector search match of its sentence.
+    assert got['poverty'].scores == [1.0, 0.7]
+
+  @mock.patch.dict('os.environ', {'NL_EXACT_MATCH': 'false'})
+  def test_disabled(self):
+    model = FakeModel()
+    embeddings = Embeddings(model=model, store=FakeStore())
+    got = search_vars([embeddings], ['poverty'])
+    assert model.calls == [['poverty']]
+    assert got['poverty'].scores == [0.99, 0.7]
+
+
+class TestMemoryStore(unittest.TestCase):
+
+  def test_exact_match(self):
+    store = MemoryEmbeddingsStore(MemoryIndexConfig(embeddings_path=_TEST_DATA))
+    got = store.exact_match(['zero  hunger', 'hunger'])
+    assert got == [[
+        EmbeddingsMatch(sentence='Zero Hunger',
+                        score=1.0,
+                        vars=['dc/topic/sdg_2'])
+    ], []]
@@ -0,0 +1,110 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the IVF approximate nearest neighbour index."""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import torch
+
+from nl_server.config import MemoryIndexConfig
+from nl_server.config import MemorySearchType
+from nl_server.store import ivf
+from nl_server.store.memory import MemoryEmbeddingsStore
+
+_TEST_DATA = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'test_data',
+    'custom.ft_final_v20230717230459.all-MiniLM-L6-v2.csv')
+
+
+def _clustered_embeddings(num_clusters=20, per_cluster=100, dim=32):
+  generator = torch.Generator().manual_seed(1)
+  centers = torch.randn(num_clusters, dim, generator=generator)
+  points = centers.repeat_interleave(per_cluster, dim=0) + 0.3 * torch.randn(
+      num_clusters * per_cluster, dim, generator=generator)
+  return torch.nn.functional.normalize(points, dim=1)
+
+
+class TestIVFIndex(unittest.TestCase):
+
+  def test_build(self):
+    embeddings = _clustered_embeddings()
+    index = ivf.IVFIndex.build(embeddings, nlist=20)
+    assert index.nlist == 20
+    # Every embedding is in exactly one list.
+    assert sorted(index.order.tolist()) == list(range(len(embeddings)))
+    assert int(index.offsets[-1]) == len(embeddings)
+
+  def test_search_all_lists_is_exact(self):
+    embeddings = _clustered_embeddings()
+    index = ivf.IVFIndex.build(embeddings, nlist=20)
+    queries = embeddings[:5]
+    hits = index.search(embeddings, queries, top_k=10, nprobe=20)
+    exact = torch.topk(queries @ embeddings.T, 10, dim=1)
+    for query_hits, ids, scores in zip(hits, exact.indices.tolist(),
+                                       exact.values.tolist()):
+      assert [h['corpus_id'] for h in query_hits] == ids
+      for hit, score in zip(query_hits, scores):
+        self.assertAlmostEqual(hit['score'], score, places=5)
+
+  def test_recall(self):
+    embeddings = _clustered_embeddings()
+    index = ivf.IVFIndex.build(embeddings, nlist=20)
+    assert ivf.recall_at_k(index, embeddings, top_k=10, nprobe=4) >= 0.9
+    assert ivf.recall_at_k(index, embeddings, top_k=10, nprobe=20) == 1.0
+
+  def test_fewer_vectors_than_lists(self):
+    embeddings = _clustered_embeddings(num_clusters=1, per_cluster=3)
+    index = ivf.IVFIndex.build(embeddings, nlist=10)
+    assert index.nlist == 3
+    hits = index.search(embeddings, embeddings[:1], top_k=10, nprobe=10)
+    assert len(hits[0]) == 3
+    assert hits[0][0]['corpus_id'] == 0
+
+  def test_load_or_build(self):
+    embeddings = _clustered_embeddings()
+    with tempfile.TemporaryDirectory() as cache_dir:
+      built = ivf.load_or_build(embeddings, 20, cache_dir)
+      assert len(os.listdir(cache_dir)) == 1
+      with mock.patch.object(ivf.IVFIndex, 'build') as build:
+        loaded = ivf.load_or_build(embeddings, 20, cache_dir)
+        build.assert_not_called()
+    assert torch.equal(built.centroids, loaded.centroids)
+    assert torch.equal(built.order, loaded.order)
+    assert torch.equal(built.offsets, loaded.offsets)
+
+
+class TestMemoryStoreIVF(unittest.TestCase):
+
+  def test_vector_search(self):
+    with tempfile.TemporaryDirectory() as cache_root:
+      with mock.patch('nl_server.store.memory.get_cache_root',
+                      return_value=cache_root):
+        exact_store = MemoryEmbeddingsStore(
+            MemoryIndexConfig(embeddings_path=_TEST_DATA))
+        ivf_store = MemoryEmbeddingsStore(
+            MemoryIndexConfig(embeddings_path=_TEST_DATA,
+                              search_type=MemorySearchType.IVF))
+    assert exact_store.ivf_index is None
+    assert ivf_store.ivf_index is not None
+    queries = exact_store.dataset_embeddings[:1]
+    exact = exact_store.vector_search(queries, top_k=5)
+    approx = ivf_store.vector_search(queries, top_k=5)
+    assert [[m.vars for m in r] for r in approx
+           ] == [[m.vars for m in r] for r in exact]
+    assert [[m.sentence for m in r] for r in approx
+           ] == [[m.sentence for m in r] for r in exact]
+    self.assertAlmostEqual(approx[0][0].score, exact[0][0].score, places=5)
@@ -0,0 +1,106 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the stage latency metrics."""
+
+from typing import List
+import unittest
+
+from nl_server import metrics
+from nl_server.embeddings import Embeddings
+from nl_server.embeddings import EmbeddingsMatch
+from nl_server.embeddings import EmbeddingsModel
+from nl_server.embeddings import EmbeddingsStore
+from nl_server.ranking import RerankingModel
+from nl_server.search import search_vars
+
+
+class FakeModel(EmbeddingsModel):
+
+  def __init__(self):
+    super().__init__(score_threshold=0.5)
+
+  def encode(self, queries: List[str]) -> List[List[float]]:
+    return [[1.0] for _ in queries]
+
+
+class FakeStore(EmbeddingsStore):
+
+  def __init__(self):
+    super().__init__(healthcheck_query='health')
+
+  def vector_search(self, query_embeddings, top_k):
+    return [[
+        EmbeddingsMatch(sentence='poverty', score=0.9, vars=['Count_Poverty'])
+    ] for _ in query_embeddings]
+
+
+class FakeReranker(RerankingModel):
+
+  def __init__(self):
+    self.model_name = 'fake_reranker'
+
+  def predict(self, query_sentence_pairs):
+    return [0.5 for _ in query_sentence_pairs]
+
+
+class TestMetrics(unittest.TestCase):
+
+  def test_histogram(self):
+    histogram = metrics.Histogram([1, 10])
+    for value in [0.5, 1, 5, 20]:
+      histogram.add(value)
+    assert histogram.to_dict() == {
+        'count': 4,
+        'mean': 6.625,
+        'buckets': {
+            '<=1': 2,
+            '<=10': 1,
+            '>10': 1
+        },
+    }
+
+  def test_timer(self):
+    stage_metrics = metrics.StageMetrics()
+    stage_metrics.record('encode', 'model', 3)
+    stage_metrics.record('encode', 'model', 7)
+    stage_metrics.record('search', 'index', 1)
+    stats = stage_metrics.stats()
+    assert sorted(stats) == ['encode', 'search']
+    assert stats['encode']['model']['count'] == 2
+    assert stats['encode']['model']['mean'] == 5
+
+    timings = {}
+    with metrics.timer('test_stage', 'label', timings):
+      pass
+    assert list(timings) == ['test_stage:label']
+    assert metrics.stats()['test_stage']['label']['count'] >= 1
+
+  def test_search_vars_timings(self):
+    embeddings = Embeddings(model=FakeModel(),
+                            store=FakeStore(),
+                            index_name='base',
+                            model_name='model')
+    before = metrics.stats().get('search', {}).get('base', {}).get('count', 0)
+    timings = {}
+    search_vars([embeddings], ['people in poverty'],
+                rerank_model=FakeReranker(),
+                debug_logs={},
+                timings=timings)
+
+    assert sorted(timings) == [
+        'encode:model', 'exact_match', 'merge', 'rank_vars',
+        'rerank:fake_reranker', 'rerank_predict:fake_reranker', 'search:base',
+        'search_vars', 'vector_search'
+    ]
+    assert metrics.stats()['search']['base']['count'] == before + 1
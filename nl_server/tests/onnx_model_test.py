@@ -0,0 +1,144 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the ONNX Runtime models, on tiny randomly initialized models."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sentence_transformers import CrossEncoder
+from sentence_transformers import models
+from sentence_transformers import SentenceTransformer
+import torch
+from transformers import BertConfig
+from transformers import BertForSequenceClassification
+from transformers import BertModel
+from transformers import BertTokenizer
+
+from nl_server.config import ModelType
+from nl_server.config import ModelUsage
+from nl_server.config import OnnxModelConfig
+from nl_server.model import onnx_model
+
+_WORDS = [
+    'health', 'life', 'expectancy', 'in', 'california', 'income', 'median',
+    'population', 'people', 'number', 'of', 'emissions', 'farms'
+]
+
+
+def _bert_config(**kwargs) -> BertConfig:
+  return BertConfig(vocab_size=5 + len(_WORDS),
+                    hidden_size=32,
+                    num_hidden_layers=2,
+                    num_attention_heads=2,
+                    intermediate_size=64,
+                    max_position_embeddings=64,
+                    **kwargs)
+
+
+def _save_tokenizer(folder: str) -> BertTokenizer:
+  vocab_file = os.path.join(folder, 'vocab.txt')
+  os.makedirs(folder, exist_ok=True)
+  with open(vocab_file, 'w') as f:
+    f.write('\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + _WORDS))
+  tokenizer = BertTokenizer(vocab_file)
+  tokenizer.save_pretrained(folder)
+  return tokenizer
+
+
+def _config(**kwargs) -> OnnxModelConfig:
+  return OnnxModelConfig(type=ModelType.ONNX, **kwargs)
+
+
+class TestOnnxModels(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    torch.manual_seed(0)
+    cls.tmp_dir = tempfile.mkdtemp()
+
+    transformer_dir = os.path.join(cls.tmp_dir, 'transformer')
+    _save_tokenizer(transformer_dir)
+    BertModel(_bert_config()).save_pretrained(transformer_dir)
+    transformer = models.Transformer(transformer_dir, max_seq_length=32)
+    pooling = models.Pooling(transformer.get_word_embedding_dimension())
+    cls.st_dir = os.path.join(cls.tmp_dir, 'sentence_transformer')
+    SentenceTransformer(
+        modules=[transformer, pooling, models.Normalize()]).save(cls.st_dir)
+
+    cls.ce_dir = os.path.join(cls.tmp_dir, 'cross_encoder')
+    _save_tokenizer(cls.ce_dir)
+    BertForSequenceClassification(_bert_config(num_labels=1)).save_pretrained(
+        cls.ce_dir)
+
+  @classmethod
+  def tearDownClass(cls):
+    shutil.rmtree(cls.tmp_dir)
+
+  def _model_dir(self, src):
+    # A fresh copy, so that each test exports its own ONNX files.
+    dst = tempfile.mkdtemp(dir=self.tmp_dir)
+    shutil.copytree(src, dst, dirs_exist_ok=True)
+    return dst
+
+  def test_sentence_transformer(self):
+    model_dir = self._model_dir(self.st_dir)
+    model = onnx_model.OnnxSentenceTransformerModel(_config(
+        usage=ModelUsage.EMBEDDINGS, quantize=False, tolerance=1e-4),
+                                                    model_path=model_dir)
+    assert os.path.exists(os.path.join(model_dir, 'onnx', 'model.onnx'))
+
+    queries = ['median income in california', 'farms']
+    want = SentenceTransformer(model_dir).encode(queries,
+                                                 convert_to_tensor=True)
+    got = model.encode(queries)
+    assert got.shape == want.shape
+    assert torch.allclose(got, want, atol=1e-4)
+
+  def test_sentence_transformer_quantized(self):
+    model_dir = self._model_dir(self.st_dir)
+    model = onnx_model.OnnxSentenceTransformerModel(_config(
+        usage=ModelUsage.EMBEDDINGS, quantize=True, tolerance=1),
+                                                    model_path=model_dir)
+    assert os.path.exists(os.path.join(model_dir, 'onnx', 'model.int8.onnx'))
+    assert model.encode(['health']).shape == (1, 32)
+
+    # A second load reuses the exported model.
+    mtime = os.path.getmtime(os.path.join(model_dir, 'onnx', 'model.int8.onnx'))
+    onnx_model.OnnxSentenceTransformerModel(_config(usage=ModelUsage.EMBEDDINGS,
+                                                    quantize=True,
+                                                    tolerance=1),
+                                            model_path=model_dir)
+    assert mtime == os.path.getmtime(
+        os.path.join(model_dir, 'onnx', 'model.int8.onnx'))
+
+  def test_tolerance(self):
+    with self.assertRaises(ValueError):
+      onnx_model.OnnxSentenceTransformerModel(
+          _config(usage=ModelUsage.EMBEDDINGS, quantize=True, tolerance=0),
+          model_path=self._model_dir(self.st_dir))
+
+  def test_cross_encoder(self):
+    model_dir = self._model_dir(self.ce_dir)
+    model = onnx_model.OnnxCrossEncoderModel(_config(usage=ModelUsage.RERANKING,
+                                                     quantize=False,
+                                                     tolerance=1e-4),
+                                             model_path=model_dir)
+    pairs = [['median income', 'income'], ['farms', 'number of farms']]
+    want = CrossEncoder(model_dir).predict(pairs)
+    got = model.predict(pairs)
+    assert len(got) == 2
+    for got_score, want_score in zip(got, want):
+      self.assertAlmostEqual(got_score, float(want_score), places=4)
@@ -0,0 +1,117 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for quantized embeddings."""
+
+import os
+import tempfile
+import unittest
+
+from parameterized import parameterized
+import torch
+
+from nl_server.config import MemoryIndexConfig
+from nl_server.config import MemoryQuantization
+from nl_server.config import MemorySearchType
+from nl_server.store import binary_embeddings
+from nl_server.store.memory import MemoryEmbeddingsStore
+from nl_server.store.quantize import QuantizedEmbeddings
+
+_TEST_DATA = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'test_data',
+    'custom.ft_final_v20230717230459.all-MiniLM-L6-v2.csv')
+
+
+def _embeddings(num=2000, dim=64):
+  generator = torch.Generator().manual_seed(1)
+  # Not normalized, like the embeddings of some models.
+  return 3 * torch.randn(num, dim, generator=generator)
+
+
+class TestQuantizedEmbeddings(unittest.TestCase):
+
+  @parameterized.expand([
+      (MemoryQuantization.FLOAT16, 2),
+      (MemoryQuantization.INT8, 1),
+  ])
+  def test_search(self, quantization, bytes_per_value):
+    embeddings = _embeddings()
+    quantized = QuantizedEmbeddings(embeddings, quantization)
+    assert quantized.nbytes == embeddings.nelement() * bytes_per_value
+
+    queries = embeddings[:20] + 0.5 * torch.randn(
+        20, 64, generator=torch.Generator().manual_seed(2))
+    hits = quantized.search(embeddings, queries, top_k=10, rescore_factor=4)
+    normalized = torch.nn.functional.normalize(embeddings, dim=1)
+    exact = torch.topk(
+        torch.nn.functional.normalize(queries, dim=1) @ normalized.T, 10)
+    found = 0
+    for query_hits, ids, scores in zip(hits, exact.indices.tolist(),
+                                       exact.values.tolist()):
+      found += len(set(ids) & set(h['corpus_id'] for h in query_hits))
+      # Scores are rescored in full precision.
+      self.assertAlmostEqual(query_hits[0]['score'], scores[0], places=5)
+    assert found / (10 * len(queries)) >= 0.95
+
+  def test_unsupported(self):
+    with self.assertRaises(ValueError):
+      QuantizedEmbeddings(_embeddings(), 'INT4')
+
+
+class TestMemoryStoreQuantized(unittest.TestCase):
+
+  def setUp(self):
+    self.exact_store = MemoryEmbeddingsStore(
+        MemoryIndexConfig(embeddings_path=_TEST_DATA))
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tmp_dir.cleanup)
+    self.folder = os.path.join(self.tmp_dir.name, 'embeddings_bin')
+
+  def _save(self, dtype):
+    binary_embeddings.save(self.folder,
+                           self.exact_store.dataset_embeddings.numpy(),
+                           self.exact_store.dcids,
+                           self.exact_store.sentences,
+                           dtype=dtype)
+
+  @parameterized.expand([
+      ('float32', torch.float32, 5),
+      ('float16', torch.float16, 2),
+  ])
+  def test_vector_search(self, dtype, torch_dtype, places):
+    self._save(dtype)
+    quantized_store = MemoryEmbeddingsStore(
+        MemoryIndexConfig(embeddings_path=self.folder,
+                          quantization=MemoryQuantization.INT8))
+    # The full precision embeddings are not converted to a float32 copy.
+    assert quantized_store.dataset_embeddings.dtype == torch_dtype
+    queries = self.exact_store.dataset_embeddings[:1]
+    exact = self.exact_store.vector_search(queries, top_k=5)
+    got = quantized_store.vector_search(queries, top_k=5)
+    assert [[m.vars for m in r] for r in got
+           ] == [[m.vars for m in r] for r in exact]
+    self.assertAlmostEqual(got[0][0].score, exact[0][0].score, places=places)
+
+  def test_csv_not_supported(self):
+    with self.assertRaises(ValueError):
+      MemoryEmbeddingsStore(
+          MemoryIndexConfig(embeddings_path=_TEST_DATA,
+                            quantization=MemoryQuantization.FLOAT16))
+
+  def test_ivf_not_supported(self):
+    self._save('float32')
+    with self.assertRaises(ValueError):
+      MemoryEmbeddingsStore(
+          MemoryIndexConfig(embeddings_path=self.folder,
+                            search_type=MemorySearchType.IVF,
+                            quantization=MemoryQuantization.FLOAT16))
@@ -0,0 +1,201 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for loading and reloading the registry."""
+
+import dataclasses
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from nl_server import query_cache
+from nl_server import registry
+from nl_server.config import MemoryIndexConfig
+from nl_server.config import ModelType
+from nl_server.config import ModelUsage
+from nl_server.config import ServerConfig
+from nl_server.config import VertexAIModelConfig
+from nl_server.embeddings import EmbeddingsModel
+from nl_server.embeddings import EmbeddingsStore
+
+
+class FakeModel(EmbeddingsModel):
+
+  def __init__(self, model_config):
+    super().__init__(score_threshold=0.5)
+
+  def encode(self, queries):
+    return [[1.0] for _ in queries]
+
+
+class FakeStore(EmbeddingsStore):
+
+  def __init__(self, idx_info):
+    super().__init__(healthcheck_query='health')
+    self.source_path = idx_info.source_path
+
+  def vector_search(self, query_embeddings, top_k):
+    return [[] for _ in query_embeddings]
+
+
+def _server_config(version='1') -> ServerConfig:
+  return ServerConfig(version=version,
+                      default_indexes=['base'],
+                      indexes={
+                          'base':
+                              MemoryIndexConfig(store_type='MEMORY',
+                                                source_path='base_' + version,
+                                                model='model'),
+                          'other':
+                              MemoryIndexConfig(store_type='MEMORY',
+                                                source_path='other_' + version,
+                                                model='model'),
+                      },
+                      models={
+                          'model':
+                              VertexAIModelConfig(type=ModelType.VERTEXAI,
+                                                  usage=ModelUsage.EMBEDDINGS,
+                                                  score_threshold=0.5)
+                      },
+                      enable_reranking=False)
+
+
+def _model_key(config: ServerConfig) -> str:
+  return query_cache.model_key('model', config.models['model'])
+
+
+@mock.patch.object(registry, 'AttributeModel', mock.Mock)
+@mock.patch.object(registry, 'MemoryEmbeddingsStore', FakeStore)
+class TestRegistry(unittest.TestCase):
+
+  @mock.patch.object(registry, 'create_embeddings_model')
+  def test_lazy_index(self, create_model):
+    create_model.side_effect = FakeModel
+    reg = registry.Registry(_server_config())
+
+    assert sorted(reg.name_to_emb) == ['base']
+    assert reg.load_stats()['notLoadedIndexes'] == ['other']
+    assert sorted(
+        reg.load_seconds) == ['attribute_model', 'index:base', 'model:model']
+
+    assert reg.get_index('other').store.source_path == 'other_1'
+    assert reg.load_stats()['notLoadedIndexes'] == []
+    assert reg.get_index('unknown') is None
+
+  @mock.patch.dict('os.environ', {'NL_LAZY_INDEXES': 'false'})
+  @mock.patch.object(registry, 'create_embeddings_model')
+  def test_eager_indexes(self, create_model):
+    create_model.side_effect = FakeModel
+    reg = registry.Registry(_server_config())
+    assert sorted(reg.name_to_emb) == ['base', 'other']
+
+  @mock.patch.object(registry, 'create_embeddings_model')
+  def test_concurrent_load(self, create_model):
+    # Only passes if the model and the default index load at the same time.
+    barrier = threading.Barrier(2)
+
+    def _create_model(model_config):
+      barrier.wait(timeout=10)
+      return FakeModel(model_config)
+
+    def _create_store(idx_info):
+      barrier.wait(timeout=10)
+      return FakeStore(idx_info)
+
+    create_model.side_effect = _create_model
+    with mock.patch.object(registry, 'MemoryEmbeddingsStore', _create_store):
+      reg = registry.Registry(_server_config())
+    assert reg.get_index('base').store.source_path == 'base_1'
+
+  @mock.patch.object(registry, 'create_embeddings_model')
+  def test_reload(self, create_model):
+    create_model.side_effect = FakeModel
+    old = registry.Registry(_server_config())
+    old.embeddings_cache.put(_model_key(_server_config()),
+                             {'q': np.array([1.0])})
+    old.embeddings_cache.put('removed', {'q': np.array([2.0])})
+    app_config = {registry.REGISTRY_KEY: old}
+    reloader = registry.Reloader()
+
+    with mock.patch.object(registry, 'config_reader') as config_reader:
+      config_reader.get_server_config.return_value = _server_config('2')
+      new = reloader.reload(app_config).result(timeout=10)
+
+    assert app_config[registry.REGISTRY_KEY] is new
+    assert new.server_config().version == '2'
+    assert new.get_index('base').store.source_path == 'base_2'
+    # The unchanged model is reused, with the caches of the new registry.
+    assert create_model.call_count == 1
+    assert new.get_embedding_model('model').model is old.get_embedding_model(
+        'model').model
+    assert new.get_embedding_model('model').cache is new.embeddings_cache
+    # Only the cached embeddings of the reused model are carried over.
+    assert list(new.embeddings_cache.get(_model_key(new.server_config()),
+                                         ['q'])) == ['q']
+    assert new.embeddings_cache.get('removed', ['q']) == {}
+    assert reloader.status()['state'] == 'done'
+
+  @mock.patch.object(registry, 'create_embeddings_model')
+  def test_reload_changed_model(self, create_model):
+    create_model.side_effect = FakeModel
+    old = registry.Registry(_server_config())
+    old.embeddings_cache.put(_model_key(_server_config()),
+                             {'q': np.array([1.0])})
+
+    config = _server_config('2')
+    config.models['model'] = dataclasses.replace(config.models['model'],
+                                                 score_threshold=0.7)
+    new = registry.Registry(config, previous=old)
+    assert create_model.call_count == 2
+    assert new.embeddings_cache.get(_model_key(_server_config()), ['q']) == {}
+
+  @mock.patch.object(registry, 'create_embeddings_model')
+  def test_restart_changed_model(self, create_model):
+    create_model.side_effect = FakeModel
+    with tempfile.TemporaryDirectory() as disk_dir, mock.patch.dict(
+        'os.environ', {'NL_EMBEDDINGS_CACHE_DIR': disk_dir}):
+      old = registry.Registry(_server_config())
+      old.get_embedding_model('model').encode(['q'])
+
+      # The cached embeddings on disk are used after a restart with the same
+      # model config, but not with a changed one.
+      restarted = registry.Registry(_server_config())
+      restarted.get_embedding_model('model').encode(['q'])
+      assert restarted.embeddings_cache.stats()['diskHits'] == 1
+
+      config = _server_config()
+      config.models['model'] = dataclasses.replace(config.models['model'],
+                                                   project_id='other')
+      changed = registry.Registry(config)
+      changed.get_embedding_model('model').encode(['q'])
+      assert changed.embeddings_cache.stats()['diskHits'] == 0
+      assert changed.embeddings_cache.stats()['misses'] == 1
+
+  @mock.patch.object(registry, 'create_embeddings_model')
+  def test_failed_reload(self, create_model):
+    create_model.side_effect = FakeModel
+    old = registry.Registry(_server_config())
+    app_config = {registry.REGISTRY_KEY: old}
+    reloader = registry.Reloader()
+
+    with mock.patch.object(registry, 'config_reader') as config_reader:
+      config_reader.get_server_config.side_effect = ValueError('bad catalog')
+      with self.assertRaises(ValueError):
+        reloader.reload(app_config).result(timeout=10)
+
+    # The old registry keeps serving.
+    assert app_config[registry.REGISTRY_KEY] is old
+    assert reloader.status() == {'state': 'failed', 'error': 'bad catalog'}
@@ -0,0 +1,78 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the rerank score cache."""
+
+import tempfile
+import threading
+from typing import List
+import unittest
+
+from nl_server.ranking import RerankingModel
+from nl_server.rerank_cache import CachedRerankingModel
+from nl_server.rerank_cache import RerankScoreCache
+
+
+class FakeRerankingModel(RerankingModel):
+
+  def __init__(self):
+    self.calls = []
+    self.lock = threading.Lock()
+
+  def predict(self, query_sentence_pairs: List) -> List[float]:
+    with self.lock:
+      self.calls.append(query_sentence_pairs)
+    return [float(len(q) + len(s)) for q, s in query_sentence_pairs]
+
+
+class TestRerankScoreCache(unittest.TestCase):
+
+  def test_lru(self):
+    cache = RerankScoreCache(max_size=2)
+    cache.put('model', {('a', 'x'): 1.0, ('b', 'x'): 2.0})
+    # Touch ('a', 'x') so that ('b', 'x') is the least recently used.
+    assert cache.get('model', [('a', 'x')]) == {('a', 'x'): 1.0}
+    cache.put('model', {('c', 'x'): 3.0})
+    assert cache.get('model', [('a', 'x'), ('b', 'x'), ('c', 'x')]) == {
+        ('a', 'x'): 1.0,
+        ('c', 'x'): 3.0
+    }
+    # Scores are per model.
+    assert cache.get('other', [('a', 'x')]) == {}
+    stats = cache.stats()
+    assert stats['hits'] == 3
+    assert stats['misses'] == 2
+
+  def test_disk(self):
+    with tempfile.TemporaryDirectory() as disk_dir:
+      RerankScoreCache(disk_dir=disk_dir).put('model', {('a', 'x'): 1.5})
+      cache = RerankScoreCache(disk_dir=disk_dir)
+      assert cache.get('model', [('a', 'x')]) == {('a', 'x'): 1.5}
+      assert cache.stats()['diskHits'] == 1
+
+
+class TestCachedRerankingModel(unittest.TestCase):
+
+  def test_predict(self):
+    model = FakeRerankingModel()
+    cached = CachedRerankingModel(model, 'model', RerankScoreCache())
+
+    pairs = [['q', 'aa'], ['q', 'bbb'], ['q', 'c'], ['q', 'aa']]
+    assert cached.predict(pairs) == [3.0, 4.0, 2.0, 3.0]
+    # Unique pairs are predicted in one call.
+    assert model.calls == [[['q', 'aa'], ['q', 'bbb'], ['q', 'c']]]
+
+    model.calls.clear()
+    # Cached pairs (with the query whitespace normalized) are not predicted.
+    assert cached.predict([['q ', 'aa'], ['q', 'dddd']]) == [3.0, 5.0]
+    assert model.calls == [[['q', 'dddd']]]
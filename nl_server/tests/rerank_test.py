@@ -139,3 +139,51 @@ class TestReank(unittest.TestCase):
         debug_logs=dummy_logs)
 
     self.assertEqual(want, var_candidates_to_dict(got[query]))
+
+  def test_max_candidates(self):
+    query = 'poverty'
+    candidates = dict_to_var_candidates({
+        'SV': ['sv1', 'sv2', 'sv3'],
+        'CosineScore': [0.9, 0.8, 0.7],
+        'SV_to_Sentences': {
+            'sv1': [{
+                'sentence': 's1a',
+                'score': 0.9
+            }, {
+                'sentence': 's1b',
+                'score': 0.85
+            }],
+            'sv2': [{
+                'sentence': 's2',
+                'score': 0.8
+            }],
+            'sv3': [{
+                'sentence': 's3',
+                'score': 0.7
+            }],
+        }
+    })
+    got_api_input = []
+
+    class RerankModel:
+
+      def predict(local_self, pairs):
+        got_api_input.extend(pairs)
+        return [{'s1a': 1, 's2': 2}[s] for _, s in pairs]
+
+    debug_logs = {}
+    got = rerank.rerank(rerank_model=RerankModel(),
+                        query2candidates={query: candidates},
+                        debug_logs=debug_logs,
+                        max_candidates=2,
+                        max_sentences=1)
+
+    # Only the top sentence of the top 2 SVs is reranked.
+    self.assertEqual([[query, 's1a'], [query, 's2']], got_api_input)
+    # The SV that was not reranked goes last.
+    self.assertEqual(['sv2', 'sv1', 'sv3'], got[query].svs)
+    self.assertEqual([0.8, 0.9, 0.7], got[query].scores)
+    self.assertEqual([1, None],
+                     [s.rerank_score for s in got[query].sv2sentences['sv1']])
+    self.assertEqual(2, debug_logs['reranking_num_pairs'])
+    self.assertIn('time_rerank_predict', debug_logs)
@@ -0,0 +1,83 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for searching multiple indexes."""
+
+import threading
+from typing import List
+import unittest
+
+from nl_server.embeddings import Embeddings
+from nl_server.embeddings import EmbeddingsMatch
+from nl_server.embeddings import EmbeddingsModel
+from nl_server.embeddings import EmbeddingsStore
+from nl_server.search import search_vars
+
+
+class FakeModel(EmbeddingsModel):
+
+  def __init__(self):
+    super().__init__(score_threshold=0.5)
+    self.calls = []
+
+  def encode(self, queries: List[str]) -> List[List[float]]:
+    self.calls.append(queries)
+    return [[float(len(q))] for q in queries]
+
+
+class FakeStore(EmbeddingsStore):
+
+  def __init__(self, matches: List[EmbeddingsMatch],
+               barrier: threading.Barrier):
+    super().__init__(healthcheck_query='health')
+    self.matches = matches
+    self.barrier = barrier
+
+  def vector_search(self, query_embeddings, top_k):
+    # Only passes if all the stores are searched at the same time.
+    self.barrier.wait(timeout=10)
+    return [self.matches[:top_k] for _ in query_embeddings]
+
+
+class TestSearchVars(unittest.TestCase):
+
+  def test_multiple_indexes(self):
+    model = FakeModel()
+    barrier = threading.Barrier(2)
+    base = Embeddings(
+        model=model,
+        store=FakeStore([
+            EmbeddingsMatch(
+                sentence='poverty', score=0.9, vars=['Count_Poverty']),
+            EmbeddingsMatch(
+                sentence='income', score=0.6, vars=['Median_Income']),
+        ], barrier))
+    custom = Embeddings(
+        model=model,
+        store=FakeStore([
+            EmbeddingsMatch(
+                sentence='poor people', score=0.8, vars=['Custom_Poverty']),
+            EmbeddingsMatch(
+                sentence='poverty rate', score=0.7, vars=['Count_Poverty']),
+        ], barrier))
+
+    got = search_vars([base, custom], ['poverty'])
+
+    # The queries are encoded once for both indexes.
+    assert model.calls == [['poverty']]
+    assert got['poverty'].svs == [
+        'Count_Poverty', 'Custom_Poverty', 'Median_Income'
+    ]
+    assert got['poverty'].scores == [0.9, 0.8, 0.6]
+    assert [s.sentence for s in got['poverty'].sv2sentences['Count_Poverty']
+           ] == ['poverty', 'poverty rate']
@@ -0,0 +1,136 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for sharing embeddings and model weights across processes."""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import torch
+
+from nl_server import shared_memory
+from nl_server.config import MemoryIndexConfig
+from nl_server.config import MemorySearchType
+from nl_server.store.memory import MemoryEmbeddingsStore
+
+_TEST_DATA = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'test_data',
+    'custom.ft_final_v20230717230459.all-MiniLM-L6-v2.csv')
+
+
+class TestSharedMemory(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    env = mock.patch.dict('os.environ', {
+        'NL_SHARED_MEMORY': 'true',
+        'NL_SHARED_MEMORY_DIR': self.tmp_dir.name,
+    })
+    env.start()
+    self.addCleanup(env.stop)
+    self.addCleanup(self.tmp_dir.cleanup)
+    self.addCleanup(
+        lambda: [shared_memory._release(p) for p in list(shared_memory._held)])
+
+  def test_share_matrix(self):
+    calls = []
+
+    def _matrix():
+      calls.append(1)
+      return np.arange(6, dtype=np.float64).reshape(2, 3)
+
+    first = shared_memory.share_matrix('m', _matrix)
+    second = shared_memory.share_matrix('m', _matrix)
+    # Only computed by the first caller.
+    assert len(calls) == 1
+    assert first.dtype == torch.float32
+    assert torch.equal(first, second)
+    assert first.tolist() == [[0, 1, 2], [3, 4, 5]]
+
+  def test_remove_previous_versions(self):
+    source = os.path.join(self.tmp_dir.name, 'source.txt')
+    with open(source, 'w') as f:
+      f.write('v1')
+    old_key = shared_memory.source_key(source)
+    old = shared_memory.share_matrix(f'm_{old_key}', lambda: np.ones((2, 2)))
+    other = shared_memory.share_matrix('other', lambda: np.ones((2, 2)))
+    with open(source, 'w') as f:
+      f.write('v2 with another size')
+    new_key = shared_memory.source_key(source)
+    assert new_key.split('-')[0] == old_key.split('-')[0]
+    assert new_key != old_key
+
+    shared_memory.share_matrix(f'm_{new_key}', lambda: np.zeros((2, 2)))
+    names = os.listdir(self.tmp_dir.name)
+    assert f'm_{new_key}.npy' in names
+    assert f'm_{old_key}.npy' not in names
+    assert 'other.npy' in names
+    # The removed file can still be read by the processes that map it.
+    assert old.tolist() == [[1, 1], [1, 1]]
+    assert other.tolist() == [[1, 1], [1, 1]]
+
+  def test_remove_unused(self):
+    shared_memory.share_matrix('used', lambda: np.ones((2, 2)))
+    for name in ['unused.npy', 'used.npy.123.tmp']:
+      with open(os.path.join(self.tmp_dir.name, name), 'w') as f:
+        f.write('data')
+    os.makedirs(os.path.join(self.tmp_dir.name, 'unused_folder'))
+
+    shared_memory.remove_unused()
+    names = os.listdir(self.tmp_dir.name)
+    assert 'used.npy' in names
+    for name in ['unused.npy', 'unused_folder', 'used.npy.123.tmp']:
+      assert name not in names
+
+  def test_share_weights(self):
+    torch.manual_seed(0)
+    module = torch.nn.Linear(4, 2)
+    inputs = torch.randn(3, 4)
+    want = module(inputs)
+
+    shared_memory.share_weights(module, 'linear')
+    assert os.path.exists(os.path.join(self.tmp_dir.name, 'linear.pt'))
+    assert torch.allclose(module(inputs), want)
+
+  def test_memory_store(self):
+    with mock.patch.dict('os.environ', {'NL_SHARED_MEMORY': ''}):
+      want = MemoryEmbeddingsStore(
+          MemoryIndexConfig(embeddings_path=_TEST_DATA))
+    got = MemoryEmbeddingsStore(MemoryIndexConfig(embeddings_path=_TEST_DATA))
+    assert got.shared_key
+    assert os.path.isdir(
+        os.path.join(self.tmp_dir.name, f'embeddings_{got.shared_key}'))
+    assert got.dcids == want.dcids
+    assert torch.equal(got.dataset_embeddings, want.dataset_embeddings)
+
+    queries = want.dataset_embeddings[:1]
+    assert [
+        [m.vars for m in r] for r in got.vector_search(queries, top_k=5)
+    ] == [[m.vars for m in r] for r in want.vector_search(queries, top_k=5)]
+
+  def test_memory_store_ivf(self):
+    store = MemoryEmbeddingsStore(
+        MemoryIndexConfig(embeddings_path=_TEST_DATA,
+                          search_type=MemorySearchType.IVF))
+    assert os.path.exists(
+        os.path.join(self.tmp_dir.name, f'normalized_{store.shared_key}.npy'))
+    queries = store.dataset_embeddings[:1]
+    assert store.vector_search(queries,
+                               top_k=1)[0][0].vars == store.dcids[0].split(';')
+
+  def test_memory_stats(self):
+    stats = shared_memory.memory_stats()
+    assert stats['VmRSS'] > 0
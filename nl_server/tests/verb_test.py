@@ -14,6 +14,7 @@
 """Tests for verbs (in nl_attribute_model.py)."""
 
 import unittest
+from unittest import mock
 
 from parameterized import parameterized
 
@@ -45,3 +46,21 @@ class TestVerbs(unittest.TestCase):
   def test_verb_detection(self, query_str, expected):
     got = self.nl_model.detect_verbs(query_str)
     self.assertEqual(expected, got)
+
+  def test_detect_verbs_batch(self):
+    queries = [
+        'tell me about palo alto', 'GDP of Africa', 'tell  me about palo alto'
+    ]
+    got = self.nl_model.detect_verbs_batch(queries)
+    self.assertEqual([['tell'], [], ['tell']], got)
+    # Same as one query at a time.
+    self.assertEqual([self.nl_model.detect_verbs(q) for q in queries], got)
+
+  def test_cache(self):
+    model = AttributeModel()
+    model.detect_verbs('How to write scholarship essay')
+    with mock.patch.object(model.spacy_model_, 'pipe') as pipe:
+      # Cached by normalized query.
+      self.assertEqual(['write'],
+                       model.detect_verbs('How to  write scholarship essay '))
+      pipe.assert_not_called()
@@ -80,6 +80,12 @@ class Config:
   MAP_TOOL_FOOTER = ""
   # The default property to use for getting geojsons
   GEO_JSON_PROP = "geoJsonCoordinates"
+  # Folder (local path or gs:// URL) holding the Cloud-Optimized GeoTIFFs
+  # served by the choropleth raster endpoints. Defaults to the server folder.
+  RASTER_ROOT = ''
+  # Local folder that background export jobs spool their files to. Defaults to
+  # a folder in the system temp folder.
+  EXPORT_JOB_DIR = ''
   # Optional: Override the stat var hierarchy root nodes with these filters.
   # Example: Set to "dc/g/SDG" to only show SDG variables.
   # Typedef in static/js/tools/stat_var/stat_var_hierarchy_config.ts
@@ -98,3 +104,7 @@ class Config:
   # Whether to enable BigQuery for instance. This is primarily used for
   # accessing the observation browser pages.
   ENABLE_BQ = False
+  # Whether /api/place/coords2places resolves coordinates against the cached
+  # geojsons before calling the mixer (see lib/coords_resolver.py). Check the
+  # agreement with the mixer with tools/coords2places_differ before enabling.
+  ENABLE_LOCAL_COORDS2PLACES = False
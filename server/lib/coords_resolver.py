@@ -0,0 +1,152 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Resolves coordinates to places locally using point-in-polygon lookups.
+
+The boundaries come from the geojsons that are cached in the app config (see
+CACHED_GEOJSON_FILES in lib/util.py). Those boundaries are simplified, so a
+coordinate is only resolved locally when it falls inside exactly one polygon
+and is not too close to that polygon's boundary. Every other coordinate should
+be resolved by the mixer.
+"""
+
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+
+# Coordinates closer than this many degrees to the (simplified) boundary of a
+# place are not resolved locally, keyed by place type. These must be at least
+# the simplification error of the boundaries: for countries, the coarsest
+# boundaries that are used (*_country_dp13) are up to 0.3 degrees (Hausdorff
+# distance) away from the finer *_country_dp10 and *_country_dp6 ones.
+_BOUNDARY_TOLERANCE_DEGREES = {
+    'Country': 0.35,
+}
+_DEFAULT_BOUNDARY_TOLERANCE_DEGREES = 0.005
+
+_POLYGON_TYPES = set(['Polygon', 'MultiPolygon'])
+
+# Dict of (place type, geojson prop) to PolygonIndex. The value is None if
+# there are no cached boundaries for that place type.
+_INDEXES: Dict[Tuple[str, str], Optional['PolygonIndex']] = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+class PolygonIndex:
+  """An R-tree over place boundaries that answers batch point lookups."""
+
+  def __init__(self, features: List[Dict], boundary_tolerance: float):
+    """
+    Args:
+      features: geojson features with a geoDcid and name in their properties.
+      boundary_tolerance: coordinates closer than this many degrees to the
+        boundary of the place they fall in are left unresolved.
+    """
+    self.dcids = []
+    self.names = {}
+    geometries = []
+    for feature in features:
+      geometry = feature.get('geometry') or {}
+      dcid = feature.get('properties', {}).get('geoDcid', '')
+      if not dcid or geometry.get('type') not in _POLYGON_TYPES:
+        continue
+      self.dcids.append(dcid)
+      self.names[dcid] = feature['properties'].get('name', '')
+      geometries.append(shape(geometry))
+    self._geometries = np.array(geometries, dtype=object)
+    self._boundaries = shapely.boundary(self._geometries)
+    self._tree = shapely.STRtree(self._geometries)
+    self._boundary_tolerance = boundary_tolerance
+
+  def __len__(self):
+    return len(self.dcids)
+
+  def resolve(self, coordinates: List[Tuple[float, float]]) -> List[str]:
+    """Resolves a batch of (latitude, longitude) coordinates.
+
+    Returns a list with the dcid of the place for each coordinate, or an
+    empty string if the coordinate could not be resolved locally.
+    """
+    result = [''] * len(coordinates)
+    if not coordinates or not self.dcids:
+      return result
+    lats, lons = zip(*coordinates)
+    points = shapely.points(lons, lats)
+    point_idx, geo_idx = self._tree.query(points, predicate='within')
+    hits = np.bincount(point_idx, minlength=len(coordinates))
+    distances = shapely.distance(points[point_idx], self._boundaries[geo_idx])
+    for p, g, d in zip(point_idx, geo_idx, distances):
+      if hits[p] == 1 and d > self._boundary_tolerance:
+        result[p] = self.dcids[g]
+    return result
+
+
+def _num_coordinates(feature: Dict) -> int:
+  geometry = feature.get('geometry') or {}
+  if geometry.get('type') not in _POLYGON_TYPES:
+    return 0
+  return shapely.get_num_coordinates(shape(geometry))
+
+
+def _finest_features(place_type: str, geojson_prop: str,
+                     cached_geojsons: Dict) -> Dict[str, Dict]:
+  """Gets the feature with the finest boundary (the most coordinates) of each
+  place, since a place can be in several cached geojsons that are simplified
+  to different levels (eg. earth_country_dp13 and europe_country_dp6)."""
+  features = {}
+  num_coordinates = {}
+  for geojsons_by_type in cached_geojsons.values():
+    geojson = geojsons_by_type.get(place_type, {}).get(geojson_prop, {})
+    for feature in geojson.get('features', []):
+      dcid = feature.get('properties', {}).get('geoDcid', '')
+      if not dcid:
+        continue
+      count = _num_coordinates(feature)
+      if dcid not in features or count > num_coordinates[dcid]:
+        features[dcid] = feature
+        num_coordinates[dcid] = count
+  return features
+
+
+def get_index(place_type: str, geojson_prop: str,
+              cached_geojsons: Dict) -> Optional[PolygonIndex]:
+  """Gets the polygon index for a place type, building it on first use.
+
+  Args:
+    place_type: place type to resolve coordinates to.
+    geojson_prop: geojson property of the cached geojsons to use.
+    cached_geojsons: the CACHED_GEOJSONS app config.
+
+  Returns:
+    The index, or None if there are no cached boundaries for the place type.
+  """
+  key = (place_type, geojson_prop)
+  if key in _INDEXES:
+    return _INDEXES[key]
+  with _INDEXES_LOCK:
+    if key not in _INDEXES:
+      features = list(
+          _finest_features(place_type, geojson_prop, cached_geojsons).values())
+      index = None
+      if features:
+        tolerance = _BOUNDARY_TOLERANCE_DEGREES.get(
+            place_type, _DEFAULT_BOUNDARY_TOLERANCE_DEGREES)
+        index = PolygonIndex(features, tolerance)
+        logging.info('Built coordinate index for %s with %d places', place_type,
+                     len(index))
+      _INDEXES[key] = index
+  return _INDEXES[key]
@@ -0,0 +1,237 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Background jobs that build data export files.
+
+Export files are built by a thread pool and spooled to a local folder. The id
+of a job is a hash of the export request, so identical exports share a job and
+its result. The status of each job is kept in a json file next to the result,
+which lets every server process sharing the folder poll the job and serve the
+result.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import BinaryIO, Callable, Dict, Optional
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Max number of exports to build at the same time in a server process.
+_MAX_WORKERS = 2
+# How long a built export is served before it gets rebuilt. Jobs that have not
+# been updated for this long are deleted by sweep().
+_RESULT_TTL_SECONDS = 3600 * 24
+# Min time between two sweeps of the spool folder by a server process.
+_SWEEP_INTERVAL_SECONDS = 3600
+# A pending or running job that has not reported progress for this long is
+# considered dead (eg. the process building it was restarted) and is
+# resubmitted.
+_STALE_JOB_SECONDS = 15 * 60
+
+# A function that writes an export to a file, and reports progress by calling
+# the progress function with (number of shards done, total number of shards).
+BuildFn = Callable[[BinaryIO, Callable[[int, int], None]], None]
+
+_JOB_ID_RE = re.compile(r'^[0-9a-f]{64}$')
+
+_MANAGERS: Dict[str, 'ExportJobs'] = {}
+_MANAGERS_LOCK = threading.Lock()
+
+
+def job_id(request_json: Dict) -> str:
+  """Gets the id of the job for an export request."""
+  key = json.dumps(request_json, sort_keys=True, separators=(',', ':'))
+  return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class ExportJobs:
+  """Builds export files in the background and tracks their status."""
+
+  def __init__(self, spool_dir: str, max_workers: int = _MAX_WORKERS):
+    self._spool_dir = spool_dir
+    os.makedirs(spool_dir, exist_ok=True)
+    self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                        thread_name_prefix='export_job')
+    # Guards checking whether a job needs to run and submitting it.
+    self._lock = threading.Lock()
+    # Deletes the jobs expired while the server was down.
+    self._last_sweep = 0.0
+    self.sweep()
+
+  def _status_path(self, job_id: str) -> str:
+    return os.path.join(self._spool_dir, job_id + '.json')
+
+  def _result_path(self, job_id: str, filename: str) -> str:
+    _, extension = os.path.splitext(filename)
+    return os.path.join(self._spool_dir, job_id + extension)
+
+  def _write_status(self, job_id: str, status: Dict):
+    status = dict(status, updated=time.time())
+    path = self._status_path(job_id)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+      json.dump(status, f)
+    os.replace(tmp_path, path)
+
+  def _update_status(self, job_id: str, **kwargs):
+    status = self.status(job_id) or {}
+    status.update(kwargs)
+    self._write_status(job_id, status)
+
+  def status(self, job_id: str) -> Optional[Dict]:
+    """Gets the status of a job, or None if there is no such job."""
+    if not _JOB_ID_RE.match(job_id):
+      return None
+    try:
+      with open(self._status_path(job_id)) as f:
+        return json.load(f)
+    except (FileNotFoundError, ValueError):
+      return None
+
+  def result_path(self, job_id: str) -> Optional[str]:
+    """Gets the path of the result of a job, or None if it is not done."""
+    status = self.status(job_id)
+    if not status or status.get('status') != DONE:
+      return None
+    path = self._result_path(job_id, status['filename'])
+    if not os.path.exists(path):
+      return None
+    return path
+
+  def _is_live(self, status: Optional[Dict]) -> bool:
+    """Returns whether a job is done or still being built."""
+    if not status:
+      return False
+    age = time.time() - status.get('updated', 0)
+    if status.get('status') == DONE:
+      return age < _RESULT_TTL_SECONDS and os.path.exists(
+          self._result_path(status['jobId'], status['filename']))
+    if status.get('status') in (PENDING, RUNNING):
+      return age < _STALE_JOB_SECONDS
+    return False
+
+  def sweep(self) -> int:
+    """Deletes the status and files of the jobs that have not been updated for
+    the result TTL, i.e. expired results and long dead jobs.
+
+    Returns:
+      The number of jobs deleted.
+    """
+    with self._lock:
+      return self._sweep()
+
+  def _sweep(self) -> int:
+    now = time.time()
+    self._last_sweep = now
+    names = os.listdir(self._spool_dir)
+    deleted = 0
+    for name in names:
+      job_id, extension = os.path.splitext(name)
+      if extension != '.json' or not _JOB_ID_RE.match(job_id):
+        continue
+      status = self.status(job_id)
+      if not status or now - status.get('updated', 0) < _RESULT_TTL_SECONDS:
+        continue
+      # The result and any tmp file first, so that a job with a status always
+      # has its files.
+      for other in names:
+        if other.startswith(job_id) and other != name:
+          self._remove(os.path.join(self._spool_dir, other))
+      self._remove(self._status_path(job_id))
+      deleted += 1
+    if deleted:
+      logging.info('Deleted %d expired export jobs', deleted)
+    return deleted
+
+  def _remove(self, path: str):
+    try:
+      os.remove(path)
+    except FileNotFoundError:
+      # Deleted by another process sharing the spool folder.
+      pass
+
+  def submit(self, job_id: str, filename: str, mimetype: str,
+             build: BuildFn) -> Dict:
+    """Submits a job to build an export, unless the same export is already
+    built or being built.
+
+    Args:
+      job_id: id of the job, see job_id().
+      filename: file name to download the result as.
+      mimetype: mimetype of the result.
+      build: function that writes the export.
+
+    Returns:
+      The status of the job.
+    """
+    with self._lock:
+      if time.time() - self._last_sweep >= _SWEEP_INTERVAL_SECONDS:
+        self._sweep()
+      status = self.status(job_id)
+      if self._is_live(status):
+        return status
+      status = {
+          'jobId': job_id,
+          'status': PENDING,
+          'filename': filename,
+          'mimetype': mimetype,
+          'shardsDone': 0,
+          'numShards': 0,
+          'created': time.time(),
+      }
+      self._write_status(job_id, status)
+      self._executor.submit(self._run, job_id, filename, build)
+    return self.status(job_id)
+
+  def _run(self, job_id: str, filename: str, build: BuildFn):
+    path = self._result_path(job_id, filename)
+    # Suffixed with the process id in case another process sharing the spool
+    # folder resubmits the same job.
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+      self._update_status(job_id, status=RUNNING)
+
+      def progress(shards_done, num_shards):
+        self._update_status(job_id,
+                            shardsDone=shards_done,
+                            numShards=num_shards)
+
+      with open(tmp_path, 'wb') as f:
+        build(f, progress)
+      os.replace(tmp_path, path)
+      self._update_status(job_id, status=DONE, size=os.path.getsize(path))
+    except Exception:
+      logging.exception('Export job %s failed', job_id)
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+      self._update_status(job_id, status=FAILED)
+
+
+def get_export_jobs(spool_dir: str) -> ExportJobs:
+  """Gets the export job manager for a spool folder, creating it on first
+  use."""
+  if spool_dir in _MANAGERS:
+    return _MANAGERS[spool_dir]
+  with _MANAGERS_LOCK:
+    if spool_dir not in _MANAGERS:
+      _MANAGERS[spool_dir] = ExportJobs(spool_dir)
+  return _MANAGERS[spool_dir]
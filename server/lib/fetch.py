@@ -425,6 +425,32 @@ def raw_property_values(nodes, prop, out=True, constraints=''):
   return result
 
 
+def multiple_property_values(nodes, props, out=True):
+  """Returns compact property values for several properties in one call.
+
+  The response is the following format:
+  {
+    <node_dcid>: {
+      <prop>: [value list]
+    }
+  }
+  """
+  resp = dc.v2node(nodes, '{}[{}]'.format('->' if out else '<-',
+                                          ', '.join(props)))
+  result = {}
+  for node, node_arcs in resp.get('data', {}).items():
+    result[node] = {}
+    arcs = node_arcs.get('arcs', {})
+    for prop in props:
+      result[node][prop] = []
+      for v in arcs.get(prop, {}).get('nodes', []):
+        if 'dcid' in v:
+          result[node][prop].append(v['dcid'])
+        elif 'value' in v:
+          result[node][prop].append(v['value'])
+  return result
+
+
 def triples(nodes, out=True):
   """Fetch triples for given nodes.
 
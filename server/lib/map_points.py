@@ -0,0 +1,126 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Helpers to filter and cluster map points on the server.
+
+Points are dicts of the form returned by the /api/choropleth/map-points
+endpoint: { placeDcid, placeName, latitude, longitude }.
+"""
+
+import math
+from typing import Dict, List, Optional, Tuple
+
+# Size of a web mercator tile in pixels.
+TILE_SIZE_PX = 256
+# Points that fall in the same square of this many pixels (at the requested
+# zoom) get grouped into one cluster.
+CLUSTER_CELL_SIZE_PX = 64
+# At or above this zoom, points are returned as-is without clustering.
+MAX_CLUSTER_ZOOM = 16
+# Latitude limit of the web mercator projection.
+_MAX_MERCATOR_LAT = 85.05112878
+
+# (west, south, east, north) in degrees
+BBox = Tuple[float, float, float, float]
+
+
+def parse_bbox(bbox_str: str) -> Optional[BBox]:
+  """Parses a "west,south,east,north" string into a bbox tuple.
+
+  Returns None if the string is not a valid bbox. West may be greater than
+  east for a bbox that crosses the antimeridian.
+  """
+  parts = bbox_str.split(',')
+  if len(parts) != 4:
+    return None
+  try:
+    west, south, east, north = [float(p) for p in parts]
+  except ValueError:
+    return None
+  if south > north or not (-90 <= south <= 90 and -90 <= north <= 90):
+    return None
+  if not (-180 <= west <= 180 and -180 <= east <= 180):
+    return None
+  return (west, south, east, north)
+
+
+def in_bbox(point: Dict, bbox: BBox) -> bool:
+  """Returns whether a point falls within a bbox."""
+  west, south, east, north = bbox
+  lat = point['latitude']
+  lon = point['longitude']
+  if lat < south or lat > north:
+    return False
+  if west <= east:
+    return west <= lon <= east
+  # bbox crosses the antimeridian
+  return lon >= west or lon <= east
+
+
+def _project(lat: float, lon: float) -> Tuple[float, float]:
+  """Projects a coordinate to web mercator world coordinates in [0, 1]."""
+  lat = max(min(lat, _MAX_MERCATOR_LAT), -_MAX_MERCATOR_LAT)
+  x = (lon + 180) / 360
+  sin_lat = math.sin(math.radians(lat))
+  y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+  return x, y
+
+
+def cluster_points(points: List[Dict],
+                   zoom: int,
+                   bbox: Optional[BBox] = None) -> List[Dict]:
+  """Groups points into grid clusters for display at the given zoom.
+
+  Args:
+    points: list of map points
+    zoom: web mercator zoom level that the points will be displayed at
+    bbox: if set, only points within this bbox are returned
+
+  Returns:
+    A list where cells with a single point hold the original point, and cells
+    with multiple points hold a cluster of the form:
+      {
+        clusterId: "<zoom>/<x>/<y>",
+        count: number of points in the cluster,
+        latitude: mean latitude of the points,
+        longitude: mean longitude of the points,
+        bbox: [west, south, east, north] of the points
+      }
+  """
+  if bbox:
+    points = [p for p in points if in_bbox(p, bbox)]
+  if zoom >= MAX_CLUSTER_ZOOM:
+    return points
+  num_cells = TILE_SIZE_PX * (2**zoom) / CLUSTER_CELL_SIZE_PX
+  cells = {}
+  for point in points:
+    x, y = _project(point['latitude'], point['longitude'])
+    cell = (int(x * num_cells), int(y * num_cells))
+    cells.setdefault(cell, []).append(point)
+  result = []
+  for cell in sorted(cells):
+    cell_points = cells[cell]
+    if len(cell_points) == 1:
+      result.append(cell_points[0])
+      continue
+    lats = [p['latitude'] for p in cell_points]
+    lons = [p['longitude'] for p in cell_points]
+    result.append({
+        'clusterId': f'{zoom}/{cell[0]}/{cell[1]}',
+        'count': len(cell_points),
+        'latitude': sum(lats) / len(lats),
+        'longitude': sum(lons) / len(lons),
+        'bbox': [min(lons), min(lats),
+                 max(lons), max(lats)],
+    })
+  return result
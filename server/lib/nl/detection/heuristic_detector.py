@@ -28,6 +28,7 @@ from server.lib.nl.detection.types import NLClassifier
 from server.lib.nl.detection.types import SimpleClassificationAttributes
 from server.lib.nl.explore import params
 from server.lib.nl.explore.params import QueryMode
+import shared.lib.utils as shared_utils
 
 TOOLFORMER_QUERY_REPLACEMENTS = {"residents": "people", "global": "world"}
 
@@ -41,6 +42,14 @@ def detect(orig_query: str, cleaned_query: str,
   if (params.is_toolformer_mode(dargs.mode)):
     query_with_string_replacements = dutils.replace_strings_in_query(
         orig_query, TOOLFORMER_QUERY_REPLACEMENTS)
+  # Start searching the variables of the query before its places are stripped,
+  # while the places are detected.
+  speculative_search = None
+  if dargs.speculative_var_search:
+    speculative_search = variable.SpeculativeSearch(
+        shared_utils.remove_punctuations(query_with_string_replacements,
+                                         include_comma=True), dargs)
+
   place_detection = place.detect_from_query_dc(query_with_string_replacements,
                                                query_detection_debug_logs,
                                                dargs.allow_triples)
@@ -88,7 +97,9 @@ def detect(orig_query: str, cleaned_query: str,
     sv_detection_result = variable.detect_vars(
         orig_query=sv_detection_query,
         debug_logs=query_detection_debug_logs["query_transformations"],
-        dargs=dargs)
+        dargs=dargs,
+        speculative=speculative_search,
+        counters=counters)
   except ValueError as e:
     counters.err('detect_vars_value_error', {
         'q': sv_detection_query,
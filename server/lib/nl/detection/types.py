@@ -445,3 +445,5 @@ class DetectionArgs:
   include_stop_words: bool
   # variable threshold to use
   var_threshold: float
+  # Search the variables of the query speculatively while detecting its places
+  speculative_var_search: bool = False
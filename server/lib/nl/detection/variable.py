@@ -15,8 +15,15 @@
 # Interface for variable detection
 #
 
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import logging
 from typing import Dict, List
 
+from flask import current_app
+
+from server.lib.nl.common.counters import Counters
 from server.lib.nl.detection import query_util
 from server.lib.nl.detection.types import DetectionArgs
 import server.lib.nl.detection.utils as dutils
@@ -34,15 +41,25 @@ _NUM_CANDIDATES_PER_NSPLIT = 3
 
 _MAX_MULTIVAR_PARTS = 2
 
+# Runs the speculative NL server searches (see SpeculativeSearch).
+_SPECULATIVE_WORKERS = 8
+_speculative_executor = ThreadPoolExecutor(
+    max_workers=_SPECULATIVE_WORKERS, thread_name_prefix='speculative_search')
+
 
 #
-# The main entry point into SV detection. Given a query (with places removed)
-# calls the NL Server and returns a dict with both single-SV and multi-SV
-# (if relevant) detections.  For more details see create_sv_detection().
+# The queries to search the NL server with for a query.
 #
-def detect_vars(orig_query: str, debug_logs: Dict,
-                dargs: DetectionArgs) -> vars.VarDetectionResult:
+@dataclass
+class _Queries:
+  # The query with stop-words removed, for a single SV.
+  monovar: str
+  multi_querysets: List[query_util.QuerySet]
+  # The monovar query, then the query parts of the multi_querysets.
+  all: List[str]
+
 
+def _prepare_queries(orig_query: str, dargs: DetectionArgs) -> _Queries | None:
   # Get the list of stop words to use depending on if this is toolformer mode
   # or not.
   if params.is_toolformer_mode(dargs.mode):
@@ -52,7 +69,7 @@ def detect_vars(orig_query: str, debug_logs: Dict,
     stop_words = shared_utils.combine_stop_words()
 
   #
-  # 1. Prepare all the queries for embeddings lookup, both mono-var and multi-var.
+  # Prepare all the queries for embeddings lookup, both mono-var and multi-var.
   #
   # Remove all stop-words only for mono-var query.
   # Check comment at the top of this file above `ALL_STOP_WORDS` to understand
@@ -64,23 +81,156 @@ def detect_vars(orig_query: str, debug_logs: Dict,
   else:
     query_monovar = shared_utils.remove_stop_words(orig_query, stop_words)
   if not query_monovar.strip():
-    # Empty user query!  Return empty results
-    return dutils.empty_var_detection_result()
-  all_queries = [query_monovar]
+    # Empty user query!
+    return None
 
   # Try to detect multiple SVs.  Use the original query so that
   # the logic can rely on stop-words like `vs`, `and`, etc as hints
   # for SV delimiters.
   multi_querysets, multi_queries = _prepare_multivar_queries(
       orig_query, stop_words)
-  all_queries.extend(multi_queries)
+  return _Queries(monovar=query_monovar,
+                  multi_querysets=multi_querysets,
+                  all=[query_monovar] + multi_queries)
+
+
+def _search_vars(queries: List[str], dargs: DetectionArgs) -> Dict:
+  return dc.nl_search_vars(queries, dargs.embeddings_index_types,
+                           dargs.reranker)
+
+
+#
+# The key to match queries that only differ by case and whitespace, like the
+# queries of a query before and after its places are stripped.
+#
+def _query_key(query: str) -> str:
+  return ' '.join(query.lower().split())
+
+
+#
+# Searches the NL server for the queries of a query speculatively, while its
+# places are still being detected. detect_vars() then reuses the results of the
+# queries it needs that were searched, and only searches the others.
+#
+class SpeculativeSearch:
+
+  def __init__(self, query: str, dargs: DetectionArgs):
+    queries = _prepare_queries(query, dargs)
+    # Query key -> query that was searched.
+    self.queries: Dict[str, str] = {
+        _query_key(q): q for q in queries.all
+    } if queries else {}
+    self._future: Future | None = None
+    if self.queries:
+      app = current_app._get_current_object()
+
+      def _search():
+        with app.app_context():
+          return _search_vars(queries.all, dargs)
+
+      self._future = _speculative_executor.submit(_search)
+
+  #
+  # Gets the NL server response of the speculative search, or None if it failed.
+  #
+  def result(self) -> Dict | None:
+    if not self._future:
+      return None
+    try:
+      return self._future.result()
+    except Exception as e:
+      logging.warning('Speculative variable search failed: %s', e)
+      return None
+
+  #
+  # Cancels the speculative search if it has not started, so that it does not
+  # hold a worker when its results are not needed.
+  #
+  def cancel(self):
+    if self._future:
+      self._future.cancel()
+
+
+def _search_vars_with_speculation(queries: _Queries, dargs: DetectionArgs,
+                                  speculative: SpeculativeSearch,
+                                  counters: Counters | None) -> Dict:
+  # Query -> speculatively searched query with the same results.
+  reused = {
+      q: speculative.queries[_query_key(q)]
+      for q in queries.all
+      if _query_key(q) in speculative.queries
+  }
+  if not reused:
+    # Nothing to reuse, so no need to wait for the speculative search.
+    _count(counters, 'speculative_var_search_miss')
+    speculative.cancel()
+    return _search_vars(queries.all, dargs)
+
+  # The missing queries are searched while the speculative search completes.
+  missing = [q for q in queries.all if q not in reused]
+  resp = _search_vars(missing, dargs) if missing else {}
+  speculative_resp = speculative.result()
+  if not speculative_resp:
+    _count(counters, 'speculative_var_search_failed')
+    return _search_vars(queries.all, dargs)
+  # The monovar results are the main results, so reusing them is a hit even
+  # if some multi-var query parts were searched.
+  if queries.monovar in reused:
+    _count(counters, 'speculative_var_search_hit')
+  else:
+    _count(counters, 'speculative_var_search_partial_hit')
+
+  # Builds a new response, since responses are cached.
+  query_results = {
+      q: speculative_resp['queryResults'][speculative_q]
+      for q, speculative_q in reused.items()
+  }
+  query_results.update(resp.get('queryResults', {}))
+  debug_logs = dict(speculative_resp.get('debugLogs', {}))
+  debug_logs.update(resp.get('debugLogs', {}))
+  return {
+      'queryResults': {
+          q: query_results[q] for q in queries.all
+      },
+      'scoreThreshold': speculative_resp['scoreThreshold'],
+      'debugLogs': debug_logs,
+  }
+
+
+def _count(counters: Counters | None, counter: str):
+  if counters:
+    counters.info(counter, 1)
+
+
+#
+# The main entry point into SV detection. Given a query (with places removed)
+# calls the NL Server and returns a dict with both single-SV and multi-SV
+# (if relevant) detections.  For more details see create_sv_detection().
+#
+# If a speculative search was started for the query before its places were
+# removed, its results are reused for the queries it has in common.
+#
+def detect_vars(orig_query: str,
+                debug_logs: Dict,
+                dargs: DetectionArgs,
+                speculative: SpeculativeSearch | None = None,
+                counters: Counters | None = None) -> vars.VarDetectionResult:
+  #
+  # 1. Prepare all the queries for embeddings lookup, both mono-var and multi-var.
+  #
+  queries = _prepare_queries(orig_query, dargs)
+  if not queries:
+    # Empty user query!  Return empty results
+    return dutils.empty_var_detection_result()
 
   #
   # 2. Lookup embeddings with both single-var and multi-var queries.
   #
   # Make API call to the NL models/embeddings server.
-  resp = dc.nl_search_vars(all_queries, dargs.embeddings_index_types,
-                           dargs.reranker)
+  if speculative:
+    resp = _search_vars_with_speculation(queries, dargs, speculative, counters)
+  else:
+    resp = _search_vars(queries.all, dargs)
   query2results = {
       q: vars.dict_to_var_candidates(r) for q, r in resp['queryResults'].items()
   }
@@ -94,12 +244,13 @@ def detect_vars(orig_query: str, debug_logs: Dict,
   threshold_override = params.sv_threshold_override(dargs)
   multi_var_threshold = dutils.compute_final_threshold(model_threshold,
                                                        threshold_override)
-  result_monovar = query2results[query_monovar]
-  result_multivar = _prepare_multivar_candidates(multi_querysets, query2results,
+  result_monovar = query2results[queries.monovar]
+  result_multivar = _prepare_multivar_candidates(queries.multi_querysets,
+                                                 query2results,
                                                  multi_var_threshold)
 
   debug_logs["sv_detection_query_input"] = orig_query
-  debug_logs["sv_detection_query_stop_words_removal"] = query_monovar
+  debug_logs["sv_detection_query_stop_words_removal"] = queries.monovar
   return vars.VarDetectionResult(single_var=result_monovar,
                                  multi_var=result_multivar,
                                  model_threshold=model_threshold)
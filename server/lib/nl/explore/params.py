@@ -51,6 +51,8 @@ class Params(str, Enum):
   RERANKER = 'reranker'
   # If set, then don't get related things
   SKIP_RELATED_THINGS = 'skipRelatedThings'
+  # If set, then search variables speculatively while detecting places
+  SPECULATIVE_VAR_SEARCH = 'speculativeVarSearch'
 
 
 class DCNames(str, Enum):
@@ -0,0 +1,244 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Windowed reads of (Cloud-Optimized) GeoTIFF rasters.
+
+Every read goes through a WarpedVRT whose output grid is exactly the requested
+region, so GDAL only fetches the source blocks (or overview blocks) that cover
+that region. The full raster is never loaded into memory, and remote rasters
+(eg. gs://bucket/file.tif) are read with HTTP range requests.
+"""
+
+import contextlib
+import io
+import logging
+import math
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.errors import RasterioIOError
+from rasterio.transform import from_bounds
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+
+TILE_SIZE_PX = 256
+# Max width or height of a clipped GeoTIFF.
+MAX_CLIP_SIZE_PX = 2048
+WEB_MERCATOR_CRS = 'EPSG:3857'
+LAT_LON_CRS = 'EPSG:4326'
+# Half the width of the web mercator world in meters.
+_WEB_MERCATOR_HALF_WORLD = 20037508.342789244
+
+# Image formats that tiles can be encoded in, keyed by file extension.
+TILE_FORMATS = {
+    'png': ('PNG', 'image/png'),
+    'webp': ('WEBP', 'image/webp'),
+}
+
+RESAMPLING_METHODS = {
+    'nearest': Resampling.nearest,
+    'bilinear': Resampling.bilinear,
+    'average': Resampling.average,
+}
+
+# Colors (RGB) of the color ramp used to render tiles, evenly spaced from the
+# min to the max value.
+DEFAULT_COLOR_RAMP = [(68, 1, 84), (59, 82, 139), (33, 145, 140), (94, 201, 98),
+                      (253, 231, 37)]
+
+_RASTER_NAME_RE = re.compile(r'^[A-Za-z0-9_\-]+(/[A-Za-z0-9_\-]+)*\.tiff?$')
+
+
+class RasterNotFoundError(Exception):
+  """Raised when a raster can not be opened.
+
+  The message never contains the path of the raster, so it is safe to return
+  to clients.
+  """
+
+
+@contextlib.contextmanager
+def _open(path: str):
+  try:
+    src = rasterio.open(path)
+  except RasterioIOError as e:
+    logging.warning('Could not open raster %s: %s', path, e)
+    raise RasterNotFoundError('raster not found') from None
+  with src:
+    yield src
+
+
+def _default_nodata(dtype: str) -> float:
+  """Gets the nodata value to use for a raster that does not set one.
+
+  NaN for floating point rasters, otherwise the largest (or for signed types,
+  smallest) value of the integer dtype, which can be stored in the band.
+  """
+  dtype = np.dtype(dtype)
+  if np.issubdtype(dtype, np.floating):
+    return np.nan
+  info = np.iinfo(dtype)
+  return info.min if np.issubdtype(dtype, np.signedinteger) else info.max
+
+
+def raster_path(root: str, name: str) -> Optional[str]:
+  """Gets the path of a raster under the raster root.
+
+  Returns None if the name is not a valid raster file name (eg. tries to
+  escape the root folder).
+  """
+  if not _RASTER_NAME_RE.match(name):
+    return None
+  if root.startswith('gs://'):
+    return root.rstrip('/') + '/' + name
+  return os.path.join(root, name)
+
+
+def tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+  """Gets the web mercator (EPSG:3857) bounds of a XYZ tile."""
+  tile_size = 2 * _WEB_MERCATOR_HALF_WORLD / (2**z)
+  left = -_WEB_MERCATOR_HALF_WORLD + x * tile_size
+  top = _WEB_MERCATOR_HALF_WORLD - y * tile_size
+  return (left, top - tile_size, left + tile_size, top)
+
+
+def is_valid_tile(z: int, x: int, y: int) -> bool:
+  return 0 <= z <= 24 and 0 <= x < 2**z and 0 <= y < 2**z
+
+
+def raster_bounds(path: str) -> Tuple[float, float, float, float]:
+  """Gets the (west, south, east, north) lat/lon bounds of a raster."""
+  with _open(path) as src:
+    if not src.crs or src.crs.to_string() == LAT_LON_CRS:
+      return tuple(src.bounds)
+    return transform_bounds(src.crs, LAT_LON_CRS, *src.bounds)
+
+
+def value_range(path: str) -> Tuple[float, float]:
+  """Gets the (min, max) value of the first band of a raster.
+
+  Uses the statistics stored in the raster if there are any, otherwise
+  computes them from a decimated read (served from the overviews of a COG).
+  """
+  with _open(path) as src:
+    tags = src.tags(1)
+    if 'STATISTICS_MINIMUM' in tags and 'STATISTICS_MAXIMUM' in tags:
+      return float(tags['STATISTICS_MINIMUM']), float(
+          tags['STATISTICS_MAXIMUM'])
+    scale = max(src.width / TILE_SIZE_PX, src.height / TILE_SIZE_PX, 1)
+    out_shape = (max(1, int(src.height / scale)), max(1,
+                                                      int(src.width / scale)))
+    data = src.read(1, out_shape=out_shape, masked=True)
+  data = data[np.isfinite(data.filled(np.nan))]
+  if not data.size:
+    return 0, 0
+  return float(data.min()), float(data.max())
+
+
+def read_region(path: str, bounds: Tuple[float, float, float, float], crs: str,
+                width: int, height: int,
+                resampling: Resampling) -> Tuple[np.ma.MaskedArray, Dict]:
+  """Reads the first band of a raster resampled onto a width x height grid
+  covering bounds (in crs).
+
+  Returns the masked data (masked where there is no data) and a GeoTIFF
+  profile describing the grid.
+  """
+  transform = from_bounds(*bounds, width, height)
+  with _open(path) as src:
+    nodata = src.nodata
+    if nodata is None:
+      nodata = _default_nodata(src.dtypes[0])
+    with WarpedVRT(src,
+                   crs=crs,
+                   transform=transform,
+                   width=width,
+                   height=height,
+                   nodata=nodata,
+                   resampling=resampling) as vrt:
+      data = vrt.read(1, masked=True)
+    profile = {
+        'driver': 'GTiff',
+        'dtype': data.dtype.name,
+        'count': 1,
+        'crs': crs,
+        'transform': transform,
+        'width': width,
+        'height': height,
+        'nodata': nodata,
+    }
+  return data, profile
+
+
+def clip_size(path: str, bbox: Tuple[float, float, float,
+                                     float]) -> Tuple[int, int]:
+  """Gets the output size to clip a bbox (in lat/lon) at, which is the native
+  resolution of the raster capped at MAX_CLIP_SIZE_PX."""
+  with _open(path) as src:
+    res_x, res_y = src.res
+    if src.crs and not src.crs.is_geographic:
+      # Roughly convert the resolution to degrees at the equator.
+      res_x, res_y = res_x / 111320, res_y / 111320
+  west, south, east, north = bbox
+  width = max(1, math.ceil((east - west) / res_x))
+  height = max(1, math.ceil((north - south) / res_y))
+  scale = max(width / MAX_CLIP_SIZE_PX, height / MAX_CLIP_SIZE_PX, 1)
+  return max(1, int(width / scale)), max(1, int(height / scale))
+
+
+def colorize(
+    data: np.ma.MaskedArray,
+    vmin: float,
+    vmax: float,
+    color_ramp: List[Tuple[int, int, int]] = DEFAULT_COLOR_RAMP) -> np.ndarray:
+  """Maps values to RGBA colors along a linear color ramp.
+
+  Pixels with no data are fully transparent.
+  """
+  data = data.astype(np.float64)
+  mask = np.ma.getmaskarray(data) | ~np.isfinite(data.filled(np.nan))
+  span = vmax - vmin if vmax > vmin else 1
+  scaled = np.clip((data.filled(vmin) - vmin) / span, 0, 1)
+  scaled[mask] = 0
+  ramp = np.array(color_ramp, dtype=np.float64)
+  stops = np.linspace(0, 1, len(ramp))
+  rgba = np.zeros(data.shape + (4,), dtype=np.uint8)
+  for channel in range(3):
+    rgba[..., channel] = np.interp(scaled, stops, ramp[:, channel])
+  rgba[..., 3] = np.where(mask, 0, 255)
+  return rgba
+
+
+def encode_image(rgba: np.ndarray, fmt: str) -> bytes:
+  """Encodes an RGBA array as an image in one of TILE_FORMATS."""
+  pil_format, _ = TILE_FORMATS[fmt]
+  buf = io.BytesIO()
+  Image.fromarray(rgba, mode='RGBA').save(buf, format=pil_format)
+  return buf.getvalue()
+
+
+def encode_geotiff(data: np.ma.MaskedArray, profile: Dict) -> bytes:
+  """Encodes a band as a tiled, deflate compressed GeoTIFF."""
+  profile = dict(profile, tiled=True, compress='deflate')
+  if profile['width'] < TILE_SIZE_PX or profile['height'] < TILE_SIZE_PX:
+    # Outputs smaller than one internal tile are left untiled.
+    profile['tiled'] = False
+  with rasterio.MemoryFile() as memfile:
+    with memfile.open(**profile) as dst:
+      dst.write(data.filled(profile['nodata']), 1)
+    return memfile.read()
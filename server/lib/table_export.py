@@ -0,0 +1,163 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Typed encodings of data export rows.
+
+Export rows have the layout written by the csv blueprint:
+  [placeDcid, placeName, Date:sv1, Value:sv1, Source:sv1, Date:sv2, ...]
+
+In the typed formats, Value columns are numbers (null when there is no data)
+and Date columns are dates. Observation dates can be a year (2015), a month
+(2015-01) or a day (2015-01-02); the Parquet and Arrow formats store the first
+day of that period, while JSON Lines keeps the original date string.
+"""
+
+import datetime
+import io
+import json
+from typing import Iterator, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Export formats keyed by their name in requests, to their mimetype and file
+# extension.
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+}
+
+# Number of rows in each Parquet row group / Arrow record batch.
+ROWS_PER_BATCH = 10000
+
+_DATE_FORMATS = {
+    4: '%Y',
+    7: '%Y-%m',
+    10: '%Y-%m-%d',
+}
+
+
+def parse_date(date: str) -> Optional[datetime.date]:
+  """Parses an observation date into the first day of its period.
+
+  Returns None for empty or unrecognized dates.
+  """
+  if not date:
+    return None
+  # Drop the time from dates like 2015-01-02T00:00:00
+  date = date[:10]
+  date_format = _DATE_FORMATS.get(len(date))
+  if not date_format:
+    return None
+  try:
+    return datetime.datetime.strptime(date, date_format).date()
+  except ValueError:
+    return None
+
+
+def parse_value(value) -> Optional[float]:
+  """Parses an observation value into a number, or None if it is missing."""
+  if value is None or value == '':
+    return None
+  try:
+    return float(value)
+  except (TypeError, ValueError):
+    return None
+
+
+def _schema(header_row: List[str]) -> pa.Schema:
+  fields = []
+  for column in header_row:
+    if column.startswith('Date:'):
+      fields.append(pa.field(column, pa.date32()))
+    elif column.startswith('Value:'):
+      fields.append(pa.field(column, pa.float64()))
+    else:
+      fields.append(pa.field(column, pa.string()))
+  return pa.schema(fields)
+
+
+def _parse_cell(column: str, cell):
+  if column.startswith('Date:'):
+    return parse_date(cell)
+  if column.startswith('Value:'):
+    return parse_value(cell)
+  return cell if cell != '' else None
+
+
+def _record_batches(header_row: List[str], schema: pa.Schema,
+                    rows: Iterator[List]) -> Iterator[pa.RecordBatch]:
+  """Groups rows into record batches of at most ROWS_PER_BATCH rows."""
+  columns = [[] for _ in header_row]
+  num_rows = 0
+  for row in rows:
+    for i, column in enumerate(header_row):
+      columns[i].append(_parse_cell(column, row[i]))
+    num_rows += 1
+    if num_rows >= ROWS_PER_BATCH:
+      yield pa.RecordBatch.from_arrays(columns, schema=schema)
+      columns = [[] for _ in header_row]
+      num_rows = 0
+  if num_rows:
+    yield pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def _drain(buf: io.BytesIO) -> bytes:
+  data = buf.getvalue()
+  buf.seek(0)
+  buf.truncate(0)
+  return data
+
+
+def parquet_chunks(header_row: List[str],
+                   rows: Iterator[List]) -> Iterator[bytes]:
+  """Yields a Parquet file of the rows, one row group at a time."""
+  schema = _schema(header_row)
+  buf = io.BytesIO()
+  with pq.ParquetWriter(buf, schema, compression='zstd') as writer:
+    for batch in _record_batches(header_row, schema, rows):
+      writer.write_batch(batch)
+      yield _drain(buf)
+  yield _drain(buf)
+
+
+def arrow_chunks(header_row: List[str],
+                 rows: Iterator[List]) -> Iterator[bytes]:
+  """Yields an Arrow IPC stream of the rows, one record batch at a time."""
+  schema = _schema(header_row)
+  buf = io.BytesIO()
+  with pa.ipc.new_stream(buf, schema) as writer:
+    for batch in _record_batches(header_row, schema, rows):
+      writer.write_batch(batch)
+      yield _drain(buf)
+  yield _drain(buf)
+
+
+def jsonl_chunks(header_row: List[str], rows: Iterator[List]) -> Iterator[str]:
+  """Yields one JSON object per row, keyed by the header columns."""
+  lines = []
+  for row in rows:
+    record = {}
+    for column, cell in zip(header_row, row):
+      if column.startswith('Value:'):
+        record[column] = parse_value(cell)
+      else:
+        record[column] = cell if cell != '' else None
+    lines.append(json.dumps(record))
+    if len(lines) >= ROWS_PER_BATCH:
+      yield '\n'.join(lines) + '\n'
+      lines = []
+  if lines:
+    yield '\n'.join(lines) + '\n'
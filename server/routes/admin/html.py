@@ -82,6 +82,7 @@ def load_data():
       _CUSTOM_EMBEDDINGS_INDEX,
       '--additional_catalog_path',
       additional_catalog_path,
+      '--incremental',
   ]
   # Update mixer in-memory cache.
   command3 = [
@@ -98,7 +99,10 @@ def load_data():
       '-H',
       'Content-Type: application/json',
       '-d',
-      json.dumps({'additional_catalog_path': additional_catalog_path}),
+      json.dumps({
+          'additional_catalog_path': additional_catalog_path,
+          'wait': True
+      }),
       'localhost:6060/api/load/',
   ]
   output = []
@@ -193,13 +193,17 @@ def parse_query_and_detect(request: Dict, backend: str, client: str,
   include_stop_words_str = request.args.get(
       params.Params.INCLUDE_STOP_WORDS.value, '')
 
+  speculative_var_search_str = request.args.get(
+      params.Params.SPECULATIVE_VAR_SEARCH.value, '')
+
   detection_args = DetectionArgs(
       embeddings_index_types=embeddings_index_types,
       mode=mode,
       reranker=reranker,
       allow_triples=allow_triples,
       include_stop_words=include_stop_words_str.lower() == 'true',
-      var_threshold=var_threshold)
+      var_threshold=var_threshold,
+      speculative_var_search=speculative_var_search_str.lower() == 'true')
 
   # Query detection routine:
   # Returns detection for Place, SVs and Query Classifications.
@@ -20,15 +20,17 @@ import urllib.parse
 
 from flask import Blueprint
 from flask import current_app
-from flask import make_response
+from flask import g
 from flask import request
 from flask import Response
-from flask import send_file
 from flask import url_for
 from geojson_rewind import rewind
+from rasterio.enums import Resampling
 
 from server.lib.cache import cache
 import server.lib.fetch as fetch
+import server.lib.map_points as lib_map_points
+import server.lib.raster as lib_raster
 from server.lib.shared import is_float
 import server.lib.shared as shared
 import server.lib.util as lib_util
@@ -82,6 +84,8 @@ CHOROPLETH_GEOJSON_DP_LEVEL_MAP = {
 MULTILINE_GEOJSON_TYPE = "MultiLineString"
 MULTIPOLYGON_GEOJSON_TYPE = "MultiPolygon"
 POLYGON_GEOJSON_TYPE = "Polygon"
+# Raster to serve when no raster is specified.
+DEFAULT_RASTER = "test_county.tif"
 
 
 @cache.memoize(timeout=TIMEOUT)
@@ -475,25 +479,23 @@ def choropleth_data(dcid):
   return Response(json.dumps(result), 200, mimetype='application/json')
 
 
-@bp.route('/map-points')
-@cache.cached(timeout=TIMEOUT, query_string=True)
-def get_map_points():
-  """Get map point data for the given place type enclosed within the given dcid
+@cache.memoize(timeout=TIMEOUT)
+def get_map_point_index(place_dcid, place_type, locale):
+  """Gets all the map points for the given place type enclosed within the
+  given dcid.
+
+  Args:
+      place_dcid: dcid of the enclosing place
+      place_type: place type of the points
+      locale: locale of the point names. Only used as part of the cache key,
+          names are fetched for the locale of the current request.
+
+  Returns:
+      list of { placeDcid, placeName, latitude, longitude } objects
   """
-  place_dcid = request.args.get("placeDcid")
-  if not place_dcid:
-    return Response(json.dumps("error: must provide a placeDcid field"),
-                    400,
-                    mimetype='application/json')
-  place_type = request.args.get("placeType")
-  if not place_type:
-    return Response(json.dumps("error: must provide a placeType field"),
-                    400,
-                    mimetype='application/json')
-  geos = []
   geos = fetch.descendent_places([place_dcid], place_type).get(place_dcid, [])
   if not geos:
-    return Response(json.dumps([]), 200, mimetype='application/json')
+    return []
   names_by_geo = place_api.get_i18n_name(geos)
   # For some places, lat long is attached to the place node, but for other
   # places, the lat long is attached to the location value of the place node.
@@ -502,28 +504,33 @@ def get_map_points():
   # eg. epaGhgrpFacilityId/1003010 has latitude and longitude but no location
   # epa/120814013 which is an AirQualitySite has a location, but no latitude
   # or longitude
-  location_by_geo = fetch.property_values(geos, "location")
+  props_by_geo = fetch.multiple_property_values(
+      geos, ["location", "latitude", "longitude"])
   # dict of <dcid used to get latlon>: <dcid of the place>
-  geo_by_latlon_subject = {}
+  geo_by_location = {}
+  # dict of <dcid used to get latlon>: {latitude: [], longitude: []}
+  latlon_by_subject = {}
   for geo_dcid in geos:
-    if location_by_geo[geo_dcid]:
-      location_dcid = location_by_geo[geo_dcid][0]
-      geo_by_latlon_subject[location_dcid] = geo_dcid
+    geo_props = props_by_geo.get(geo_dcid, {})
+    if geo_props.get("location"):
+      geo_by_location[geo_props["location"][0]] = geo_dcid
     else:
-      geo_by_latlon_subject[geo_dcid] = geo_dcid
-  lat_by_subject = fetch.property_values(list(geo_by_latlon_subject.keys()),
-                                         "latitude")
-  lon_by_subject = fetch.property_values(list(geo_by_latlon_subject.keys()),
-                                         "longitude")
+      latlon_by_subject[geo_dcid] = geo_props
+  geo_by_latlon_subject = {geo: geo for geo in latlon_by_subject}
+  if geo_by_location:
+    latlon_by_subject.update(
+        fetch.multiple_property_values(list(geo_by_location.keys()),
+                                       ["latitude", "longitude"]))
+    geo_by_latlon_subject.update(geo_by_location)
 
   map_points_list = []
-  for subject_dcid, latitude in lat_by_subject.items():
-    longitude = lon_by_subject.get(subject_dcid, [])
+  for subject_dcid, geo_id in geo_by_latlon_subject.items():
+    latitude = latlon_by_subject.get(subject_dcid, {}).get("latitude", [])
+    longitude = latlon_by_subject.get(subject_dcid, {}).get("longitude", [])
     if len(latitude) == 0 or len(longitude) == 0:
       continue
     if not is_float(latitude[0]) or not is_float(longitude[0]):
       continue
-    geo_id = geo_by_latlon_subject.get(subject_dcid, "")
     map_point = {
         "placeDcid": geo_id,
         "placeName": names_by_geo.get(geo_id, "Unnamed Place"),
@@ -531,15 +538,158 @@ def get_map_points():
         "longitude": float(longitude[0])
     }
     map_points_list.append(map_point)
+  return map_points_list
+
+
+@bp.route('/map-points')
+@cache.cached(timeout=TIMEOUT, query_string=True)
+def get_map_points():
+  """Get map point data for the given place type enclosed within the given dcid
+
+  Optional query params:
+      bbox: "west,south,east,north" in degrees. Only points within the bbox are
+          returned.
+      zoom: web mercator zoom level of the map. When set, nearby points are
+          grouped into clusters with counts (see lib/map_points.py).
+  """
+  place_dcid = request.args.get("placeDcid")
+  if not place_dcid:
+    return Response(json.dumps("error: must provide a placeDcid field"),
+                    400,
+                    mimetype='application/json')
+  place_type = request.args.get("placeType")
+  if not place_type:
+    return Response(json.dumps("error: must provide a placeType field"),
+                    400,
+                    mimetype='application/json')
+  bbox = None
+  bbox_str = request.args.get("bbox")
+  if bbox_str:
+    bbox = lib_map_points.parse_bbox(bbox_str)
+    if not bbox:
+      return Response(json.dumps("error: invalid bbox field"),
+                      400,
+                      mimetype='application/json')
+  zoom = None
+  zoom_str = request.args.get("zoom")
+  if zoom_str:
+    if not zoom_str.isdigit():
+      return Response(json.dumps("error: invalid zoom field"),
+                      400,
+                      mimetype='application/json')
+    zoom = int(zoom_str)
+  map_points_list = get_map_point_index(place_dcid, place_type, g.locale)
+  if zoom is not None:
+    map_points_list = lib_map_points.cluster_points(map_points_list, zoom, bbox)
+  elif bbox:
+    map_points_list = [
+        p for p in map_points_list if lib_map_points.in_bbox(p, bbox)
+    ]
   return Response(json.dumps(map_points_list), 200, mimetype='application/json')
 
 
+def _get_raster_path():
+  """Gets the path of the raster requested by the "raster" query param, or
+  None if the raster name is invalid."""
+  raster_root = current_app.config['RASTER_ROOT'] or lib_util.get_repo_root()
+  raster_name = request.args.get("raster", DEFAULT_RASTER)
+  return lib_raster.raster_path(raster_root, raster_name)
+
+
+def _raster_not_found():
+  # The path of the raster is deliberately left out of the response.
+  return Response(json.dumps("error: raster not found"),
+                  404,
+                  mimetype='application/json')
+
+
+@cache.memoize(timeout=TIMEOUT)
+def get_raster_value_range(raster_path):
+  return lib_raster.value_range(raster_path)
+
+
 @bp.route('/geotiff')
+@cache.cached(timeout=TIMEOUT, query_string=True)
 def get_geotiff():
-  # TODO should get geotiff from mixer given some parameters
-  response = make_response(
-      send_file("test_county.tif",
-                mimetype='image/tiff',
-                as_attachment=True,
-                cache_timeout=0))
-  return response
+  """Get a GeoTIFF clipped to a bbox.
+
+  Optional query params:
+      raster: name of the raster file under the RASTER_ROOT config folder.
+      bbox: "west,south,east,north" in degrees. Defaults to the bounds of the
+          raster.
+
+  The clip is read with a windowed read at the native resolution of the raster
+  (capped at lib_raster.MAX_CLIP_SIZE_PX) and returned in EPSG:4326.
+  """
+  raster_path = _get_raster_path()
+  if not raster_path:
+    return Response(json.dumps("error: invalid raster field"),
+                    400,
+                    mimetype='application/json')
+  bbox = None
+  bbox_str = request.args.get("bbox")
+  if bbox_str:
+    bbox = lib_map_points.parse_bbox(bbox_str)
+    if not bbox or bbox[0] >= bbox[2]:
+      return Response(json.dumps("error: invalid bbox field"),
+                      400,
+                      mimetype='application/json')
+  try:
+    if not bbox:
+      bbox = lib_raster.raster_bounds(raster_path)
+    width, height = lib_raster.clip_size(raster_path, bbox)
+    data, profile = lib_raster.read_region(raster_path, bbox,
+                                           lib_raster.LAT_LON_CRS, width,
+                                           height, Resampling.nearest)
+  except lib_raster.RasterNotFoundError:
+    return _raster_not_found()
+  return Response(lib_raster.encode_geotiff(data, profile),
+                  200,
+                  mimetype='image/tiff')
+
+
+@bp.route('/raster-tile/<int:z>/<int:x>/<int:y>.<fmt>')
+@cache.cached(timeout=TIMEOUT, query_string=True)
+def get_raster_tile(z, x, y, fmt):
+  """Get a web mercator XYZ tile of a raster rendered as a PNG or WebP image.
+
+  Optional query params:
+      raster: name of the raster file under the RASTER_ROOT config folder.
+      vmin, vmax: values mapped to the ends of the color ramp. Defaults to the
+          min and max value of the raster.
+      resampling: one of lib_raster.RESAMPLING_METHODS. Defaults to bilinear.
+  """
+  if fmt not in lib_raster.TILE_FORMATS or not lib_raster.is_valid_tile(
+      z, x, y):
+    return Response(json.dumps("error: invalid tile"),
+                    400,
+                    mimetype='application/json')
+  raster_path = _get_raster_path()
+  if not raster_path:
+    return Response(json.dumps("error: invalid raster field"),
+                    400,
+                    mimetype='application/json')
+  resampling = lib_raster.RESAMPLING_METHODS.get(
+      request.args.get("resampling", "bilinear"))
+  vmin = request.args.get("vmin", "")
+  vmax = request.args.get("vmax", "")
+  if not resampling or (vmin and not is_float(vmin)) or (vmax and
+                                                         not is_float(vmax)):
+    return Response(json.dumps("error: invalid tile params"),
+                    400,
+                    mimetype='application/json')
+  try:
+    if not vmin or not vmax:
+      default_vmin, default_vmax = get_raster_value_range(raster_path)
+      vmin = vmin or default_vmin
+      vmax = vmax or default_vmax
+    data, _ = lib_raster.read_region(raster_path,
+                                     lib_raster.tile_bounds(z, x, y),
+                                     lib_raster.WEB_MERCATOR_CRS,
+                                     lib_raster.TILE_SIZE_PX,
+                                     lib_raster.TILE_SIZE_PX, resampling)
+  except lib_raster.RasterNotFoundError:
+    return _raster_not_found()
+  rgba = lib_raster.colorize(data, float(vmin), float(vmax))
+  _, mimetype = lib_raster.TILE_FORMATS[fmt]
+  return Response(lib_raster.encode_image(rgba, fmt), 200, mimetype=mimetype)
@@ -14,15 +14,27 @@
 """Flask endpoint to handle csv download request
 """
 
+import bisect
 import csv
+import heapq
 import io
+import itertools
+import os
+import tempfile
 
 from flask import Blueprint
-from flask import make_response
+from flask import current_app
+from flask import jsonify
 from flask import request
+from flask import Response
+from flask import send_file
+from flask import stream_with_context
+from markupsafe import escape
 
-from server.lib.shared import date_greater_equal_min
-from server.lib.shared import date_lesser_equal_max
+from server.lib import export_jobs
+from server.lib import fetch
+from server.lib import table_export
+from server.lib.shared import divide_into_batches
 from server.lib.shared import is_valid_date
 from server.lib.shared import names
 import server.services.datacommons as dc
@@ -30,16 +42,59 @@ import server.services.datacommons as dc
 # Define blueprint
 bp = Blueprint("csv", __name__, url_prefix='/api/csv')
 
+# Max number of (place, variable) pairs to fetch data for in one mixer call.
+_MAX_SERIES_PER_SHARD = 5000
+# Number of csv rows to write before flushing them to the response stream.
+_ROWS_PER_CHUNK = 1000
+# Sorts after every character in a date string.
+_MAX_CHAR = "\uffff"
+
+
+def _entity_shards(parent_place, child_type, num_vars):
+  """Gets sorted batches of the child places of a certain place type
+    contained in a parent place, sized so that each batch fetches at most
+    _MAX_SERIES_PER_SHARD (place, variable) pairs."""
+  entities = fetch.descendent_places([parent_place],
+                                     child_type).get(parent_place, [])
+  shard_size = max(1, _MAX_SERIES_PER_SHARD // max(1, num_vars))
+  return list(divide_into_batches(sorted(entities), shard_size))
+
+
+def _shard_rows(shards, get_rows, progress=None):
+  """Yields the csv rows of each shard of places, calling
+    progress(shards done, number of shards) after each shard is fetched."""
+  for i, entities in enumerate(shards):
+    rows = get_rows(entities)
+    if progress:
+      progress(i + 1, len(shards))
+    yield rows
+
+
+def _limit_rows(row_shards, row_limit):
+  """Chains lists of csv rows into a single generator of at most row_limit
+    rows (or all rows if row_limit is not set)."""
+  num_rows = 0
+  for rows in row_shards:
+    for row in rows:
+      if row_limit and num_rows >= row_limit:
+        return
+      num_rows += 1
+      yield row
+
 
 def get_point_within_csv_rows(parent_place,
                               child_type,
                               sv_list,
                               facet_map,
                               date,
-                              row_limit=None):
+                              row_limit=None,
+                              progress=None):
   """Gets the csv rows for a set of statistical variables data for child places
     of a certain place type contained in a parent place.
 
+  Data is fetched in shards of child places, so only one shard of data is held
+  in memory at a time.
+
   Args:
       parent_place: the parent place of the places to get data for
       child_type: the type of places to get data for
@@ -47,14 +102,35 @@ def get_point_within_csv_rows(parent_place,
           left to right in each csv row.
       date: the date to get the data for
       row_limit (optional): number of csv rows to return
+      progress (optional): function called with (shards done, number of
+          shards) after each shard of data is fetched
+
+  Returns:
+      A generator of csv rows. These csv rows are represented as an array
+      where each item is the value of a cell in the row.
+  """
+  row_shards = _shard_rows(
+      _entity_shards(parent_place, child_type, len(sv_list)),
+      lambda entities: get_point_csv_rows(dc.obs_point(entities, sv_list, date),
+                                          sv_list, facet_map), progress)
+  return _limit_rows(row_shards, row_limit)
+
+
+def get_point_csv_rows(points_response, sv_list, facet_map):
+  """Gets the csv rows for a set of statistical variables data from an
+    observation point response.
+
+  Args:
+      points_response: the response from a dc.obs_point call
+      sv_list: list of variables in the order that they should appear from
+          left to right in each csv row.
+      facet_map: map of variable dcid to the id of the facet to get data from
 
   Returns:
       An array where each item in the array is a csv row. These csv rows are
       represented as an array where each item is the value of a cell in the
       row.
   """
-  points_response = dc.obs_point_within(parent_place, child_type, sv_list, date)
-
   # dict of place dcid to dict of sv dcid to chosen data point.
   data_by_place = {}
   # go through the data in points_response_all and add to data_by_place
@@ -84,8 +160,6 @@ def get_point_within_csv_rows(parent_place,
   place_names = names(place_list)
   result = []
   for place, place_name in place_names.items():
-    if row_limit and len(result) >= row_limit:
-      break
     place_row = [place, place_name]
     for sv in sv_list:
       data = data_by_place.get(place, {}).get(sv, {})
@@ -101,6 +175,106 @@ def get_point_within_csv_rows(parent_place,
   return result
 
 
+def _date_prefixes(date):
+  """Gets the lower granularity dates that contain a date.
+
+  eg. 2015-01-02 is contained in 2015 and 2015-01.
+  """
+  return [date[:i] for i, c in enumerate(date) if c == "-"]
+
+
+def _filter_observations(observations, min_date, max_date):
+  """Gets the observations of a series that are within a date range, sorted by
+    date.
+
+  This keeps the same observations as date_greater_equal_min and
+  date_lesser_equal_max, but finds them with binary searches over the sorted
+  dates instead of checking every observation.
+  """
+  observations = sorted((o for o in observations if o.get("date")),
+                        key=lambda o: o["date"])
+  dates = [o["date"] for o in observations]
+  # Dates at or before max_date, plus higher granularity dates within max_date
+  # (eg. 2015-01 when max_date is 2015).
+  end = len(dates)
+  if max_date:
+    end = bisect.bisect_right(dates, max_date + _MAX_CHAR)
+  if not min_date:
+    return observations[:end]
+  result = []
+  # Lower granularity dates that contain min_date (eg. 2015 when min_date is
+  # 2015-01).
+  for prefix in _date_prefixes(min_date):
+    prefix_start = bisect.bisect_left(dates, prefix)
+    prefix_end = bisect.bisect_right(dates, prefix, lo=prefix_start)
+    result.extend(observations[prefix_start:min(prefix_end, end)])
+  # Dates at or after min_date
+  result.extend(observations[bisect.bisect_left(dates, min_date):end])
+  return result
+
+
+def _merge_series(place, place_name, sv_observations, sv_sources):
+  """Merges the date sorted observations of each variable for a place into
+    csv rows.
+
+  Each row is for one date, chosen as the earliest date with the highest
+  granularity out of the next date of each variable (eg. between 2015 and
+  2015-01 we want 2015-01, and between 2015 and 2016 we want 2015). A row has
+  data for every variable whose next date is equal to or encompasses the
+  chosen date, and empty cells for the other variables.
+
+  The next date of each variable is kept in a heap, so choosing the date of a
+  row does not need to look at every variable.
+
+  Args:
+      place: dcid of the place
+      place_name: name of the place
+      sv_observations: list with the date sorted observations of each variable
+          in the order that they should appear from left to right in each row.
+      sv_sources: list with the source url of each variable.
+
+  Returns:
+      A generator of csv rows.
+  """
+  # Heap of (date key, variable index, observation index). The date key sorts
+  # higher granularity dates before the lower granularity dates that contain
+  # them (2015-01 before 2015), and otherwise sorts by date.
+  heap = []
+  # dict of date to the indexes of the variables whose next date is that date
+  svs_by_next_date = {}
+  for sv_idx, observations in enumerate(sv_observations):
+    if observations:
+      date = observations[0]["date"]
+      heap.append((date + _MAX_CHAR, sv_idx, 0))
+      svs_by_next_date.setdefault(date, []).append(sv_idx)
+  heapq.heapify(heap)
+  # index of the next observation to add to the result for each variable
+  sv_curr_index = [0] * len(sv_observations)
+  while True:
+    # Drop heap entries for observations that were already added to the
+    # result.
+    while heap and heap[0][2] != sv_curr_index[heap[0][1]]:
+      heapq.heappop(heap)
+    if not heap:
+      return
+    curr_date = heap[0][0][:-1]
+    row = [place, place_name] + ["", "", ""] * len(sv_observations)
+    for date in _date_prefixes(curr_date) + [curr_date]:
+      for sv_idx in svs_by_next_date.pop(date, []):
+        observations = sv_observations[sv_idx]
+        idx = sv_curr_index[sv_idx]
+        cell = 2 + 3 * sv_idx
+        row[cell:cell +
+            3] = [date, observations[idx]["value"], sv_sources[sv_idx]]
+        idx += 1
+        sv_curr_index[sv_idx] = idx
+        if idx < len(observations):
+          next_date = observations[idx]["date"]
+          heapq.heappush(heap, (next_date + _MAX_CHAR, sv_idx, idx))
+          svs_by_next_date.setdefault(next_date, []).append(sv_idx)
+    yield row
+
+
 def get_series_csv_rows(series_response,
                         sv_list,
                         facet_map,
@@ -111,7 +285,7 @@ def get_series_csv_rows(series_response,
     date range.
 
   Args:
-      series_response: the response from a dc.obs_series_within call
+      series_response: the response from a dc.obs_series call
       sv_list: list of variables in the order that they should appear from
           left to right in each csv row.
       min_date (optional): the earliest date as a string to get data for. If
@@ -147,135 +321,260 @@ def get_series_csv_rows(series_response,
 
   place_list = sorted(list(data_by_place.keys()))
   place_names = names(place_list)
+  # each variable gets one set of columns, even if it is in sv_list more than
+  # once
+  unique_svs = list(dict.fromkeys(sv_list))
   result = []
   for place, place_name in place_names.items():
-    # dict of sv to sorted list of data points available for the sv and is within
-    # the date range
-    sv_data_points = {}
-    # dict of sv to its source
-    sv_source = {}
-    # dict of sv to the idx of the next date for that sv to add to the result
-    sv_curr_index = {}
-    # whether or not there is still data to add to the result
-    have_data = False
-    for sv in sv_list:
+    if row_limit and len(result) >= row_limit:
+      break
+    sv_observations = []
+    sv_sources = []
+    for sv in unique_svs:
       sv_series = data_by_place.get(place, {}).get(sv, {})
-      want_data_points = []
-      # Go through the series and keep data points that are within the
-      # date range
-      for data_point in sv_series.get("observations", []):
-        date = data_point.get("date")
-        is_greater_than_min = date_greater_equal_min(date, min_date)
-        is_less_than_max = date_lesser_equal_max(date, max_date)
-        if is_greater_than_min and is_less_than_max:
-          want_data_points.append(data_point)
-      want_data_points.sort(key=lambda x: x["date"])
-      sv_data_points[sv] = want_data_points
+      sv_observations.append(
+          _filter_observations(sv_series.get("observations", []), min_date,
+                               max_date))
       facetId = sv_series.get("facetId", "")
-      sv_source[sv] = facets.get(facetId, {}).get("provenanceUrl", "")
-      sv_curr_index[sv] = 0
-      have_data = have_data or len(want_data_points) > 0
-    while have_data:
-      if row_limit and len(result) >= row_limit:
-        break
-      curr_date = ""
-      # look through all the next dates to add data for and choose the
-      # earliest date and the one with highest granularity
-      # eg. between 2015 and 2015-01 we want 2015-01
-      #     between 2015 and 2016 we want 2015
-      for sv, idx in sv_curr_index.items():
-        if idx >= len(sv_data_points[sv]):
-          continue
-        curr_sv_date = sv_data_points[sv][idx]["date"]
-        if not curr_date:
-          curr_date = curr_sv_date
-        elif curr_sv_date < curr_date or curr_sv_date.startswith(curr_date):
-          curr_date = curr_sv_date
-      have_data = False
-      place_date_row = [place, place_name]
-      for sv, idx in sv_curr_index.items():
-        # if a sv doesn't have any more data left, just append empty cells
-        if idx >= len(sv_data_points[sv]):
-          place_date_row.extend(["", "", ""])
-          continue
-        curr_sv_date = sv_data_points[sv][idx]["date"]
-        # Add data for an sv if the current date to add for that sv is
-        # equal to or encompassing the chosen date. Eg. if the chosen
-        # date is 2015-01-02, then we can add data from 2015, 2015-01 or
-        # 2015-01-02.
-        if curr_date.startswith(curr_sv_date):
-          value = sv_data_points[sv][idx]["value"]
-          place_date_row.extend([curr_sv_date, value, sv_source.get(sv, "")])
-          sv_curr_index[sv] += 1
-        else:
-          place_date_row.extend(["", "", ""])
-        have_data = have_data or sv_curr_index[sv] < len(sv_data_points[sv])
-      result.append(place_date_row)
+      sv_sources.append(facets.get(facetId, {}).get("provenanceUrl", ""))
+    place_rows = _merge_series(place, place_name, sv_observations, sv_sources)
+    if row_limit:
+      place_rows = itertools.islice(place_rows, row_limit - len(result))
+    result.extend(place_rows)
   return result
 
 
-@bp.route('/within', methods=['POST'])
-def get_stats_within_place_csv():
-  """Gets the statistical variable data as a csv for child places of a
-    certain place type contained in a parent place. If no date range specified,
-    gets data for all dates of a series. If minDate and maxDate are "latest",
-    the latest date data will be returned.
+def get_series_within_csv_rows(parent_place,
+                               child_type,
+                               sv_list,
+                               facet_map,
+                               min_date,
+                               max_date,
+                               row_limit=None,
+                               progress=None):
+  """Gets the csv rows for a set of statistical variable series for child
+    places of a certain place type contained in a parent place.
 
-  Request body:
-      parentPlace: the parent place of the places to get data for
-      childType: type of places to get data for
-      statVars: list of statistical variables to get data for
-      minDate (optional): earliest date to get data for
-      maxDate (optional): latest date to get data for
-      facetMap (optional): map of statistical variable dcid to the id of the
-          facet to get data from
-      rowLimit (optional): number of csv rows to return
+  Data is fetched in shards of child places, so only one shard of data is held
+  in memory at a time. See get_series_csv_rows and get_point_within_csv_rows
+  for the args.
+
+  Returns:
+      A generator of csv rows.
+  """
+  row_shards = _shard_rows(
+      _entity_shards(parent_place, child_type,
+                     len(sv_list)), lambda entities: get_series_csv_rows(
+                         dc.obs_series(entities, sv_list), sv_list, facet_map,
+                         min_date, max_date, row_limit), progress)
+  return _limit_rows(row_shards, row_limit)
+
+
+def _csv_chunks(header_row, rows):
+  """Yields csv text for a header row and a generator of rows, one chunk per
+    _ROWS_PER_CHUNK rows."""
+  buf = io.StringIO()
+  csv_writer = csv.writer(buf)
+  csv_writer.writerow(header_row)
+  num_buffered = 1
+  for row in rows:
+    csv_writer.writerow(row)
+    num_buffered += 1
+    if num_buffered >= _ROWS_PER_CHUNK:
+      yield buf.getvalue()
+      buf.seek(0)
+      buf.truncate(0)
+      num_buffered = 0
+  if num_buffered:
+    yield buf.getvalue()
+
+
+def _parse_export_request(request_json):
+  """Parses and validates the body of an export request.
+
+  Returns:
+      A tuple of a dict with the export params, and an error message (or None
+      if the request is valid).
   """
-  parent_place = request.json.get("parentPlace")
+  parent_place = request_json.get("parentPlace")
   if not parent_place:
-    return "error: must provide a parentPlace field", 400
-  child_type = request.json.get("childType")
+    return None, "error: must provide a parentPlace field"
+  child_type = request_json.get("childType")
   if not child_type:
-    return "error: must provide a childType field", 400
-  sv_list = request.json.get("statVars")
+    return None, "error: must provide a childType field"
+  sv_list = request_json.get("statVars")
   if not sv_list:
-    return "error: must provide a statVars field", 400
-  min_date = request.json.get("minDate")
+    return None, "error: must provide a statVars field"
+  # each variable gets one set of columns, even if it is in statVars more than
+  # once
+  sv_list = list(dict.fromkeys(sv_list))
+  min_date = request_json.get("minDate")
   if not is_valid_date(min_date):
-    return "error: minDate must be YYYY or YYYY-MM or YYYY-MM-DD", 400
-  max_date = request.json.get("maxDate")
+    return None, "error: minDate must be YYYY or YYYY-MM or YYYY-MM-DD"
+  max_date = request_json.get("maxDate")
   if not is_valid_date(max_date):
-    return "error: minDate must be YYYY or YYYY-MM or YYYY-MM-DD", 400
-  facet_map = request.json.get("facetMap", {})
-  row_limit = request.json.get("rowLimit")
+    return None, "error: minDate must be YYYY or YYYY-MM or YYYY-MM-DD"
+  export_format = request_json.get("format") or "csv"
+  if export_format not in table_export.EXPORT_FORMATS:
+    return None, "error: format must be one of {}".format(", ".join(
+        table_export.EXPORT_FORMATS))
+  row_limit = request_json.get("rowLimit")
   if row_limit:
     row_limit = int(row_limit)
-  result_csv = []
+  return {
+      "parent_place": parent_place,
+      "child_type": child_type,
+      "sv_list": sv_list,
+      "min_date": min_date,
+      "max_date": max_date,
+      "facet_map": request_json.get("facetMap", {}),
+      "format": export_format,
+      "row_limit": row_limit,
+  }, None
+
+
+def _export_chunks(params, progress=None):
+  """Gets a generator of the chunks of an export file.
+
+  Args:
+      params: export params from _parse_export_request
+      progress (optional): function called with (shards done, number of
+          shards) after each shard of data is fetched
+  """
+  sv_list = params["sv_list"]
+  min_date = params["min_date"]
+  max_date = params["max_date"]
   header_row = ["placeDcid", "placeName"]
   for sv in sv_list:
     header_row.extend(["Date:" + sv, "Value:" + sv, "Source:" + sv])
-  result_csv.append(header_row)
   # when min_date and max_date are the same and non empty, we will get the
   # data for that one date
   if min_date and max_date and min_date == max_date:
     date = min_date
     if min_date == "latest":
       date = "LATEST"
-    result_csv.extend(
-        get_point_within_csv_rows(parent_place, child_type, sv_list, facet_map,
-                                  date, row_limit))
+    rows = get_point_within_csv_rows(params["parent_place"],
+                                     params["child_type"], sv_list,
+                                     params["facet_map"], date,
+                                     params["row_limit"], progress)
   else:
-    series_response = dc.obs_series_within(parent_place, child_type, sv_list)
-    result_csv.extend(
-        get_series_csv_rows(series_response, sv_list, facet_map, min_date,
-                            max_date, row_limit))
-  si = io.StringIO()
-  csv_writer = csv.writer(si)
-  csv_writer.writerows(result_csv)
-  response = make_response(si.getvalue())
-  response.headers["Content-type"] = "text/csv"
-  response.headers[
-      "Content-Disposition"] = "attachment; filename={}_{}.csv".format(
-          parent_place, child_type)
-  response.status_code = 200
+    rows = get_series_within_csv_rows(params["parent_place"],
+                                      params["child_type"], sv_list,
+                                      params["facet_map"], min_date, max_date,
+                                      params["row_limit"], progress)
+  if params["format"] == "parquet":
+    return table_export.parquet_chunks(header_row, rows)
+  if params["format"] == "arrow":
+    return table_export.arrow_chunks(header_row, rows)
+  if params["format"] == "jsonl":
+    return table_export.jsonl_chunks(header_row, rows)
+  return _csv_chunks(header_row, rows)
+
+
+def _export_filename(params):
+  _, extension = table_export.EXPORT_FORMATS[params["format"]]
+  return "{}_{}.{}".format(params["parent_place"], params["child_type"],
+                           extension)
+
+
+def _export_jobs():
+  spool_dir = current_app.config["EXPORT_JOB_DIR"] or os.path.join(
+      tempfile.gettempdir(), "export_jobs")
+  return export_jobs.get_export_jobs(spool_dir)
+
+
+@bp.route('/within', methods=['POST'])
+def get_stats_within_place_csv():
+  """Gets the statistical variable data as a csv for child places of a
+    certain place type contained in a parent place. If no date range specified,
+    gets data for all dates of a series. If minDate and maxDate are "latest",
+    the latest date data will be returned.
+
+  Request body:
+      parentPlace: the parent place of the places to get data for
+      childType: type of places to get data for
+      statVars: list of statistical variables to get data for
+      minDate (optional): earliest date to get data for
+      maxDate (optional): latest date to get data for
+      facetMap (optional): map of statistical variable dcid to the id of the
+          facet to get data from
+      rowLimit (optional): number of csv rows to return
+      format (optional): one of csv (default), parquet, arrow or jsonl. The
+          parquet, arrow and jsonl formats have numeric values, and the
+          parquet and arrow formats have typed dates.
+  """
+  params, error = _parse_export_request(request.json)
+  if error:
+    return error, 400
+  mimetype, _ = table_export.EXPORT_FORMATS[params["format"]]
+  response = Response(stream_with_context(_export_chunks(params)),
+                      200,
+                      mimetype=mimetype)
+  response.headers["Content-Disposition"] = "attachment; filename={}".format(
+      _export_filename(params))
   return response
+
+
+@bp.route('/within/jobs', methods=['POST'])
+def submit_export_job():
+  """Submits a background job to build the export of a /within request, for
+    exports that take too long to stream.
+
+  Identical requests share the same job, and a built export is reused until it
+  expires.
+
+  Request body: same as /within
+
+  Returns:
+      The status of the job, see get_export_job.
+  """
+  params, error = _parse_export_request(request.json)
+  if error:
+    return error, 400
+  app = current_app._get_current_object()
+
+  def build(f, progress):
+    with app.app_context():
+      for chunk in _export_chunks(params, progress):
+        f.write(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+
+  mimetype, _ = table_export.EXPORT_FORMATS[params["format"]]
+  status = _export_jobs().submit(export_jobs.job_id(request.json),
+                                 _export_filename(params), mimetype, build)
+  return jsonify(status), 202
+
+
+@bp.route('/within/jobs/<job_id>')
+def get_export_job(job_id):
+  """Gets the status of an export job.
+
+  Returns:
+      {
+        jobId: id of the job,
+        status: one of pending, running, done or failed,
+        shardsDone: number of shards of places fetched so far,
+        numShards: total number of shards of places (0 until known),
+        size (when done): size of the export in bytes
+      }
+  """
+  status = _export_jobs().status(job_id)
+  if not status:
+    return "error: no export job with id {}".format(escape(job_id)), 404
+  return jsonify(status)
+
+
+@bp.route('/within/jobs/<job_id>/file')
+def get_export_job_file(job_id):
+  """Downloads the export built by a job."""
+  jobs = _export_jobs()
+  status = jobs.status(job_id)
+  if not status:
+    return "error: no export job with id {}".format(escape(job_id)), 404
+  path = jobs.result_path(job_id)
+  if not path:
+    return "error: export job {} is {}".format(escape(job_id),
+                                               status["status"]), 409
+  return send_file(path,
+                   mimetype=status["mimetype"],
+                   as_attachment=True,
+                   download_name=status["filename"])
@@ -18,6 +18,7 @@ import logging
 import re
 
 from flask import Blueprint
+from flask import current_app
 from flask import g
 from flask import request
 from flask import Response
@@ -27,7 +28,9 @@ from markupsafe import escape
 
 from server.lib import fetch
 from server.lib.cache import cache
+import server.lib.coords_resolver as coords_resolver
 import server.lib.i18n as i18n
+from server.lib.shared import is_float
 from server.lib.shared import names
 from server.routes import TIMEOUT
 import server.services.datacommons as dc
@@ -707,6 +710,10 @@ def coords2places():
 
     Assume that the latitude/longitude at the same list index is a coordinate.
 
+    With ENABLE_LOCAL_COORDS2PLACES, coordinates are resolved locally against
+    cached boundaries when possible (see lib/coords_resolver.py), and the rest
+    are resolved by the mixer.
+
     Returns a list of { latitude: number, longitude: number, placeDcid: str, placeName: str } objects.
   """
   latitudes = request.args.getlist("latitudes")
@@ -719,7 +726,38 @@ def coords2places():
         'latitude': latitudes[idx],
         'longitude': longitudes[idx]
     })
-  coord2places = fetch.resolve_coordinates(coordinates)
+  result = []
+  # Resolve the coordinates we can locally.
+  unresolved_coordinates = coordinates
+  index = None
+  if current_app.config.get('ENABLE_LOCAL_COORDS2PLACES'):
+    index = coords_resolver.get_index(place_type,
+                                      current_app.config["GEO_JSON_PROP"],
+                                      current_app.config['CACHED_GEOJSONS'])
+  if index and coordinates:
+    unresolved_coordinates = []
+    valid_coordinates = []
+    for coord in coordinates:
+      if is_float(coord['latitude']) and is_float(coord['longitude']):
+        valid_coordinates.append(coord)
+      else:
+        unresolved_coordinates.append(coord)
+    resolved_dcids = index.resolve([
+        (float(c['latitude']), float(c['longitude'])) for c in valid_coordinates
+    ])
+    for coord, place_dcid in zip(valid_coordinates, resolved_dcids):
+      if not place_dcid:
+        unresolved_coordinates.append(coord)
+        continue
+      result.append({
+          'latitude': float(coord['latitude']),
+          'longitude': float(coord['longitude']),
+          'placeDcid': place_dcid,
+          'placeName': index.names.get(place_dcid) or place_dcid
+      })
+  if not unresolved_coordinates:
+    return Response(json.dumps(result), 200, mimetype='application/json')
+  coord2places = fetch.resolve_coordinates(unresolved_coordinates)
   # Get the place names for the places that are of the requested place type
   dcids_to_get_name = set()
   for _, places in coord2places.items():
@@ -729,7 +767,6 @@ def coords2places():
   place_names = names(list(dcids_to_get_name))
   # Populate results. For each resolved place coordinate, if there is an
   # attached place of the requested place type, add it to the result.
-  result = []
   for place_coord, places in coord2places.items():
     lat, lng = place_coord.split('#')
     for place in places:
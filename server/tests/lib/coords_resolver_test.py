@@ -0,0 +1,122 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import server.lib.coords_resolver as coords_resolver
+
+
+def _square_feature(dcid, west, south, size):
+  return {
+      'type': 'Feature',
+      'properties': {
+          'geoDcid': dcid,
+          'name': dcid + 'name'
+      },
+      'geometry': {
+          'type':
+              'Polygon',
+          'coordinates': [[[west, south], [west + size, south],
+                           [west + size, south + size], [west, south + size],
+                           [west, south]]]
+      }
+  }
+
+
+def _fine_square_feature(dcid, west, south, size):
+  """A square with a vertex in the middle of each side."""
+  feature = _square_feature(dcid, west, south, size)
+  ring = feature['geometry']['coordinates'][0]
+  fine_ring = []
+  for start, end in zip(ring, ring[1:]):
+    fine_ring += [start, [(start[0] + end[0]) / 2, (start[1] + end[1]) / 2]]
+  feature['geometry']['coordinates'] = [fine_ring + [ring[-1]]]
+  return feature
+
+
+class TestPolygonIndex(unittest.TestCase):
+
+  def setUp(self):
+    self.index = coords_resolver.PolygonIndex(
+        [
+            _square_feature('place1', 0, 0, 10),
+            _square_feature('place2', 10, 0, 10),
+            # Overlaps place1, so points in the overlap are ambiguous.
+            _square_feature('place3', 0, 8, 2),
+            # Features without polygons are skipped.
+            {
+                'properties': {
+                    'geoDcid': 'line'
+                },
+                'geometry': {
+                    'type': 'LineString',
+                    'coordinates': [[0, 0], [1, 1]]
+                }
+            },
+        ],
+        0.5)
+
+  def test_resolve(self):
+    self.assertEqual(len(self.index), 3)
+    self.assertEqual(
+        self.index.resolve([
+            # (latitude, longitude)
+            (5, 5),
+            (5, 15),
+            # Outside all places
+            (50, 50),
+            # Too close to the boundary between place1 and place2
+            (5, 9.8),
+            # In both place1 and place3
+            (9, 1),
+        ]),
+        ['place1', 'place2', '', '', ''])
+    self.assertEqual(self.index.names['place2'], 'place2name')
+
+  def test_resolve_empty(self):
+    self.assertEqual(self.index.resolve([]), [])
+
+  def test_get_index(self):
+    coords_resolver._INDEXES.clear()
+    self.addCleanup(coords_resolver._INDEXES.clear)
+    cached_geojsons = {
+        'parent1': {
+            'Country': {
+                'geoJsonCoordinates': {
+                    'features': [_square_feature('place1', 0, 0, 10)]
+                }
+            }
+        },
+        'parent2': {
+            'Country': {
+                'geoJsonCoordinates': {
+                    'features': [
+                        _fine_square_feature('place1', 0, 0, 12),
+                        _square_feature('place2', 12, 0, 10)
+                    ]
+                }
+            }
+        },
+    }
+    index = coords_resolver.get_index('Country', 'geoJsonCoordinates',
+                                      cached_geojsons)
+    self.assertEqual(len(index), 2)
+    # The finest boundary of place1 is used, which also covers (1, 11).
+    self.assertEqual(index.resolve([(1, 11), (1, 13)]), ['place1', 'place2'])
+    self.assertIs(
+        coords_resolver.get_index('Country', 'geoJsonCoordinates',
+                                  cached_geojsons), index)
+    self.assertIsNone(
+        coords_resolver.get_index('County', 'geoJsonCoordinates',
+                                  cached_geojsons))
@@ -0,0 +1,141 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import server.lib.export_jobs as export_jobs
+
+
+def _wait_for(jobs, job_id, statuses=(export_jobs.DONE, export_jobs.FAILED)):
+  for _ in range(100):
+    status = jobs.status(job_id)
+    if status and status['status'] in statuses:
+      return status
+    time.sleep(0.05)
+  raise AssertionError('Job {} did not finish'.format(job_id))
+
+
+class TestExportJobs(unittest.TestCase):
+
+  def setUp(self):
+    spool_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(spool_dir.cleanup)
+    self.spool_dir = spool_dir.name
+    self.jobs = export_jobs.ExportJobs(spool_dir.name)
+
+  def test_job_id(self):
+    assert export_jobs.job_id({
+        'a': 1,
+        'b': [1, 2]
+    }) == export_jobs.job_id({
+        'b': [1, 2],
+        'a': 1
+    })
+    assert export_jobs.job_id({'a': 1}) != export_jobs.job_id({'a': 2})
+
+  def test_build(self):
+    job_id = export_jobs.job_id({'a': 1})
+
+    def build(f, progress):
+      for i in range(3):
+        f.write(b'chunk')
+        progress(i + 1, 3)
+
+    status = self.jobs.submit(job_id, 'a.csv', 'text/csv', build)
+    assert status['jobId'] == job_id
+    assert status['status'] in (export_jobs.PENDING, export_jobs.RUNNING,
+                                export_jobs.DONE)
+    status = _wait_for(self.jobs, job_id)
+    assert status['status'] == export_jobs.DONE
+    assert status['shardsDone'] == 3
+    assert status['numShards'] == 3
+    assert status['size'] == 15
+    with open(self.jobs.result_path(job_id), 'rb') as f:
+      assert f.read() == b'chunkchunkchunk'
+
+  def test_dedupe(self):
+    job_id = export_jobs.job_id({'a': 1})
+    release = threading.Event()
+    calls = []
+
+    def build(f, progress):
+      calls.append(1)
+      release.wait(5)
+      f.write(b'data')
+
+    self.jobs.submit(job_id, 'a.csv', 'text/csv', build)
+    # Submitting while the job is still running reuses the job.
+    self.jobs.submit(job_id, 'a.csv', 'text/csv', build)
+    assert self.jobs.result_path(job_id) is None
+    release.set()
+    _wait_for(self.jobs, job_id)
+    # Submitting once the job is done reuses the result.
+    status = self.jobs.submit(job_id, 'a.csv', 'text/csv', build)
+    assert status['status'] == export_jobs.DONE
+    assert len(calls) == 1
+
+  def test_failed(self):
+    job_id = export_jobs.job_id({'a': 1})
+
+    def build(f, progress):
+      raise ValueError('mixer error')
+
+    self.jobs.submit(job_id, 'a.csv', 'text/csv', build)
+    status = _wait_for(self.jobs, job_id)
+    assert status['status'] == export_jobs.FAILED
+    assert self.jobs.result_path(job_id) is None
+
+    # Failed jobs are rerun when submitted again.
+    def build_ok(f, progress):
+      f.write(b'data')
+
+    self.jobs.submit(job_id, 'a.csv', 'text/csv', build_ok)
+    assert _wait_for(self.jobs, job_id)['status'] == export_jobs.DONE
+
+  def test_unknown_job(self):
+    assert self.jobs.status(export_jobs.job_id({'a': 1})) is None
+    assert self.jobs.status('../../etc/passwd') is None
+
+  def test_sweep(self):
+    expired_id = export_jobs.job_id({'a': 1})
+    live_id = export_jobs.job_id({'a': 2})
+    for job_id in [expired_id, live_id]:
+      self.jobs.submit(job_id, 'a.csv', 'text/csv',
+                       lambda f, progress: f.write(b'data'))
+      _wait_for(self.jobs, job_id)
+    # Ages the first job past the result TTL.
+    status_path = os.path.join(self.spool_dir, expired_id + '.json')
+    with open(status_path) as f:
+      status = json.load(f)
+    status['updated'] -= export_jobs._RESULT_TTL_SECONDS
+    with open(status_path, 'w') as f:
+      json.dump(status, f)
+
+    assert self.jobs.sweep() == 1
+    assert sorted(os.listdir(
+        self.spool_dir)) == [live_id + '.csv', live_id + '.json']
+    assert self.jobs.status(expired_id) is None
+
+  @mock.patch.object(export_jobs, '_SWEEP_INTERVAL_SECONDS', 0)
+  def test_sweep_on_submit(self):
+    with mock.patch.object(self.jobs, '_sweep') as sweep:
+      self.jobs.submit(export_jobs.job_id({'a': 1}), 'a.csv', 'text/csv',
+                       lambda f, progress: f.write(b'data'))
+    sweep.assert_called_once()
@@ -0,0 +1,80 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from parameterized import parameterized
+
+import server.lib.map_points as lib_map_points
+
+
+def _point(dcid, lat, lon):
+  return {
+      'placeDcid': dcid,
+      'placeName': dcid,
+      'latitude': lat,
+      'longitude': lon
+  }
+
+
+class TestParseBbox(unittest.TestCase):
+
+  @parameterized.expand([
+      ('-123,36,-121,38', (-123.0, 36.0, -121.0, 38.0)),
+      ('170,-10,-170,10', (170.0, -10.0, -170.0, 10.0)),
+      ('1,2,3', None),
+      ('a,b,c,d', None),
+      ('0,10,1,5', None),
+      ('0,-100,1,5', None),
+      ('-200,0,1,5', None),
+  ])
+  def test_parse_bbox(self, bbox_str, expected):
+    self.assertEqual(lib_map_points.parse_bbox(bbox_str), expected)
+
+
+class TestClusterPoints(unittest.TestCase):
+
+  def test_antimeridian_bbox(self):
+    bbox = (170.0, -10.0, -170.0, 10.0)
+    self.assertTrue(lib_map_points.in_bbox(_point('a', 0, 175), bbox))
+    self.assertTrue(lib_map_points.in_bbox(_point('a', 0, -175), bbox))
+    self.assertFalse(lib_map_points.in_bbox(_point('a', 0, 0), bbox))
+    self.assertFalse(lib_map_points.in_bbox(_point('a', 20, 175), bbox))
+
+  def test_cluster_counts(self):
+    points = [
+        _point('a', 37.1, -122.1),
+        _point('b', 37.2, -122.2),
+        _point('c', 37.3, -122.3),
+        _point('d', -33.9, 151.2),
+    ]
+    result = lib_map_points.cluster_points(points, 2)
+    self.assertEqual(len(result), 2)
+    self.assertEqual(result[0]['count'], 3)
+    self.assertEqual(result[0]['bbox'], [-122.3, 37.1, -122.1, 37.3])
+    # Single points in a cell are returned as-is
+    self.assertEqual(result[1], points[3])
+    self.assertEqual(sum(r.get('count', 1) for r in result), len(points))
+
+  def test_high_zoom_returns_points(self):
+    points = [_point('a', 37.1, -122.1), _point('b', 37.1000001, -122.1)]
+    self.assertEqual(
+        lib_map_points.cluster_points(points, lib_map_points.MAX_CLUSTER_ZOOM),
+        points)
+
+  def test_bbox_filter(self):
+    points = [_point('a', 37.1, -122.1), _point('b', -33.9, 151.2)]
+    self.assertEqual(
+        lib_map_points.cluster_points(points, 20, (-123, 36, -121, 38)),
+        [points[0]])
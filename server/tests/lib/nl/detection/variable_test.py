@@ -0,0 +1,172 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import unittest
+from unittest import mock
+
+from flask import Flask
+
+from server.lib.nl.common.counters import Counters
+from server.lib.nl.detection import variable
+from server.lib.nl.detection.types import DetectionArgs
+
+
+def _dargs() -> DetectionArgs:
+  return DetectionArgs(embeddings_index_types=['medium_ft'],
+                       mode='',
+                       reranker='',
+                       allow_triples=False,
+                       include_stop_words=True,
+                       var_threshold=None,
+                       speculative_var_search=True)
+
+
+def _search_vars(queries, index_types, reranker):
+  return {
+      'queryResults': {
+          q: {
+              'SV': [f'Var_{q}'],
+              'CosineScore': [0.9],
+              'SV_to_Sentences': {}
+          } for q in queries
+      },
+      'scoreThreshold': 0.5,
+      'debugLogs': {},
+  }
+
+
+@mock.patch.object(variable, '_prepare_multivar_queries',
+                   lambda query, stop_words: ([], []))
+class TestSpeculativeSearch(unittest.TestCase):
+
+  def setUp(self):
+    self.app = Flask(__name__)
+    ctx = self.app.app_context()
+    ctx.push()
+    self.addCleanup(ctx.pop)
+
+  @mock.patch('server.services.datacommons.nl_search_vars')
+  def test_hit(self, nl_search_vars):
+    nl_search_vars.side_effect = _search_vars
+    counters = Counters()
+    speculative = variable.SpeculativeSearch('poverty', _dargs())
+    got = variable.detect_vars('poverty', {}, _dargs(), speculative, counters)
+
+    assert got.single_var.svs == ['Var_poverty']
+    # Only searched once, speculatively.
+    assert nl_search_vars.call_count == 1
+    assert counters.get()['INFO'] == {'speculative_var_search_hit': 1}
+
+  @mock.patch('server.services.datacommons.nl_search_vars')
+  def test_miss(self, nl_search_vars):
+    # The speculative search never completes, and is not waited for.
+    blocked = threading.Event()
+    self.addCleanup(blocked.set)
+
+    def _search(queries, index_types, reranker):
+      if queries == ['poverty in california']:
+        blocked.wait(timeout=10)
+      return _search_vars(queries, index_types, reranker)
+
+    nl_search_vars.side_effect = _search
+    counters = Counters()
+    speculative = variable.SpeculativeSearch('poverty in california', _dargs())
+    got = variable.detect_vars('poverty', {}, _dargs(), speculative, counters)
+
+    assert got.single_var.svs == ['Var_poverty']
+    assert counters.get()['INFO'] == {'speculative_var_search_miss': 1}
+
+  @mock.patch('server.services.datacommons.nl_search_vars')
+  def test_miss_cancels(self, nl_search_vars):
+    nl_search_vars.side_effect = _search_vars
+    # The only worker is busy, so the speculative search is still queued.
+    executor = ThreadPoolExecutor(max_workers=1)
+    self.addCleanup(executor.shutdown)
+    blocked = threading.Event()
+    self.addCleanup(blocked.set)
+    executor.submit(blocked.wait, 10)
+    with mock.patch.object(variable, '_speculative_executor', executor):
+      speculative = variable.SpeculativeSearch('poverty in california',
+                                               _dargs())
+    variable.detect_vars('poverty', {}, _dargs(), speculative, Counters())
+
+    assert speculative._future.cancelled()
+    assert [c.args[0] for c in nl_search_vars.call_args_list] == [['poverty']]
+
+  @mock.patch('server.services.datacommons.nl_search_vars')
+  def test_hit_after_place_stripping(self, nl_search_vars):
+    nl_search_vars.side_effect = _search_vars
+    counters = Counters()
+    speculative = variable.SpeculativeSearch('Poverty  rate', _dargs())
+    got = variable.detect_vars('poverty rate', {}, _dargs(), speculative,
+                               counters)
+
+    # The query only differs by case and whitespace, so the results of the
+    # speculative search are used.
+    assert got.single_var.svs == ['Var_Poverty  rate']
+    assert nl_search_vars.call_count == 1
+    assert counters.get()['INFO'] == {'speculative_var_search_hit': 1}
+
+  @mock.patch('server.services.datacommons.nl_search_vars')
+  def test_partial_hit(self, nl_search_vars):
+    nl_search_vars.side_effect = _search_vars
+    counters = Counters()
+    with mock.patch.object(variable, '_prepare_multivar_queries',
+                           lambda query, stop_words: ([], ['poverty'])):
+      speculative = variable.SpeculativeSearch('poverty in california',
+                                               _dargs())
+      got = variable.detect_vars('poverty rate', {}, _dargs(), speculative,
+                                 counters)
+
+    assert got.single_var.svs == ['Var_poverty rate']
+    # The speculative search, and only the query it does not have.
+    assert sorted(c.args[0] for c in nl_search_vars.call_args_list) == [[
+        'poverty in california', 'poverty'
+    ], ['poverty rate']]
+    assert counters.get()['INFO'] == {'speculative_var_search_partial_hit': 1}
+
+  @mock.patch('server.services.datacommons.nl_search_vars')
+  def test_monovar_hit(self, nl_search_vars):
+    nl_search_vars.side_effect = _search_vars
+    counters = Counters()
+    speculative = variable.SpeculativeSearch('poverty', _dargs())
+    with mock.patch.object(variable, '_prepare_multivar_queries',
+                           lambda query, stop_words: ([], ['poverty rate'])):
+      got = variable.detect_vars('poverty', {}, _dargs(), speculative, counters)
+
+    assert got.single_var.svs == ['Var_poverty']
+    # The monovar query is reused, so it is a hit even though a multi-var part
+    # is searched.
+    assert sorted(
+        c.args[0] for c in nl_search_vars.call_args_list) == [['poverty'],
+                                                              ['poverty rate']]
+    assert counters.get()['INFO'] == {'speculative_var_search_hit': 1}
+
+  @mock.patch('server.services.datacommons.nl_search_vars')
+  def test_failed(self, nl_search_vars):
+
+    def _search(queries, index_types, reranker):
+      if threading.current_thread() is not threading.main_thread():
+        raise ValueError('NL server error')
+      return _search_vars(queries, index_types, reranker)
+
+    nl_search_vars.side_effect = _search
+    counters = Counters()
+    speculative = variable.SpeculativeSearch('poverty', _dargs())
+    got = variable.detect_vars('poverty', {}, _dargs(), speculative, counters)
+
+    assert got.single_var.svs == ['Var_poverty']
+    assert counters.get()['INFO'] == {'speculative_var_search_failed': 1}
@@ -0,0 +1,102 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from parameterized import parameterized
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.transform import from_bounds
+
+import server.lib.raster as lib_raster
+import server.lib.util as lib_util
+
+_TEST_RASTER = os.path.join(lib_util.get_repo_root(), 'test_county.tif')
+
+
+class TestRaster(unittest.TestCase):
+
+  @parameterized.expand([
+      ('test_county.tif', '/root/test_county.tif'),
+      ('sub/folder/file.tiff', '/root/sub/folder/file.tiff'),
+      ('../secrets.tif', None),
+      ('/abs.tif', None),
+      ('file.png', None),
+  ])
+  def test_raster_path(self, name, expected):
+    self.assertEqual(lib_raster.raster_path('/root', name), expected)
+
+  def test_raster_path_gcs(self):
+    self.assertEqual(lib_raster.raster_path('gs://bucket/rasters/', 'a.tif'),
+                     'gs://bucket/rasters/a.tif')
+
+  def test_tile_bounds(self):
+    half_world = 20037508.342789244
+    np.testing.assert_allclose(lib_raster.tile_bounds(
+        0, 0, 0), (-half_world, -half_world, half_world, half_world))
+    np.testing.assert_allclose(lib_raster.tile_bounds(1, 1, 0),
+                               (0, 0, half_world, half_world),
+                               atol=1e-6)
+
+  def test_colorize(self):
+    data = np.ma.masked_array([[0, 50, 100, 200]], mask=[[0, 0, 0, 1]])
+    rgba = lib_raster.colorize(data, 0, 100)
+    self.assertEqual(rgba.shape, (1, 4, 4))
+    self.assertEqual(tuple(rgba[0, 0]), (68, 1, 84, 255))
+    self.assertEqual(tuple(rgba[0, 1]), (33, 145, 140, 255))
+    self.assertEqual(tuple(rgba[0, 2]), (253, 231, 37, 255))
+    self.assertEqual(rgba[0, 3, 3], 0)
+
+  def test_read_region(self):
+    data, profile = lib_raster.read_region(_TEST_RASTER, (-120, 35, -110, 45),
+                                           lib_raster.LAT_LON_CRS, 50, 40,
+                                           Resampling.nearest)
+    self.assertEqual(data.shape, (40, 50))
+    self.assertEqual(profile['nodata'], -9999.0)
+    # Regions outside of the raster have no data.
+    data, _ = lib_raster.read_region(_TEST_RASTER, (0, 0, 10, 10),
+                                     lib_raster.LAT_LON_CRS, 10, 10,
+                                     Resampling.nearest)
+    self.assertTrue(data.mask.all())
+
+  def test_read_region_int_without_nodata(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      path = os.path.join(tmp_dir, 'int.tif')
+      with rasterio.open(path,
+                         'w',
+                         driver='GTiff',
+                         dtype='uint8',
+                         count=1,
+                         crs=lib_raster.LAT_LON_CRS,
+                         transform=from_bounds(0, 0, 10, 10, 10, 10),
+                         width=10,
+                         height=10) as dst:
+        dst.write(np.arange(100, dtype=np.uint8).reshape(10, 10), 1)
+      data, profile = lib_raster.read_region(path, (0, 0, 20, 10),
+                                             lib_raster.LAT_LON_CRS, 20, 10,
+                                             Resampling.nearest)
+    self.assertEqual(data.dtype, np.uint8)
+    self.assertEqual(profile['nodata'], 255)
+    # Only the half of the region outside of the raster has no data.
+    self.assertFalse(data.mask[:, :10].any())
+    self.assertTrue(data.mask[:, 10:].all())
+    np.testing.assert_array_equal(data[:, :10], np.arange(100).reshape(10, 10))
+
+  def test_unknown_raster(self):
+    with self.assertRaises(lib_raster.RasterNotFoundError) as e:
+      lib_raster.raster_bounds('/no/such/folder/missing.tif')
+    self.assertNotIn('/no/such/folder', str(e.exception))
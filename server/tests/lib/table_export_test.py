@@ -0,0 +1,115 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import io
+import json
+import unittest
+from unittest import mock
+
+from parameterized import parameterized
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import server.lib.table_export as lib_table_export
+
+_HEADER = [
+    'placeDcid', 'placeName', 'Date:Count_Person', 'Value:Count_Person',
+    'Source:Count_Person'
+]
+_ROWS = [
+    ['geoId/01', 'Alabama', '2015', 3120960, 'https://census.gov'],
+    ['geoId/02', '', '2015-05', '4.5', 'https://census.gov'],
+    ['geoId/06', 'California', '', '', ''],
+]
+
+
+class TestParseDate(unittest.TestCase):
+
+  @parameterized.expand([
+      ['2015', datetime.date(2015, 1, 1)],
+      ['2015-05', datetime.date(2015, 5, 1)],
+      ['2015-05-06', datetime.date(2015, 5, 6)],
+      ['2015-05-06T00:00:00', datetime.date(2015, 5, 6)],
+      ['', None],
+      ['2015-Q1', None],
+      ['2015-13', None],
+  ])
+  def test_parse_date(self, date, expected):
+    assert lib_table_export.parse_date(date) == expected
+
+
+class TestChunks(unittest.TestCase):
+
+  def _expected_columns(self):
+    return {
+        'placeDcid': ['geoId/01', 'geoId/02', 'geoId/06'],
+        'placeName': ['Alabama', None, 'California'],
+        'Date:Count_Person': [
+            datetime.date(2015, 1, 1),
+            datetime.date(2015, 5, 1), None
+        ],
+        'Value:Count_Person': [3120960.0, 4.5, None],
+        'Source:Count_Person': [
+            'https://census.gov', 'https://census.gov', None
+        ],
+    }
+
+  @mock.patch('server.lib.table_export.ROWS_PER_BATCH', 2)
+  def test_parquet(self):
+    data = b''.join(lib_table_export.parquet_chunks(_HEADER, iter(_ROWS)))
+    parquet_file = pq.ParquetFile(io.BytesIO(data))
+    assert parquet_file.metadata.num_row_groups == 2
+    table = parquet_file.read()
+    assert table.schema.field('Date:Count_Person').type == pa.date32()
+    assert table.schema.field('Value:Count_Person').type == pa.float64()
+    assert table.to_pydict() == self._expected_columns()
+
+  @mock.patch('server.lib.table_export.ROWS_PER_BATCH', 2)
+  def test_arrow(self):
+    data = b''.join(lib_table_export.arrow_chunks(_HEADER, iter(_ROWS)))
+    reader = pa.ipc.open_stream(data)
+    batches = list(reader)
+    assert len(batches) == 2
+    table = pa.Table.from_batches(batches)
+    assert table.to_pydict() == self._expected_columns()
+
+  def test_no_rows(self):
+    data = b''.join(lib_table_export.parquet_chunks(_HEADER, iter([])))
+    table = pq.read_table(io.BytesIO(data))
+    assert table.num_rows == 0
+    assert table.column_names == _HEADER
+
+  def test_jsonl(self):
+    data = ''.join(lib_table_export.jsonl_chunks(_HEADER, iter(_ROWS)))
+    records = [json.loads(line) for line in data.splitlines()]
+    assert records == [{
+        'placeDcid': 'geoId/01',
+        'placeName': 'Alabama',
+        'Date:Count_Person': '2015',
+        'Value:Count_Person': 3120960,
+        'Source:Count_Person': 'https://census.gov'
+    }, {
+        'placeDcid': 'geoId/02',
+        'placeName': None,
+        'Date:Count_Person': '2015-05',
+        'Value:Count_Person': 4.5,
+        'Source:Count_Person': 'https://census.gov'
+    }, {
+        'placeDcid': 'geoId/06',
+        'placeName': 'California',
+        'Date:Count_Person': None,
+        'Value:Count_Person': None,
+        'Source:Count_Person': None
+    }]
@@ -13,10 +13,14 @@
 # limitations under the License.
 
 import gzip
+import io
 import json
 import unittest
 from unittest.mock import patch
 
+from PIL import Image
+import rasterio
+
 import server.lib.shared as shared_api
 import server.routes.shared_api.choropleth as choropleth_api
 from web_app import app
@@ -682,3 +686,145 @@ class TestGetNodeGeoJson(unittest.TestCase):
                 'currentGeo': ''
             }
         })
+
+
+class TestGetMapPoints(unittest.TestCase):
+
+  @patch('server.routes.shared_api.choropleth.fetch.multiple_property_values')
+  @patch('server.routes.shared_api.choropleth.place_api.get_i18n_name')
+  @patch('server.routes.shared_api.choropleth.fetch.descendent_places')
+  def test_get_map_points(self, mock_descendents, mock_names,
+                          mock_property_values):
+    parent = 'geoId/06'
+    place_type = 'EpaReportingFacility'
+    mock_descendents.return_value = {parent: ['facility1', 'facility2', 'site']}
+    mock_names.return_value = {
+        'facility1': 'Facility 1',
+        'facility2': 'Facility 2',
+        'site': 'Site'
+    }
+
+    def property_values_side_effect(nodes, props):
+      if props == ['location', 'latitude', 'longitude']:
+        return {
+            'facility1': {
+                'location': [],
+                'latitude': ['37.1'],
+                'longitude': ['-122.1']
+            },
+            'facility2': {
+                'location': [],
+                'latitude': ['37.2'],
+                'longitude': ['-122.2']
+            },
+            'site': {
+                'location': ['latLong/1'],
+                'latitude': [],
+                'longitude': []
+            }
+        }
+      if nodes == ['latLong/1'] and props == ['latitude', 'longitude']:
+        return {'latLong/1': {'latitude': ['34.0'], 'longitude': ['-118.0']}}
+      return {}
+
+    mock_property_values.side_effect = property_values_side_effect
+
+    response = app.test_client().get(
+        '/api/choropleth/map-points?placeDcid={}&placeType={}'.format(
+            parent, place_type))
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(json.loads(response.data), [{
+        'placeDcid': 'facility1',
+        'placeName': 'Facility 1',
+        'latitude': 37.1,
+        'longitude': -122.1
+    }, {
+        'placeDcid': 'facility2',
+        'placeName': 'Facility 2',
+        'latitude': 37.2,
+        'longitude': -122.2
+    }, {
+        'placeDcid': 'site',
+        'placeName': 'Site',
+        'latitude': 34.0,
+        'longitude': -118.0
+    }])
+
+    # With a bbox around the two facilities and a low zoom, the facilities
+    # are clustered and the site is filtered out.
+    response = app.test_client().get(
+        '/api/choropleth/map-points?placeDcid={}&placeType={}&bbox={}&zoom=4'.
+        format(parent, place_type, '-123,36,-121,38'))
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(json.loads(response.data), [{
+        'clusterId': '4/10/24',
+        'count': 2,
+        'latitude': 37.150000000000006,
+        'longitude': -122.15,
+        'bbox': [-122.2, 37.1, -122.1, 37.2]
+    }])
+
+  def test_get_map_points_invalid_args(self):
+    response = app.test_client().get(
+        '/api/choropleth/map-points?placeDcid=geoId/06&placeType=City&bbox=1,2')
+    self.assertEqual(response.status_code, 400)
+    response = app.test_client().get(
+        '/api/choropleth/map-points?placeDcid=geoId/06&placeType=City&zoom=-1')
+    self.assertEqual(response.status_code, 400)
+
+
+class TestRaster(unittest.TestCase):
+
+  def test_get_geotiff(self):
+    response = app.test_client().get('/api/choropleth/geotiff')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.mimetype, 'image/tiff')
+    with rasterio.MemoryFile(response.data) as memfile:
+      with memfile.open() as dataset:
+        self.assertEqual((dataset.width, dataset.height), (986, 412))
+
+    response = app.test_client().get(
+        '/api/choropleth/geotiff?raster=test_county.tif&bbox=-125,30,-115,40')
+    self.assertEqual(response.status_code, 200)
+    with rasterio.MemoryFile(response.data) as memfile:
+      with memfile.open() as dataset:
+        self.assertEqual((dataset.width, dataset.height), (100, 100))
+        self.assertEqual(tuple(dataset.bounds), (-125, 30, -115, 40))
+
+  def test_get_geotiff_invalid_args(self):
+    response = app.test_client().get(
+        '/api/choropleth/geotiff?raster=../web_app.py')
+    self.assertEqual(response.status_code, 400)
+    response = app.test_client().get('/api/choropleth/geotiff?bbox=10,0,5,5')
+    self.assertEqual(response.status_code, 400)
+
+  def test_get_geotiff_unknown_raster(self):
+    response = app.test_client().get(
+        '/api/choropleth/geotiff?raster=missing.tif')
+    self.assertEqual(response.status_code, 404)
+    self.assertNotIn('missing.tif', response.get_data(as_text=True))
+
+  def test_get_raster_tile(self):
+    for fmt, image_format in [('png', 'PNG'), ('webp', 'WEBP')]:
+      response = app.test_client().get(
+          f'/api/choropleth/raster-tile/3/1/3.{fmt}?vmin=0&vmax=100')
+      self.assertEqual(response.status_code, 200)
+      image = Image.open(io.BytesIO(response.data))
+      self.assertEqual(image.format, image_format)
+      self.assertEqual(image.size, (256, 256))
+
+  def test_get_raster_tile_invalid_args(self):
+    response = app.test_client().get('/api/choropleth/raster-tile/3/8/3.png')
+    self.assertEqual(response.status_code, 400)
+    response = app.test_client().get('/api/choropleth/raster-tile/3/1/3.gif')
+    self.assertEqual(response.status_code, 400)
+    response = app.test_client().get(
+        '/api/choropleth/raster-tile/3/1/3.png?vmin=a')
+    self.assertEqual(response.status_code, 400)
+
+  def test_get_raster_tile_unknown_raster(self):
+    for params in ['raster=missing.tif', 'raster=missing.tif&vmin=0&vmax=1']:
+      response = app.test_client().get(
+          f'/api/choropleth/raster-tile/3/1/3.png?{params}')
+      self.assertEqual(response.status_code, 404)
+      self.assertNotIn('missing.tif', response.get_data(as_text=True))
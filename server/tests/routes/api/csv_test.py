@@ -12,9 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
+import io
+import json
+import tempfile
+import time
 import unittest
 from unittest import mock
 
+from parameterized import parameterized
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import server.routes.shared_api.csv as csv_api
 import server.tests.routes.api.mock_data as mock_data
 from web_app import app
 
@@ -44,9 +54,11 @@ class TestGetStatsWithinPlaceCsv(unittest.TestCase):
                                           })
     assert no_stat_vars.status_code == 400
 
-  @mock.patch('server.routes.shared_api.csv.dc.obs_point_within')
+  @mock.patch('server.routes.shared_api.csv.dc.obs_point')
+  @mock.patch('server.routes.shared_api.csv.fetch.descendent_places')
   @mock.patch('server.routes.shared_api.csv.names')
-  def test_single_date(self, mock_place_names, mock_point_within):
+  def test_single_date(self, mock_place_names, mock_descendent_places,
+                       mock_point):
     expected_parent_place = "country/USA"
     expected_child_type = "State"
     children_places = ["geoId/01", "geoId/02", "geoId/06"]
@@ -61,9 +73,16 @@ class TestGetStatsWithinPlaceCsv(unittest.TestCase):
 
     mock_place_names.side_effect = place_side_effect
 
-    def point_within_side_effect(parent_place, child_type, stat_vars, date):
-      if (parent_place != expected_parent_place or
-          child_type != expected_child_type or
+    def descendent_places_side_effect(parent_places, child_type):
+      if (parent_places == [expected_parent_place] and
+          child_type == expected_child_type):
+        return {expected_parent_place: children_places}
+      return {}
+
+    mock_descendent_places.side_effect = descendent_places_side_effect
+
+    def point_side_effect(entities, stat_vars, date):
+      if (entities != children_places or
           set(stat_vars) != set(expected_stat_vars)):
         return {}
       if date == "LATEST":
@@ -71,7 +90,7 @@ class TestGetStatsWithinPlaceCsv(unittest.TestCase):
       if date == expected_date:
         return mock_data.POINT_WITHIN_2015_ALL_FACETS
 
-    mock_point_within.side_effect = point_within_side_effect
+    mock_point.side_effect = point_side_effect
     endpoint_url = "api/csv/within"
     base_req_json = {
         "parentPlace": expected_parent_place,
@@ -149,9 +168,11 @@ class TestGetStatsWithinPlaceCsv(unittest.TestCase):
         "geoId/06,California,2015,9931715,https://www.census.gov/programs-surveys/popest.html,2015,3.7,https://www.bls.gov/lau/\r\n"
     )
 
-  @mock.patch('server.routes.shared_api.csv.dc.obs_series_within')
+  @mock.patch('server.routes.shared_api.csv.dc.obs_series')
+  @mock.patch('server.routes.shared_api.csv.fetch.descendent_places')
   @mock.patch('server.routes.shared_api.csv.names')
-  def test_date_range(self, mock_place_names, mock_series_within):
+  def test_date_range(self, mock_place_names, mock_descendent_places,
+                      mock_series):
     expected_parent_place = "country/USA"
     expected_child_type = "State"
     children_places = ["geoId/01", "geoId/06"]
@@ -169,15 +190,21 @@ class TestGetStatsWithinPlaceCsv(unittest.TestCase):
 
     mock_place_names.side_effect = place_side_effect
 
-    def series_within_side_effect(parent_place, child_type, stat_vars):
-      if (parent_place == expected_parent_place and
-          child_type == expected_child_type and
-          stat_vars == expected_stat_vars):
+    def descendent_places_side_effect(parent_places, child_type):
+      if (parent_places == [expected_parent_place] and
+          child_type == expected_child_type):
+        return {expected_parent_place: children_places}
+      return {}
+
+    mock_descendent_places.side_effect = descendent_places_side_effect
+
+    def series_side_effect(entities, stat_vars):
+      if entities == children_places and stat_vars == expected_stat_vars:
         return mock_data.SERIES_WITHIN_ALL_FACETS
       else:
         return {}
 
-    mock_series_within.side_effect = series_within_side_effect
+    mock_series.side_effect = series_side_effect
     endpoint_url = "api/csv/within"
     base_req_json = {
         "parentPlace": expected_parent_place,
@@ -444,3 +471,319 @@ class TestGetStatsWithinPlaceCsv(unittest.TestCase):
         "geoId/06,California,,,,2017-05,4.8,https://www.bls.gov/lau/\r\n" +
         "geoId/06,California,,,,2018-03,4.6,https://www.bls.gov/lau/\r\n" +
         "geoId/06,California,,,,2018-08,4.3,https://www.bls.gov/lau/\r\n")
+
+  @mock.patch('server.routes.shared_api.csv._MAX_SERIES_PER_SHARD', 2)
+  @mock.patch('server.routes.shared_api.csv.dc.obs_series')
+  @mock.patch('server.routes.shared_api.csv.fetch.descendent_places')
+  @mock.patch('server.routes.shared_api.csv.names')
+  def test_sharded_date_range(self, mock_place_names, mock_descendent_places,
+                              mock_series):
+    """Data is fetched one place at a time when a shard only fits one place."""
+    children_places = ["geoId/06", "geoId/01"]
+    mock_descendent_places.return_value = {"country/USA": children_places}
+    place_names = {"geoId/01": "", "geoId/06": "California"}
+    mock_place_names.side_effect = lambda places: {
+        p: place_names[p] for p in places
+    }
+
+    def series_side_effect(entities, stat_vars):
+      assert len(entities) == 1
+      result = {
+          "facets": mock_data.SERIES_WITHIN_ALL_FACETS["facets"],
+          "byVariable": {}
+      }
+      for sv, sv_data in mock_data.SERIES_WITHIN_ALL_FACETS["byVariable"].items(
+      ):
+        result["byVariable"][sv] = {
+            "byEntity": {
+                e: sv_data["byEntity"][e]
+                for e in entities
+                if e in sv_data["byEntity"]
+            }
+        }
+      return result
+
+    mock_series.side_effect = series_side_effect
+    response = app.test_client().post(
+        "api/csv/within",
+        json={
+            "parentPlace": "country/USA",
+            "childType": "State",
+            "statVars": ["Count_Person", "UnemploymentRate_Person"],
+            "minDate": "2018",
+            "rowLimit": 4
+        })
+    assert response.status_code == 200
+    assert mock_series.call_count == 2
+    assert response.data.decode("utf-8") == (
+        "placeDcid,placeName,Date:Count_Person,Value:Count_Person,Source:Count_Person,Date:UnemploymentRate_Person,Value:UnemploymentRate_Person,Source:UnemploymentRate_Person\r\n"
+        +
+        "geoId/01,,2018,1060665,https://www.census.gov/programs-surveys/popest.html,2018-01,4.5,https://www.bls.gov/lau/\r\n"
+        + "geoId/01,,,,,2018-07,3.9,https://www.bls.gov/lau/\r\n" +
+        "geoId/01,,2019,1068778,https://www.census.gov/programs-surveys/popest.html,2019-05,3.6,https://www.bls.gov/lau/\r\n"
+        + "geoId/06,California,,,,2018-03,4.6,https://www.bls.gov/lau/\r\n")
+
+  def test_invalid_format(self):
+    response = app.test_client().post("api/csv/within",
+                                      json={
+                                          "parentPlace": "country/USA",
+                                          "childType": "State",
+                                          "statVars": ["Count_Person"],
+                                          "format": "xlsx"
+                                      })
+    assert response.status_code == 400
+
+  @mock.patch('server.routes.shared_api.csv.dc.obs_point')
+  @mock.patch('server.routes.shared_api.csv.fetch.descendent_places')
+  @mock.patch('server.routes.shared_api.csv.names')
+  def test_parquet_format(self, mock_place_names, mock_descendent_places,
+                          mock_point):
+    children_places = ["geoId/01", "geoId/02", "geoId/06"]
+    mock_descendent_places.return_value = {"country/USA": children_places}
+    mock_place_names.return_value = {
+        "geoId/01": "Alabama",
+        "geoId/02": "",
+        "geoId/06": "California"
+    }
+    mock_point.return_value = mock_data.POINT_WITHIN_2015_ALL_FACETS
+    response = app.test_client().post(
+        "api/csv/within",
+        json={
+            "parentPlace": "country/USA",
+            "childType": "State",
+            "statVars": ["Count_Person", "UnemploymentRate_Person"],
+            "minDate": "2015",
+            "maxDate": "2015",
+            "format": "parquet"
+        })
+    assert response.status_code == 200
+    assert response.mimetype == "application/vnd.apache.parquet"
+    assert response.headers["Content-Disposition"].endswith(
+        "country/USA_State.parquet")
+    table = pq.read_table(io.BytesIO(response.data))
+    assert table.column("placeDcid").to_pylist() == children_places
+    assert table.column(
+        "Date:Count_Person").to_pylist() == [datetime.date(2015, 1, 1)] * 3
+    assert table.column("Value:UnemploymentRate_Person").to_pylist() == [
+        12, 5.6, 3.7
+    ]
+
+  @parameterized.expand([
+      ("csv",),
+      ("parquet",),
+      ("arrow",),
+      ("jsonl",),
+  ])
+  @mock.patch('server.routes.shared_api.csv.dc.obs_series')
+  @mock.patch('server.routes.shared_api.csv.fetch.descendent_places')
+  @mock.patch('server.routes.shared_api.csv.names')
+  def test_repeated_stat_var(self, export_format, mock_place_names,
+                             mock_descendent_places, mock_series):
+    """A statVar that is in the request more than once gets one set of
+    columns."""
+    children_places = ["geoId/01", "geoId/06"]
+    mock_descendent_places.return_value = {"country/USA": children_places}
+    mock_place_names.side_effect = lambda places: {
+        "geoId/01": "Alabama",
+        "geoId/06": "California"
+    }
+    mock_series.return_value = mock_data.SERIES_WITHIN_ALL_FACETS
+    response = app.test_client().post("api/csv/within",
+                                      json={
+                                          "parentPlace": "country/USA",
+                                          "childType": "State",
+                                          "statVars": [
+                                              "Count_Person",
+                                              "UnemploymentRate_Person",
+                                              "Count_Person"
+                                          ],
+                                          "minDate": "2018",
+                                          "format": export_format
+                                      })
+    assert response.status_code == 200
+    assert mock_series.call_args[0][1] == [
+        "Count_Person", "UnemploymentRate_Person"
+    ]
+    if export_format == "parquet":
+      columns = pq.read_table(io.BytesIO(response.data)).column_names
+    elif export_format == "arrow":
+      columns = pa.ipc.open_stream(response.data).read_all().column_names
+    elif export_format == "jsonl":
+      columns = list(
+          json.loads(response.data.decode("utf-8").splitlines()[0]).keys())
+    else:
+      columns = response.data.decode("utf-8").splitlines()[0].split(",")
+    assert columns == [
+        "placeDcid", "placeName", "Date:Count_Person", "Value:Count_Person",
+        "Source:Count_Person", "Date:UnemploymentRate_Person",
+        "Value:UnemploymentRate_Person", "Source:UnemploymentRate_Person"
+    ]
+
+
+class TestGetSeriesCsvRows(unittest.TestCase):
+
+  def _series_response(self, dates_by_sv):
+    return {
+        "facets": {
+            "1": {
+                "provenanceUrl": "url"
+            }
+        },
+        "byVariable": {
+            sv: {
+                "byEntity": {
+                    "geoId/01": {
+                        "orderedFacets": [{
+                            "facetId":
+                                "1",
+                            "observations": [{
+                                "date": date,
+                                "value": i
+                            } for i, date in enumerate(dates)]
+                        }]
+                    }
+                }
+            } for sv, dates in dates_by_sv.items()
+        }
+    }
+
+  @mock.patch('server.routes.shared_api.csv.names')
+  def test_granularity_independent_of_var_order(self, mock_place_names):
+    """A date is merged with the lower granularity dates that contain it,
+    whatever the order of the variables is."""
+    mock_place_names.return_value = {"geoId/01": "Alabama"}
+    response = self._series_response({
+        "Annual": ["2014", "2015", "2016"],
+        "Monthly": ["2015-04", "2016-02"]
+    })
+    expected_rows = [
+        ["2014", 0, "url", "", "", ""],
+        ["2015", 1, "url", "2015-04", 0, "url"],
+        ["2016", 2, "url", "2016-02", 1, "url"],
+    ]
+    rows = csv_api.get_series_csv_rows(response, ["Annual", "Monthly"], {},
+                                       None, None)
+    assert [row[2:] for row in rows] == expected_rows
+    rows = csv_api.get_series_csv_rows(response, ["Monthly", "Annual"], {},
+                                       None, None)
+    assert [row[2:] for row in rows
+           ] == [row[3:] + row[:3] for row in expected_rows]
+
+  @mock.patch('server.routes.shared_api.csv.names')
+  def test_date_range(self, mock_place_names):
+    mock_place_names.return_value = {"geoId/01": "Alabama"}
+    response = self._series_response({
+        "Annual": ["2013", "2014", "2015", "2016"],
+        "Monthly": ["2014-12", "2015-01", "2015-06", "2016-01", "2016-02"]
+    })
+    rows = csv_api.get_series_csv_rows(response, ["Annual", "Monthly"], {},
+                                       "2015-01", "2016")
+    assert [row[2:] for row in rows] == [
+        ["2015", 2, "url", "2015-01", 1, "url"],
+        ["", "", "", "2015-06", 2, "url"],
+        ["2016", 3, "url", "2016-01", 3, "url"],
+        ["", "", "", "2016-02", 4, "url"],
+    ]
+
+
+class TestExportJobs(unittest.TestCase):
+
+  def setUp(self):
+    spool_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(spool_dir.cleanup)
+    patcher = mock.patch.dict(app.config, {"EXPORT_JOB_DIR": spool_dir.name})
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def _wait_for_job(self, job_id):
+    for _ in range(100):
+      response = app.test_client().get("api/csv/within/jobs/" + job_id)
+      assert response.status_code == 200
+      if response.json["status"] in ("done", "failed"):
+        return response.json
+      time.sleep(0.05)
+    raise AssertionError("Job {} did not finish".format(job_id))
+
+  def test_invalid_request(self):
+    response = app.test_client().post("api/csv/within/jobs",
+                                      json={"parentPlace": "country/USA"})
+    assert response.status_code == 400
+
+  def test_unknown_job(self):
+    response = app.test_client().get("api/csv/within/jobs/" + "0" * 64)
+    assert response.status_code == 404
+    response = app.test_client().get("api/csv/within/jobs/" + "0" * 64 +
+                                     "/file")
+    assert response.status_code == 404
+    # The job id is escaped.
+    response = app.test_client().get(
+        "api/csv/within/jobs/%3Cimg%20src=x%20onerror=alert(1)%3E")
+    assert response.status_code == 404
+    assert b"<img" not in response.data
+    assert b"&lt;img" in response.data
+
+  @mock.patch('server.routes.shared_api.csv._MAX_SERIES_PER_SHARD', 2)
+  @mock.patch('server.routes.shared_api.csv.dc.obs_point')
+  @mock.patch('server.routes.shared_api.csv.fetch.descendent_places')
+  @mock.patch('server.routes.shared_api.csv.names')
+  def test_job(self, mock_place_names, mock_descendent_places, mock_point):
+    children_places = ["geoId/01", "geoId/02", "geoId/06"]
+    mock_descendent_places.return_value = {"country/USA": children_places}
+    place_names = {
+        "geoId/01": "Alabama",
+        "geoId/02": "",
+        "geoId/06": "California"
+    }
+    mock_place_names.side_effect = lambda places: {
+        p: place_names[p] for p in places
+    }
+
+    def point_side_effect(entities, stat_vars, date):
+      result = {
+          "facets": mock_data.POINT_WITHIN_2015_ALL_FACETS["facets"],
+          "byVariable": {}
+      }
+      for sv, sv_data in mock_data.POINT_WITHIN_2015_ALL_FACETS[
+          "byVariable"].items():
+        result["byVariable"][sv] = {
+            "byEntity": {
+                e: sv_data["byEntity"][e] for e in entities
+            }
+        }
+      return result
+
+    mock_point.side_effect = point_side_effect
+    req_json = {
+        "parentPlace": "country/USA",
+        "childType": "State",
+        "statVars": ["Count_Person"],
+        "minDate": "2015",
+        "maxDate": "2015"
+    }
+    response = app.test_client().post("api/csv/within/jobs", json=req_json)
+    assert response.status_code == 202
+    job_id = response.json["jobId"]
+    status = self._wait_for_job(job_id)
+    assert status["status"] == "done"
+    # 3 places x 1 variable in shards of at most 2 series
+    assert status["shardsDone"] == 2
+    assert status["numShards"] == 2
+
+    # The same request reuses the finished job.
+    response = app.test_client().post("api/csv/within/jobs", json=req_json)
+    assert response.json["jobId"] == job_id
+    assert response.json["status"] == "done"
+    assert mock_point.call_count == 2
+
+    response = app.test_client().get("api/csv/within/jobs/" + job_id + "/file")
+    assert response.status_code == 200
+    assert response.mimetype == "text/csv"
+    assert response.data.decode("utf-8") == (
+        "placeDcid,placeName,Date:Count_Person,Value:Count_Person,Source:Count_Person\r\n"
+        +
+        "geoId/01,Alabama,2015,3120960,https://www.census.gov/programs-surveys/popest.html\r\n"
+        +
+        "geoId/02,,2015,625216,https://www.census.gov/programs-surveys/popest.html\r\n"
+        +
+        "geoId/06,California,2015,9931715,https://www.census.gov/programs-surveys/popest.html\r\n"
+    )
@@ -92,3 +92,35 @@ class TestCoords2Places(unittest.TestCase):
         'placeName': 'place1'
     }]
     assert response_data == expected_response
+
+  @patch.dict(app.config, {'ENABLE_LOCAL_COORDS2PLACES': True})
+  @patch('server.routes.shared_api.place.fetch.resolve_coordinates')
+  @patch('server.routes.shared_api.place.names')
+  def test_get_places_for_coords_local(self, mock_place_names,
+                                       mock_resolve_coordinates):
+    # The first coordinate is in the middle of Kansas and is resolved with the
+    # cached country geojson. The second is in the ocean, so it goes to the
+    # mixer.
+    def resolve_coordinates_side_effect(coordinates):
+      if coordinates == [{'latitude': '0', 'longitude': '-140'}]:
+        return {'0#-140': []}
+      else:
+        return None
+
+    mock_resolve_coordinates.side_effect = resolve_coordinates_side_effect
+    mock_place_names.return_value = {}
+
+    response = app.test_client().get('/api/place/coords2places',
+                                     query_string={
+                                         "latitudes": [39, 0],
+                                         "longitudes": [-98, -140],
+                                         "placeType": "Country"
+                                     })
+    assert response.status_code == 200
+    assert json.loads(response.data) == [{
+        'latitude': 39.0,
+        'longitude': -98.0,
+        'placeDcid': 'country/USA',
+        'placeName': 'United States of America'
+    }]
+    mock_resolve_coordinates.assert_called_once()
@@ -455,3 +455,6 @@ DATE_HIGHEST_COVERAGE = 'HIGHEST_COVERAGE'
 
 # The name of the embeddings CSV file.
 EMBEDDINGS_FILE_NAME = 'embeddings.csv'
+
+# The name of the binary embeddings folder (see nl_server/store/binary_embeddings.py).
+EMBEDDINGS_BINARY_DIR_NAME = 'embeddings_bin'
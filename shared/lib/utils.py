@@ -14,9 +14,11 @@
 """Utility functions shared across servers."""
 
 import copy
+import functools
+import json
 import os
 import re
-from typing import Dict, List, Set
+from typing import Dict, Iterable, List, Set, Tuple
 
 from markupsafe import escape
 
@@ -82,6 +84,62 @@ def remove_words(text, remove_list):
   return text
 
 
+# A stop word that is a plain sequence of words, as opposed to a regex.
+_PLAIN_STOP_WORD_RE = re.compile(r"\w(?:[\w '-]*\w)?")
+_TOKEN_RE = re.compile(r"\w+")
+_SPACES_RE = re.compile(r" +")
+# The number of stop word lists to keep the compiled matchers of.
+_MAX_STOP_WORD_MATCHERS = 16
+
+
+class _StopWordMatcher:
+  """Removes stop words from a text with the same output as remove_words(),
+  without trying the stop words that cannot be in the text.
+
+  A plain stop word can only match a text that has all of its words, and
+  removing it never creates a new word in the text. So only the plain stop
+  words with all their words in the text, and the regex stop words, are tried,
+  with patterns compiled once, in the same order as remove_words().
+  """
+
+  def __init__(self, stop_words: Tuple[str]):
+    self._patterns = [re.compile(rf"\b{words}\b") for words in stop_words]
+    self._words: List[Set[str]] = []
+    # The regex stop words, which are always tried.
+    self._regexes: List[int] = []
+    # Word -> the plain stop words with it as their longest word.
+    self._index: Dict[str, List[int]] = {}
+    for i, words in enumerate(stop_words):
+      if not _PLAIN_STOP_WORD_RE.fullmatch(words):
+        self._regexes.append(i)
+        self._words.append(set())
+        continue
+      tokens = _TOKEN_RE.findall(words)
+      self._words.append(set(tokens))
+      self._index.setdefault(max(tokens, key=len), []).append(i)
+
+  def remove(self, text: str) -> str:
+    if not self._patterns:
+      return text
+    tokens = set(_TOKEN_RE.findall(text))
+    candidates = set(self._regexes)
+    for token in tokens:
+      candidates.update(self._index.get(token, []))
+    # The first stop word is always tried, since remove_words() only collapses
+    # the spaces of the text after trying it.
+    candidates.add(0)
+    for i in sorted(candidates):
+      if self._words[i] <= tokens:
+        text = self._patterns[i].sub("", text)
+      text = _SPACES_RE.sub(" ", text)
+    return text
+
+
+@functools.lru_cache(maxsize=_MAX_STOP_WORD_MATCHERS)
+def _stop_word_matcher(stop_words: Tuple[str]) -> _StopWordMatcher:
+  return _StopWordMatcher(stop_words)
+
+
 # Function to restore placeholders back to exclusions
 def restore_exclusions_with_placeholders(text, placeholder_map):
   for placeholder, exclusion in placeholder_map.items():
@@ -108,7 +166,7 @@ def remove_stop_words(input_str: str,
   input_str = replace_exclusions_with_placeholders(input_str, placeholder_map)
 
   # Remove words in remove_list
-  input_str = remove_words(input_str, stop_words)
+  input_str = _stop_word_matcher(tuple(stop_words)).remove(input_str)
 
   # Restore exclusions
   input_str = restore_exclusions_with_placeholders(input_str, placeholder_map)
@@ -147,6 +205,14 @@ def combine_stop_words(
                              List[str]] = constants.HEURISTIC_TYPES_IN_VARIABLES
 ) -> List[str]:
   """Returns all the combined stop words from the various constants."""
+  key = json.dumps(heuristics_to_skip, sort_keys=True)
+  # A copy, so that callers cannot change the cached list.
+  return list(_combine_stop_words(key))
+
+
+@functools.lru_cache(maxsize=_MAX_STOP_WORD_MATCHERS)
+def _combine_stop_words(heuristics_to_skip_json: str) -> Tuple[str]:
+  heuristics_to_skip = json.loads(heuristics_to_skip_json)
   # Make a copy.
   stop_words = copy.deepcopy(constants.STOP_WORDS)
 
@@ -158,7 +224,7 @@ def combine_stop_words(
   # Sort stop_words by the length (longer strings should come first) so that the
   # longer sentences can be removed first.
   stop_words = sorted(stop_words, key=len, reverse=True)
-  return stop_words
+  return tuple(stop_words)
 
 
 def remove_punctuations(s, include_comma=False):
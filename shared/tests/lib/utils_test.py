@@ -133,6 +133,26 @@ class TestNLUtilsRemoveStopWordsAndPunctuation(unittest.TestCase):
         constants.HEURISTIC_TYPES_IN_VARIABLES_TOOLFORMER)
     self.assertEqual(utils.remove_stop_words(query, stop_words), expected)
 
+  @parameterized.expand([
+      # Removing "b c d" first, then nothing.
+      ["a b c d e", ["b c d", "a b", "e"], "a "],
+      # Removing "x y" joins "a b", which is then removed.
+      ["a x y b c", ["x y", "a b"], " c"],
+      ["a  b", ["x", "a b"], ""],
+      ["a  b", ["a b", "x"], "a b"],
+      ["grown and growth", ["grow(n|th|s)?"], " and "],
+      ["population of", [], "population of"],
+  ])
+  def test_stop_word_matcher(self, text, stop_words, expected):
+    self.assertEqual(utils.remove_words(text, stop_words), expected)
+    self.assertEqual(
+        utils._stop_word_matcher(tuple(stop_words)).remove(text), expected)
+
+  def test_combine_stop_words_copy(self):
+    got = utils.combine_stop_words()
+    got.clear()
+    self.assertTrue(utils.combine_stop_words())
+
   @parameterized.expand(
       [[
           "this is a random query with no punctuation",
@@ -0,0 +1,116 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compares the local coordinates resolver against the Mixer resolve API."""
+
+import csv
+import os
+from typing import Dict, List
+
+from absl import app
+from absl import flags
+import requests
+
+import server.lib.coords_resolver as coords_resolver
+import server.lib.util as lib_util
+
+_RESOLVE_URL = 'https://autopush.api.datacommons.org/v2/resolve'
+# Max number of coordinates to send to the Mixer in one call.
+_BATCH_SIZE = 500
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string('coordinates', 'tools/coords2places_differ/coordinates.csv',
+                    'Full path to CSV of latitude,longitude,placeType')
+flags.DEFINE_string('geojson_prop', lib_util.DEFAULT_GEOJSON_PROP,
+                    'GeoJSON property of the cached geojsons to use.')
+flags.DEFINE_string('output', '/tmp/coords2places_diffs.csv',
+                    'Full path to CSV to write mismatches to.')
+
+AUTOPUSH_KEY = os.environ.get('AUTOPUSH_KEY')
+assert AUTOPUSH_KEY
+
+
+def _mixer_resolve(coords: List[Dict], place_type: str) -> List[str]:
+  """Resolves coordinates with the Mixer and returns the dcid of the place of
+  place_type for each coordinate (or empty string)."""
+  headers = {'Content-Type': 'application/json', 'x-api-key': AUTOPUSH_KEY}
+  result = []
+  for i in range(0, len(coords), _BATCH_SIZE):
+    batch = coords[i:i + _BATCH_SIZE]
+    nodes = [f'{c["latitude"]}#{c["longitude"]}' for c in batch]
+    resp = requests.post(_RESOLVE_URL,
+                         json={
+                             'nodes': nodes,
+                             'property': '<-geoCoordinate->dcid'
+                         },
+                         headers=headers).json()
+    dcid_by_node = {}
+    for entity in resp.get('entities', []):
+      for candidate in entity.get('candidates', []):
+        if candidate.get('dominantType') == place_type:
+          dcid_by_node[entity['node']] = candidate['dcid']
+          break
+    result.extend([dcid_by_node.get(n, '') for n in nodes])
+  return result
+
+
+def main(_):
+  coords_by_type: Dict[str, List[Dict]] = {}
+  with open(FLAGS.coordinates) as f:
+    for row in csv.DictReader(f):
+      coords_by_type.setdefault(row['placeType'], []).append(row)
+
+  cached_geojsons = lib_util.get_cached_geojsons()
+  mismatches = []
+  for place_type, coords in coords_by_type.items():
+    index = coords_resolver.get_index(place_type, FLAGS.geojson_prop,
+                                      cached_geojsons)
+    if not index:
+      print(f'{place_type}: no cached boundaries, skipping')
+      continue
+    local = index.resolve([
+        (float(c['latitude']), float(c['longitude'])) for c in coords
+    ])
+    mixer = _mixer_resolve(coords, place_type)
+    num_local = 0
+    num_agree = 0
+    for coord, local_dcid, mixer_dcid in zip(coords, local, mixer):
+      if not local_dcid:
+        continue
+      num_local += 1
+      if local_dcid == mixer_dcid:
+        num_agree += 1
+      else:
+        mismatches.append({
+            'latitude': coord['latitude'],
+            'longitude': coord['longitude'],
+            'placeType': place_type,
+            'local': local_dcid,
+            'mixer': mixer_dcid,
+        })
+    coverage = num_local / len(coords)
+    agreement = num_agree / num_local if num_local else 1
+    print(f'{place_type}: {len(coords)} coordinates, '
+          f'coverage {coverage:.2%}, agreement {agreement:.2%}')
+
+  with open(FLAGS.output, 'w') as f:
+    writer = csv.DictWriter(
+        f, fieldnames=['latitude', 'longitude', 'placeType', 'local', 'mixer'])
+    writer.writeheader()
+    writer.writerows(mismatches)
+  print(f'Wrote {len(mismatches)} mismatches to {FLAGS.output}')
+
+
+if __name__ == "__main__":
+  app.run(main)
@@ -0,0 +1,27 @@
+#!/bin/bash
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+set -e
+
+# Install all the requirements. Need `server` too since the tool uses it.
+cd ../..
+python3 -m venv .env
+source .env/bin/activate
+python3 -m pip install --upgrade pip
+pip3 install -r server/requirements.txt -q
+pip3 install -r tools/coords2places_differ/requirements.txt -q
+
+export FLASK_ENV=local
+python3 -m tools.coords2places_differ.differ "$@"
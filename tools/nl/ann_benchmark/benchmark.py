@@ -0,0 +1,180 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compares approximate and exact search latency and recall.
+
+Runs on synthetic embeddings, or on an embeddings index with --embeddings_path.
+"""
+
+import time
+
+from absl import app
+from absl import flags
+from sentence_transformers.util import semantic_search
+import torch
+
+from nl_server.config import LanceDBIndexConfig
+from nl_server.config import MemoryIndexConfig
+from nl_server.store import ivf
+from nl_server.store import quantize
+from nl_server.store.memory import MemoryEmbeddingsStore
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_list('sizes', ['100000', '1000000'],
+                  'Numbers of embeddings to benchmark.')
+flags.DEFINE_integer('dim', 384, 'Embedding dimension.')
+flags.DEFINE_integer('num_topics', 2000,
+                     'Number of clusters the embeddings are drawn around.')
+flags.DEFINE_integer('num_queries', 200, 'Number of queries to time.')
+flags.DEFINE_integer('top_k', 40, 'Number of results per query.')
+flags.DEFINE_list('nprobes', ['4', '8', '16', '32'],
+                  'IVF nprobe values to benchmark.')
+flags.DEFINE_integer('nlist', 0,
+                     'Number of IVF lists, or 0 for the default nlist.')
+flags.DEFINE_list('quantizations', ['FLOAT16', 'INT8'],
+                  'Quantizations to benchmark.')
+flags.DEFINE_integer(
+    'rescore_factor', 4,
+    'Quantized candidates to rescore, as a multiple of top_k.')
+flags.DEFINE_string(
+    'embeddings_path', '',
+    'Embeddings index (csv file or binary folder, local or gs://) to benchmark '
+    'instead of synthetic embeddings.')
+flags.DEFINE_string(
+    'lancedb_path', '',
+    'LanceDB folder of the same index as --embeddings_path, to compare the '
+    'LanceDB store with.')
+flags.DEFINE_integer('lancedb_nprobes', 0,
+                     'LanceDB nprobes, or 0 for the LanceDB default.')
+flags.DEFINE_integer('lancedb_refine_factor', 0,
+                     'LanceDB refine factor, or 0 to not refine.')
+
+
+def _embeddings(num, generator):
+  """Embeddings drawn around random topics, like sentences of related
+  variables."""
+  topics = torch.randn(FLAGS.num_topics, FLAGS.dim, generator=generator)
+  ids = torch.randint(FLAGS.num_topics, (num,), generator=generator)
+  embeddings = topics[ids] + 0.5 * torch.randn(
+      num, FLAGS.dim, generator=generator)
+  return torch.nn.functional.normalize(embeddings, dim=1)
+
+
+def _queries(embeddings, generator):
+  ids = torch.randint(len(embeddings), (FLAGS.num_queries,),
+                      generator=generator)
+  queries = embeddings[ids] + 0.05 * torch.randn(
+      FLAGS.num_queries, FLAGS.dim, generator=generator)
+  return torch.nn.functional.normalize(queries, dim=1)
+
+
+def _per_query_ms(search, queries):
+  """Times searching the queries one at a time, as the NL server does."""
+  results = []
+  start = time.perf_counter()
+  for query in queries:
+    results.extend(search(query.unsqueeze(0)))
+  elapsed = time.perf_counter() - start
+  return elapsed * 1000 / len(queries), results
+
+
+def _recall(exact, approx):
+  found = 0
+  total = 0
+  for exact_hits, approx_hits in zip(exact, approx):
+    exact_ids = set(h['corpus_id'] for h in exact_hits)
+    found += len(exact_ids & set(h['corpus_id'] for h in approx_hits))
+    total += len(exact_ids)
+  return found / total
+
+
+def _benchmark_lancedb(sentences, queries, exact):
+  """Compares a LanceDB store of the index with exact search, by sentence."""
+  # Imported here since LanceDB is not available on all platforms.
+  from nl_server.store.lancedb import LanceDBStore
+
+  store = LanceDBStore(
+      LanceDBIndexConfig(embeddings_path=FLAGS.lancedb_path,
+                         nprobes=FLAGS.lancedb_nprobes or None,
+                         refine_factor=FLAGS.lancedb_refine_factor or None))
+  query_lists = queries.tolist()
+  start = time.perf_counter()
+  matches = []
+  for query in query_lists:
+    matches.extend(store.vector_search([query], FLAGS.top_k))
+  per_query_ms = (time.perf_counter() - start) * 1000 / len(query_lists)
+  start = time.perf_counter()
+  store.vector_search(query_lists, FLAGS.top_k)
+  batch_ms = (time.perf_counter() - start) * 1000 / len(query_lists)
+
+  found = 0
+  total = 0
+  for exact_hits, query_matches in zip(exact, matches):
+    exact_sentences = set(sentences[h['corpus_id']] for h in exact_hits)
+    found += len(exact_sentences & set(m.sentence for m in query_matches))
+    total += len(exact_sentences)
+  print(f'  lancedb: {per_query_ms:.2f} ms/query, '
+        f'{batch_ms:.2f} ms/query in one request, '
+        f'recall@{FLAGS.top_k}={found / total:.3f}')
+
+
+def _benchmark(name, embeddings, sentences=None):
+  generator = torch.Generator().manual_seed(0)
+  queries = _queries(embeddings, generator)
+  nlist = FLAGS.nlist or ivf.default_nlist(len(embeddings))
+
+  start = time.perf_counter()
+  index = ivf.IVFIndex.build(embeddings, nlist)
+  build_s = time.perf_counter() - start
+
+  exact_ms, exact = _per_query_ms(
+      lambda q: semantic_search(q, embeddings, top_k=FLAGS.top_k), queries)
+  print(f'\n{name}: {len(embeddings)} embeddings '
+        f'({embeddings.nelement() * embeddings.element_size()} bytes)')
+  print(f'  exact: {exact_ms:.2f} ms/query')
+  print(f'  ivf: {index.nlist} lists, built in {build_s:.1f}s')
+  for nprobe in FLAGS.nprobes:
+    nprobe = int(nprobe)
+    ivf_ms, approx = _per_query_ms(
+        lambda q: index.search(embeddings, q, FLAGS.top_k, nprobe), queries)
+    print(f'  ivf nprobe={nprobe}: {ivf_ms:.2f} ms/query, '
+          f'recall@{FLAGS.top_k}={_recall(exact, approx):.3f}')
+  rescore_factor = FLAGS.rescore_factor
+  for quantization in FLAGS.quantizations:
+    quantized = quantize.QuantizedEmbeddings(embeddings, quantization)
+    quantized_ms, approx = _per_query_ms(
+        lambda q: quantized.search(embeddings, q, FLAGS.top_k, rescore_factor),
+        queries)
+    print(f'  {quantization.lower()} ({quantized.nbytes} bytes): '
+          f'{quantized_ms:.2f} ms/query, '
+          f'recall@{FLAGS.top_k}={_recall(exact, approx):.3f}')
+  if FLAGS.lancedb_path and sentences:
+    _benchmark_lancedb(sentences, queries, exact)
+
+
+def main(_):
+  torch.set_grad_enabled(False)
+  if FLAGS.embeddings_path:
+    store = MemoryEmbeddingsStore(
+        MemoryIndexConfig(embeddings_path=FLAGS.embeddings_path))
+    embeddings = torch.nn.functional.normalize(store.dataset_embeddings, dim=1)
+    _benchmark(FLAGS.embeddings_path, embeddings, store.sentences)
+    return
+  for size in FLAGS.sizes:
+    generator = torch.Generator().manual_seed(0)
+    _benchmark('synthetic', _embeddings(int(size), generator))
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -14,6 +14,7 @@
 """Build the embeddings index from variable and topic descriptions."""
 
 import logging
+import os
 import sys
 
 from absl import app
@@ -30,10 +31,34 @@ flags.DEFINE_string('embeddings_name', '',
 flags.DEFINE_string('output_dir', '',
                     'The output directory to save the embeddings files/db')
 
+flags.DEFINE_enum('binary_dtype', 'float32', ['float32', 'float16'],
+                  'Type of the embeddings in the binary embeddings folder')
+
 flags.DEFINE_string(
     'additional_catalog_path', '',
     'Path to an additional catalog yaml file. Can be a local or a GCS path')
 
+flags.DEFINE_integer(
+    'num_workers', 1,
+    'Number of batches of sentences to encode at the same time')
+
+flags.DEFINE_bool(
+    'use_processes', False,
+    'Whether to encode in num_workers processes, each with its own model, '
+    'instead of threads. Use for local models, where threads are limited by '
+    'the GIL; threads are enough for API models like Vertex AI.')
+
+flags.DEFINE_bool(
+    'incremental', False,
+    'Whether to update the index of the previous build in the output folder in '
+    'place, only computing the embeddings of the new sentences. Falls back to a '
+    'full build if there is no previous build with the same model.')
+
+flags.DEFINE_string(
+    'checkpoint_dir', '',
+    'Local folder to save the computed embeddings to as they are computed, so '
+    'an interrupted run can be resumed. Defaults to the local output folder.')
+
 
 def _init_logger():
   # Log to stdout for easy redirect of the output text.
@@ -59,7 +84,10 @@ def main(_):
   index_config = catalog.indexes[embeddings_name]
   # Use default env config: autopush for base DCs and custom env for custom DCs.
   env = config_reader.read_env()
-  model = utils.get_model(catalog, env, index_config.model)
+  model_config = utils.get_model_config(catalog, env, index_config.model)
+  model = None
+  if not FLAGS.use_processes:
+    model = utils.get_model(catalog, env, index_config.model)
 
   # Construct a file manager
   input_dir = index_config.source_path
@@ -68,21 +96,50 @@ def main(_):
   # Build and save preindex
   preindexes = utils.build_and_save_preindexes(fm)
 
-  # Load existing embeddings from previous run.
-  existing_embeddings = utils.load_existing_embeddings(
-      index_config.embeddings_path)
-
   # Compute embeddings
-  final_embeddings = utils.compute_embeddings(model, preindexes,
-                                              existing_embeddings)
-
-  # Save embeddings
-  if index_config.store_type == 'MEMORY':
-    utils.save_embeddings_memory(fm.local_output_dir(), final_embeddings)
-  elif index_config.store_type == 'LANCEDB':
-    utils.save_embeddings_lancedb(fm.local_output_dir(), final_embeddings)
-  else:
-    raise ValueError(f'Unknown store type: {index_config.store_type}')
+  checkpoint_dir = FLAGS.checkpoint_dir or fm.local_output_dir()
+  checkpoint_path = os.path.join(
+      checkpoint_dir, f'embeddings_checkpoint.{index_config.model}.jsonl')
+
+  def _compute(preindexes, existing_embeddings):
+    return utils.compute_embeddings(
+        model,
+        preindexes,
+        existing_embeddings,
+        num_workers=FLAGS.num_workers,
+        model_config=model_config if FLAGS.use_processes else None,
+        checkpoint_path=checkpoint_path)
+
+  manifest = utils.build_manifest(index_config.model, index_config.store_type,
+                                  preindexes)
+  updated = False
+  if FLAGS.incremental and fm.maybe_download_output():
+    # Update the index of the previous build in the output folder.
+    updated = utils.update_index(fm.local_output_dir(),
+                                 manifest,
+                                 preindexes,
+                                 lambda added: _compute(added, []),
+                                 binary_dtype=FLAGS.binary_dtype)
+
+  if not updated:
+    # Load existing embeddings from previous run.
+    existing_embeddings = utils.load_existing_embeddings(
+        index_config.embeddings_path)
+    final_embeddings = _compute(preindexes, existing_embeddings)
+
+    # Save embeddings
+    if index_config.store_type == 'MEMORY':
+      utils.save_embeddings_memory(fm.local_output_dir(),
+                                   final_embeddings,
+                                   binary_dtype=FLAGS.binary_dtype)
+    elif index_config.store_type == 'LANCEDB':
+      utils.save_embeddings_lancedb(fm.local_output_dir(), final_embeddings)
+    else:
+      raise ValueError(f'Unknown store type: {index_config.store_type}')
+
+  # Save the manifest of the sentences in the index, for the next incremental
+  # build.
+  utils.save_manifest(fm.local_output_dir(), manifest)
 
   # Save index config
   utils.save_index_config(fm, index_config)
@@ -65,6 +65,16 @@ class FileManager(object):
   def index_config_path(self):
     return os.path.join(self._local_output_dir, _INDEX_CONFIG_YAML)
 
+  def maybe_download_output(self) -> bool:
+    """
+    Download the files of a previous build from the output path if it is GCS.
+
+    Returns whether there were any.
+    """
+    if gcs.is_gcs_path(self._output_dir):
+      return gcs.download_blob_by_path(self._output_dir, self._local_output_dir)
+    return bool(os.listdir(self._local_output_dir))
+
   def maybe_upload_to_gcs(self):
     """
     Upload the generated files to GCS if the input or output paths are GCS.
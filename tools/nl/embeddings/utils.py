@@ -13,18 +13,24 @@
 # limitations under the License.
 """Common Utility functions for Embeddings."""
 
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
 import csv
 from dataclasses import asdict
 from dataclasses import dataclass
 import datetime as datetime
+import functools
 import glob
 import hashlib
 import itertools
+import json
 import logging
 import os
+import threading
 import time
-from typing import Dict, List
+from typing import Callable, Dict, List, Set
 
+import numpy as np
 import pandas as pd
 import yaml
 
@@ -32,8 +38,10 @@ from nl_server import config_reader
 from nl_server.config import Catalog
 from nl_server.config import Env
 from nl_server.config import IndexConfig
+from nl_server.config import ModelConfig
 from nl_server.embeddings import EmbeddingsModel
 from nl_server.model.create import create_embeddings_model
+from nl_server.store import binary_embeddings
 from shared.lib import constants
 from shared.lib import gcs
 from tools.nl.embeddings.file_manager import FileManager
@@ -42,8 +50,11 @@ _COL_DCID = 'dcid'
 _COL_SENTENCE = 'sentence'
 _CHUNK_SIZE = 100
 _NUM_RETRIES = 3
+_RETRY_BACKOFF_SECONDS = 1
 _LANCEDB_TABLE = 'datacommons'
 _MD5_SUM_FILE = 'md5sum.txt'
+_MANIFEST_FILE = 'embeddings_manifest.json'
+_MANIFEST_VERSION = 1
 
 
 @dataclass
@@ -68,14 +79,19 @@ def get_md5sum(file_path: str) -> str:
     return hashlib.md5(f.read().encode('utf-8')).hexdigest()
 
 
-def get_model(catalog: Catalog, env: Env, model_name: str) -> EmbeddingsModel:
-  logging.info("Loading model")
+def get_model_config(catalog: Catalog, env: Env,
+                     model_name: str) -> ModelConfig:
   model_config = catalog.models[model_name]
   if model_name in env.vertex_ai_models:
     vertex_ai_config = env.vertex_ai_models[model_name]
     model_config = config_reader.merge_vertex_ai_configs(
         model_config, vertex_ai_config)
-  return create_embeddings_model(model_config)
+  return model_config
+
+
+def get_model(catalog: Catalog, env: Env, model_name: str) -> EmbeddingsModel:
+  logging.info("Loading model")
+  return create_embeddings_model(get_model_config(catalog, env, model_name))
 
 
 def load_existing_embeddings(embeddings_path: str) -> List[Embedding]:
@@ -83,14 +99,21 @@ def load_existing_embeddings(embeddings_path: str) -> List[Embedding]:
   try:
     if gcs.is_gcs_path(embeddings_path):
       embeddings_path = gcs.maybe_download(embeddings_path)
+    if binary_embeddings.is_binary_embeddings(embeddings_path):
+      loaded = binary_embeddings.load(embeddings_path)
+      return [
+          Embedding(PreIndex(text=sentence, dcid=dcid), vector.tolist())
+          for sentence, dcid, vector in zip(loaded.sentences, loaded.dcids,
+                                            loaded.vectors.astype(np.float32))
+      ]
     df = pd.read_csv(embeddings_path)
-    embeddings = []
-    for _, row in df.iterrows():
-      dcid = row['dcid']
-      sentence = row['sentence']
-      vector = row.drop(labels=['dcid', 'sentence']).astype(float).tolist()
-      embeddings.append(Embedding(PreIndex(text=sentence, dcid=dcid), vector))
-    return embeddings
+    vectors = df.drop(columns=[_COL_DCID, _COL_SENTENCE]).to_numpy(
+        dtype=np.float64).tolist()
+    return [
+        Embedding(PreIndex(text=sentence, dcid=dcid), vector)
+        for sentence, dcid, vector in zip(df[_COL_SENTENCE].tolist(),
+                                          df[_COL_DCID].tolist(), vectors)
+    ]
   except Exception as e:
     logging.error(e)
     return []
@@ -145,50 +168,151 @@ def build_and_save_preindexes(fm: FileManager) -> List[PreIndex]:
   return preindexes
 
 
-def compute_embeddings(
-    model: EmbeddingsModel,
-    preindexes: List[PreIndex],
-    existing_embeddings: List[Embedding],
-) -> List[Embedding]:
+def _to_lists(vectors) -> List[List[float]]:
+  if hasattr(vectors, 'tolist'):
+    # A tensor or an array.
+    return vectors.tolist()
+  return [list(v) for v in vectors]
+
+
+def _encode_with_retries(model: EmbeddingsModel,
+                         texts: List[str]) -> List[List[float]]:
+  """Encodes texts, retrying failures with backoff.
+
+  Raises:
+    RuntimeError: if the texts could not be encoded after _NUM_RETRIES tries.
+  """
+  for attempt in range(_NUM_RETRIES):
+    try:
+      resp = model.encode(texts)
+      if len(resp) != len(texts):
+        raise Exception(f'Expected {len(texts)} but got {len(resp)}')
+      return _to_lists(resp)
+    except Exception as e:
+      logging.error('Exception (attempt %d): %s', attempt + 1, e)
+      if attempt + 1 < _NUM_RETRIES:
+        time.sleep(_RETRY_BACKOFF_SECONDS * 2**attempt)
+  raise RuntimeError(
+      f'Could not encode {len(texts)} texts after {_NUM_RETRIES} tries')
+
+
+# The model of each encoding process.
+_process_model: EmbeddingsModel = None
+
+
+def _init_process(model_config: ModelConfig):
+  global _process_model
+  _process_model = create_embeddings_model(model_config)
+
+
+def _encode_in_process(texts: List[str]) -> List[List[float]]:
+  return _encode_with_retries(_process_model, texts)
+
+
+class _Checkpoint:
+  """Vectors computed so far, appended to a file as batches complete, so an
+  interrupted build resumes without recomputing them.
+
+  Each line of the file is a JSON [text, vector].
+  """
+
+  def __init__(self, path: str):
+    self._path = path
+    self._lock = threading.Lock()
+    # text -> vector
+    self.vectors: Dict[str, List[float]] = {}
+    if os.path.exists(path):
+      with open(path) as f:
+        for line in f:
+          try:
+            text, vector = json.loads(line)
+          except ValueError:
+            # A line cut short by the interruption.
+            continue
+          self.vectors[text] = vector
+      logging.info('Resuming from %d vectors in %s', len(self.vectors), path)
+    # Rewrites the file, dropping any partial line.
+    with open(path, 'w') as f:
+      for text, vector in self.vectors.items():
+        f.write(json.dumps([text, vector]) + '\n')
+
+  def add(self, texts: List[str], vectors: List[List[float]]):
+    with self._lock:
+      with open(self._path, 'a') as f:
+        for text, vector in zip(texts, vectors):
+          f.write(json.dumps([text, vector]) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+      self.vectors.update(zip(texts, vectors))
+
+  def remove(self):
+    os.remove(self._path)
+
+
+def compute_embeddings(model: EmbeddingsModel,
+                       preindexes: List[PreIndex],
+                       existing_embeddings: List[Embedding],
+                       num_workers: int = 1,
+                       model_config: ModelConfig = None,
+                       checkpoint_path: str = '',
+                       batch_size: int = _CHUNK_SIZE) -> List[Embedding]:
   """Compute embeddings for the given preindexes
 
+  The texts to compute are sorted by length, so each batch has texts of
+  similar length, and the batches are encoded by num_workers threads (or
+  processes, with model_config).
+
   Args:
-    model: The embeddings model object,
+    model: The embeddings model object. Not used with model_config.
     preindexes: A list of preindex to compute embeddings for
     existing_embeddings: A list of embeddings from previous run.
+    num_workers: The number of batches to encode at the same time.
+    model_config: If set, the batches are encoded by num_workers processes,
+      each with its own model created from this config.
+    checkpoint_path: If set, the computed vectors are saved to this file as
+      they are computed, and the vectors already in it are reused. The file is
+      removed once all the vectors are computed. It must only be reused with the
+      same model.
+    batch_size: The number of texts per model call.
   Return:
     A list of embeddings for the preindexes.
   """
   logging.info("Compute embeddings with size %s", len(preindexes))
   start = time.time()
 
-  result: List[Embedding] = []
-  preindexes_to_compute: List[PreIndex] = []
+  checkpoint = _Checkpoint(checkpoint_path) if checkpoint_path else None
 
-  # Check each preindex, use existing embeddings vector if possible
-  existing_embeddings_map = {x.preindex.text: x for x in existing_embeddings}
-  for p in preindexes:
-    if p.text in existing_embeddings_map:
-      # Only use the saved sentence vector. The dcid might be different.
-      result.append(Embedding(p, existing_embeddings_map[p.text].vector))
-    else:
-      preindexes_to_compute.append(p)
+  # Use existing embeddings vectors if possible. Only use the saved sentence
+  # vector. The dcid might be different.
+  text2vector = {x.preindex.text: x.vector for x in existing_embeddings}
+  if checkpoint:
+    text2vector.update(checkpoint.vectors)
+  texts_to_compute = sorted(set(
+      p.text for p in preindexes if p.text not in text2vector),
+                            key=len)
 
   # Compute embeddings with model inference
-  logging.info("%d embeddings need computation", len(preindexes_to_compute))
-  for i, chunk in enumerate(_chunk_list(preindexes_to_compute, _CHUNK_SIZE)):
-    logging.info('texts %d to %d', i * _CHUNK_SIZE, (i + 1) * _CHUNK_SIZE - 1)
-    for i in range(_NUM_RETRIES):
-      try:
-        resp = model.encode([x.text for x in chunk])
-        if len(resp) != len(chunk):
-          raise Exception(f'Expected {len(chunk)} but got {len(resp)}')
-        for i, vector in enumerate(resp):
-          result.append(
-              Embedding(PreIndex(chunk[i].text, chunk[i].dcid), vector))
-        break
-      except Exception as e:
-        logging.error('Exception: %s', e)
+  logging.info("%d embeddings need computation", len(texts_to_compute))
+  batches = [list(b) for b in _chunk_list(texts_to_compute, batch_size)]
+  if model_config:
+    executor = ProcessPoolExecutor(max_workers=num_workers,
+                                   initializer=_init_process,
+                                   initargs=(model_config,))
+    encode = _encode_in_process
+  else:
+    executor = ThreadPoolExecutor(max_workers=num_workers)
+    encode = functools.partial(_encode_with_retries, model)
+  with executor:
+    for i, (batch,
+            vectors) in enumerate(zip(batches, executor.map(encode, batches))):
+      text2vector.update(zip(batch, vectors))
+      if checkpoint:
+        checkpoint.add(batch, vectors)
+      logging.info('Computed batch %d of %d', i + 1, len(batches))
+
+  result = [Embedding(p, text2vector[p.text]) for p in preindexes]
+  if checkpoint:
+    checkpoint.remove()
 
   # Sort result
   result.sort(key=lambda x: x.preindex.text)
@@ -196,17 +320,34 @@ def compute_embeddings(
   return result
 
 
-def save_embeddings_memory(local_dir: str, embeddings: List[Embedding]):
-  """
-  Save embeddings as csv file.
-  """
+def _to_dataframe(embeddings: List[Embedding]) -> pd.DataFrame:
+  """Gets the rows of the embeddings csv file."""
   df = pd.DataFrame([x.vector for x in embeddings])
   df[_COL_DCID] = [x.preindex.dcid for x in embeddings]
   df[_COL_SENTENCE] = [x.preindex.text for x in embeddings]
+  return df
+
+
+def save_embeddings_memory(local_dir: str,
+                           embeddings: List[Embedding],
+                           binary_dtype: str = 'float32'):
+  """
+  Save embeddings as csv file, and as a binary embeddings folder.
+  """
+  df = _to_dataframe(embeddings)
   local_file = os.path.join(local_dir, constants.EMBEDDINGS_FILE_NAME)
   df.to_csv(local_file, index=False)
   logging.info("Saved embeddings to %s", local_file)
 
+  binary_dir = os.path.join(local_dir, constants.EMBEDDINGS_BINARY_DIR_NAME)
+  binary_embeddings.save(binary_dir,
+                         np.array([x.vector for x in embeddings],
+                                  dtype=np.float32),
+                         dcids=[x.preindex.dcid for x in embeddings],
+                         sentences=[x.preindex.text for x in embeddings],
+                         dtype=binary_dtype)
+  logging.info("Saved binary embeddings to %s", binary_dir)
+
 
 def save_embeddings_lancedb(local_dir: str, embeddings: List[Embedding]):
   # lancedb has issues in docker containers on certain platforms.
@@ -221,10 +362,223 @@ def save_embeddings_lancedb(local_dir: str, embeddings: List[Embedding]):
       _COL_SENTENCE: x.preindex.text,
       'vector': x.vector
   } for x in embeddings]
-  db.create_table(_LANCEDB_TABLE, records)
+  db.create_table(_LANCEDB_TABLE, records, mode='overwrite')
   logging.info("Saved embeddings as lancedb file in %s", local_dir)
 
 
 def save_index_config(fm: FileManager, index_config: IndexConfig):
   with open(fm.index_config_path(), 'w') as f:
     yaml.dump(asdict(index_config), f)
+
+
+#
+# Incremental builds.
+#
+# Each build records a manifest of the sentences in the index in the output
+# folder. An incremental build diffs the new preindexes against the manifest of
+# the previous build, computes vectors only for the new sentences, and updates
+# the previous index in place.
+#
+
+# Computes the embeddings of some preindexes.
+_ComputeFn = Callable[[List[PreIndex]], List[Embedding]]
+
+
+def _hash(value: str) -> str:
+  return hashlib.sha256(value.encode('utf-8')).hexdigest()[:16]
+
+
+@dataclass
+class Manifest:
+  model: str
+  store_type: str
+  # Hash of each sentence -> hash of its ';' concatenated dcids.
+  sentences: Dict[str, str]
+
+
+@dataclass
+class IndexDiff:
+  # Sentences not in the previous index.
+  added: List[PreIndex]
+  # Sentences in the previous index, with different dcids.
+  changed: List[PreIndex]
+  # Hashes of the sentences of the previous index that are no longer used.
+  removed: Set[str]
+
+
+def build_manifest(model: str, store_type: str,
+                   preindexes: List[PreIndex]) -> Manifest:
+  return Manifest(model=model,
+                  store_type=store_type,
+                  sentences={_hash(p.text): _hash(p.dcid) for p in preindexes})
+
+
+def save_manifest(local_dir: str, manifest: Manifest):
+  with open(os.path.join(local_dir, _MANIFEST_FILE), 'w') as f:
+    json.dump({'version': _MANIFEST_VERSION, **asdict(manifest)}, f)
+
+
+def load_manifest(local_dir: str) -> Manifest | None:
+  path = os.path.join(local_dir, _MANIFEST_FILE)
+  if not os.path.exists(path):
+    return None
+  with open(path) as f:
+    manifest = json.load(f)
+  if manifest.pop('version', None) != _MANIFEST_VERSION:
+    return None
+  return Manifest(**manifest)
+
+
+def diff_index(previous: Manifest, preindexes: List[PreIndex]) -> IndexDiff:
+  diff = IndexDiff(added=[], changed=[], removed=set(previous.sentences))
+  for p in preindexes:
+    key = _hash(p.text)
+    if key not in previous.sentences:
+      diff.added.append(p)
+      continue
+    diff.removed.discard(key)
+    if previous.sentences[key] != _hash(p.dcid):
+      diff.changed.append(p)
+  return diff
+
+
+def update_embeddings_memory(local_dir: str, previous: Manifest,
+                             diff: IndexDiff, compute: _ComputeFn,
+                             binary_dtype: str) -> bool:
+  """Updates the csv file and the binary embeddings folder of the previous
+  build in place.
+
+  Args:
+    previous: the manifest of the previous build.
+    diff: the diff of the new preindexes against the previous build.
+    compute: computes the embeddings of the added sentences.
+  Returns:
+    Whether the index was updated. False if the files of the previous build do
+    not match its manifest.
+  """
+  local_file = os.path.join(local_dir, constants.EMBEDDINGS_FILE_NAME)
+  binary_dir = os.path.join(local_dir, constants.EMBEDDINGS_BINARY_DIR_NAME)
+  if not os.path.exists(
+      local_file) or not binary_embeddings.is_binary_embeddings(binary_dir):
+    return False
+  try:
+    loaded = binary_embeddings.load(binary_dir)
+  except ValueError as e:
+    logging.info('Binary embeddings of the previous build not usable: %s', e)
+    return False
+  rows = {_hash(sentence): row for row, sentence in enumerate(loaded.sentences)}
+  if rows.keys() != previous.sentences.keys() or str(
+      loaded.vectors.dtype) != binary_dtype:
+    return False
+  del loaded
+  embeddings = compute(diff.added)
+
+  # The csv file is text, so it is only appended to if no row is removed or
+  # changed.
+  new_df = _to_dataframe(embeddings)
+  if diff.removed or diff.changed:
+    df = pd.read_csv(local_file)
+    df = df[[_hash(s) not in diff.removed for s in df[_COL_SENTENCE]]]
+    dcids = {p.text: p.dcid for p in diff.changed}
+    df[_COL_DCID] = [
+        dcids.get(s, d) for s, d in zip(df[_COL_SENTENCE], df[_COL_DCID])
+    ]
+    if embeddings:
+      new_df.columns = df.columns
+      df = pd.concat([df, new_df])
+    df.to_csv(local_file, index=False)
+  elif embeddings:
+    new_df.to_csv(local_file, mode='a', header=False, index=False)
+  logging.info("Updated embeddings in %s", local_file)
+
+  binary_embeddings.update(
+      binary_dir,
+      delete_rows=[rows[key] for key in diff.removed],
+      dcid_updates={rows[_hash(p.text)]: p.dcid for p in diff.changed},
+      vectors=np.array([x.vector for x in embeddings], dtype=np.float32),
+      dcids=[x.preindex.dcid for x in embeddings],
+      sentences=[x.preindex.text for x in embeddings])
+  logging.info("Updated binary embeddings in %s", binary_dir)
+  return True
+
+
+def _sql_string(value: str) -> str:
+  return "'" + value.replace("'", "''") + "'"
+
+
+def update_embeddings_lancedb(local_dir: str, previous: Manifest,
+                              diff: IndexDiff, compute: _ComputeFn) -> bool:
+  """Updates the lancedb table of the previous build in place.
+
+  Args:
+    previous: the manifest of the previous build.
+    diff: the diff of the new preindexes against the previous build.
+    compute: computes the embeddings of the added sentences.
+  Returns:
+    Whether the index was updated. False if the table of the previous build does
+    not match its manifest.
+  """
+  # See save_embeddings_lancedb for the local import.
+  import lancedb
+
+  db = lancedb.connect(local_dir)
+  if _LANCEDB_TABLE not in db.table_names():
+    return False
+  table = db.open_table(_LANCEDB_TABLE)
+  sentences = table.to_lance().to_table(
+      columns=[_COL_SENTENCE]).column(_COL_SENTENCE).to_pylist()
+  if set(_hash(s) for s in sentences) != previous.sentences.keys():
+    return False
+  embeddings = compute(diff.added)
+
+  removed = [s for s in sentences if _hash(s) in diff.removed]
+  for chunk in _chunk_list(removed, _CHUNK_SIZE):
+    table.delete(
+        f'{_COL_SENTENCE} IN ({", ".join(_sql_string(s) for s in chunk)})')
+  for p in diff.changed:
+    table.update(where=f'{_COL_SENTENCE} = {_sql_string(p.text)}',
+                 values={_COL_DCID: p.dcid})
+  if embeddings:
+    table.add([{
+        _COL_DCID: x.preindex.dcid,
+        _COL_SENTENCE: x.preindex.text,
+        'vector': x.vector
+    } for x in embeddings])
+  logging.info("Updated lancedb table in %s", local_dir)
+  return True
+
+
+def update_index(local_dir: str, manifest: Manifest, preindexes: List[PreIndex],
+                 compute: _ComputeFn, binary_dtype: str) -> bool:
+  """Updates the index of the previous build in local_dir to the preindexes.
+
+  Args:
+    manifest: the manifest of the new build.
+    compute: computes the embeddings of the given preindexes.
+  Returns:
+    Whether the index was updated. False if there is no previous build with the
+    same model and store type to update, and the index must be fully built.
+  """
+  previous = load_manifest(local_dir)
+  if not previous:
+    logging.info('No previous build to update in %s', local_dir)
+    return False
+  if (previous.model, previous.store_type) != (manifest.model,
+                                               manifest.store_type):
+    logging.info('Previous build in %s has a different model or store type',
+                 local_dir)
+    return False
+
+  diff = diff_index(previous, preindexes)
+  logging.info('Incremental build: %d added, %d changed, %d removed sentences',
+               len(diff.added), len(diff.changed), len(diff.removed))
+  if manifest.store_type == 'MEMORY':
+    updated = update_embeddings_memory(local_dir, previous, diff, compute,
+                                       binary_dtype)
+  elif manifest.store_type == 'LANCEDB':
+    updated = update_embeddings_lancedb(local_dir, previous, diff, compute)
+  else:
+    raise ValueError(f'Unknown store type: {manifest.store_type}')
+  if not updated:
+    logging.info('Previous build in %s does not match its manifest', local_dir)
+  return updated
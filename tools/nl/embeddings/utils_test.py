@@ -15,8 +15,12 @@
 import os
 import shutil
 import tempfile
+import threading
+from typing import List
 import unittest
+from unittest import mock
 
+from nl_server.embeddings import EmbeddingsModel
 from tools.nl.embeddings import utils
 from tools.nl.embeddings.utils import Embedding
 from tools.nl.embeddings.utils import PreIndex
@@ -24,6 +28,23 @@ from tools.nl.embeddings.utils import PreIndex
 _THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
+class FakeModel(EmbeddingsModel):
+  """Encodes a text as [its length], failing for the texts in `fail`."""
+
+  def __init__(self, fail=None):
+    super().__init__(score_threshold=0.5)
+    self.fail = fail or set()
+    self.calls = []
+    self._lock = threading.Lock()
+
+  def encode(self, queries: List[str]) -> List[List[float]]:
+    with self._lock:
+      self.calls.append(queries)
+    if self.fail.intersection(queries):
+      raise ValueError('failed')
+    return [[float(len(q))] for q in queries]
+
+
 class TestBuildPreindex(unittest.TestCase):
 
   def setUp(self):
@@ -71,3 +92,156 @@ class TestRetrieveEmbeddings(unittest.TestCase):
     ]
     print(got)
     self.assertEqual(got, expected)
+
+  def test_batches(self):
+    model = FakeModel()
+    preindexes = [PreIndex(t, 'dcid') for t in ['ccc', 'a', 'bb', 'dddd', 'a']]
+    got = utils.compute_embeddings(model,
+                                   preindexes,
+                                   existing_embeddings=[],
+                                   num_workers=2,
+                                   batch_size=2)
+    self.assertEqual([(e.preindex.text, e.vector) for e in got],
+                     [('a', [1.0]), ('a', [1.0]), ('bb', [2.0]), ('ccc', [3.0]),
+                      ('dddd', [4.0])])
+    # Each text is only computed once, in batches of similar length.
+    self.assertEqual(sorted(model.calls), [['a', 'bb'], ['ccc', 'dddd']])
+
+  @mock.patch.object(utils, '_RETRY_BACKOFF_SECONDS', 0)
+  def test_failed_batch(self):
+    model = FakeModel(fail={'bb'})
+    with self.assertRaises(RuntimeError):
+      utils.compute_embeddings(
+          model,
+          [PreIndex('a', 'dcid'), PreIndex('bb', 'dcid')],
+          existing_embeddings=[])
+    self.assertEqual(len(model.calls), utils._NUM_RETRIES)
+
+  @mock.patch.object(utils, '_RETRY_BACKOFF_SECONDS', 0)
+  def test_checkpoint(self):
+    preindexes = [PreIndex(t, 'dcid') for t in ['a', 'bb', 'ccc']]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      checkpoint_path = os.path.join(tmp_dir, 'checkpoint.jsonl')
+      # The first run fails after computing the first batch.
+      with self.assertRaises(RuntimeError):
+        utils.compute_embeddings(FakeModel(fail={'ccc'}),
+                                 preindexes,
+                                 existing_embeddings=[],
+                                 checkpoint_path=checkpoint_path,
+                                 batch_size=2)
+      self.assertTrue(os.path.exists(checkpoint_path))
+
+      # The second run only computes the rest.
+      model = FakeModel()
+      got = utils.compute_embeddings(model,
+                                     preindexes,
+                                     existing_embeddings=[],
+                                     checkpoint_path=checkpoint_path,
+                                     batch_size=2)
+      self.assertEqual(model.calls, [['ccc']])
+      self.assertEqual([e.vector for e in got], [[1.0], [2.0], [3.0]])
+      self.assertFalse(os.path.exists(checkpoint_path))
+
+
+class TestSaveEmbeddingsMemory(unittest.TestCase):
+
+  def test_binary_round_trip(self):
+    embeddings = [
+        Embedding(PreIndex('bar', 'dcid3'), [0.4, 0.5, 0.6]),
+        Embedding(PreIndex('foo', 'dcid1;dcid2'), [0.1, 0.2, 0.3]),
+    ]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      utils.save_embeddings_memory(tmp_dir, embeddings)
+      from_csv = utils.load_existing_embeddings(
+          os.path.join(tmp_dir, 'embeddings.csv'))
+      from_binary = utils.load_existing_embeddings(
+          os.path.join(tmp_dir, 'embeddings_bin'))
+    self.assertEqual([e.preindex for e in from_binary],
+                     [e.preindex for e in embeddings])
+    self.assertEqual(from_csv, embeddings)
+    for got, want in zip(from_binary, embeddings):
+      for got_value, want_value in zip(got.vector, want.vector):
+        self.assertAlmostEqual(got_value, want_value, places=6)
+
+
+class TestIncrementalBuild(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tmp_dir.cleanup)
+    self.model = FakeModel()
+
+  def _compute(self, preindexes):
+    return utils.compute_embeddings(self.model, preindexes, [])
+
+  def _build(self, preindexes, incremental=True):
+    local_dir = self.tmp_dir.name
+    manifest = utils.build_manifest('model', 'MEMORY', preindexes)
+    updated = incremental and utils.update_index(
+        local_dir, manifest, preindexes, self._compute, binary_dtype='float32')
+    if not updated:
+      utils.save_embeddings_memory(local_dir, self._compute(preindexes))
+    utils.save_manifest(local_dir, manifest)
+    return updated
+
+  def _load(self, name):
+    got = utils.load_existing_embeddings(os.path.join(self.tmp_dir.name, name))
+    return sorted((e.preindex.text, e.preindex.dcid, e.vector) for e in got)
+
+  def test_diff(self):
+    previous = utils.build_manifest('model', 'MEMORY', [
+        PreIndex('a', 'dcid1'),
+        PreIndex('bb', 'dcid2'),
+        PreIndex('ccc', 'dcid3')
+    ])
+    diff = utils.diff_index(previous, [
+        PreIndex('a', 'dcid1'),
+        PreIndex('bb', 'dcid4'),
+        PreIndex('dddd', 'dcid5')
+    ])
+    self.assertEqual(diff.added, [PreIndex('dddd', 'dcid5')])
+    self.assertEqual(diff.changed, [PreIndex('bb', 'dcid4')])
+    self.assertEqual(diff.removed, {utils._hash('ccc')})
+
+  def test_no_previous_build(self):
+    self.assertFalse(self._build([PreIndex('a', 'dcid1')]))
+
+  def test_append(self):
+    self._build([PreIndex('a', 'dcid1'), PreIndex('bb', 'dcid2')])
+    self.model.calls = []
+    self.assertTrue(
+        self._build([
+            PreIndex('a', 'dcid1'),
+            PreIndex('bb', 'dcid2'),
+            PreIndex('ccc', 'dcid3')
+        ]))
+    # Only the new sentence is computed.
+    self.assertEqual(self.model.calls, [['ccc']])
+    want = [('a', 'dcid1', [1.0]), ('bb', 'dcid2', [2.0]),
+            ('ccc', 'dcid3', [3.0])]
+    self.assertEqual(self._load('embeddings.csv'), want)
+    self.assertEqual(self._load('embeddings_bin'), want)
+
+  def test_update(self):
+    self._build([
+        PreIndex('a', 'dcid1'),
+        PreIndex('bb', 'dcid2'),
+        PreIndex('ccc', 'dcid3')
+    ])
+    self.assertTrue(
+        self._build([
+            PreIndex('bb', 'dcid4'),
+            PreIndex('ccc', 'dcid3'),
+            PreIndex('dddd', 'dcid5')
+        ]))
+    want = [('bb', 'dcid4', [2.0]), ('ccc', 'dcid3', [3.0]),
+            ('dddd', 'dcid5', [4.0])]
+    self.assertEqual(self._load('embeddings.csv'), want)
+    self.assertEqual(self._load('embeddings_bin'), want)
+
+  def test_mismatched_index(self):
+    self._build([PreIndex('a', 'dcid1')])
+    # The index is rebuilt without updating the manifest.
+    utils.save_embeddings_memory(self.tmp_dir.name,
+                                 self._compute([PreIndex('bb', 'dcid2')]))
+    self.assertFalse(self._build([PreIndex('a', 'dcid1')]))
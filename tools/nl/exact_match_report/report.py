@@ -0,0 +1,73 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Reports how many queries of a query log match an index's sentences exactly,
+and so take the exact match path of the NL server instead of vector search."""
+
+import csv
+import sys
+from typing import List
+
+from absl import app
+from absl import flags
+
+from nl_server.store import binary_embeddings
+from nl_server.store.sentence_index import SentenceIndex
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string(
+    'queries_file', 'tools/nl/svindex_differ/queryset_vars.csv',
+    'File with one query per line. Lines starting with "#" are skipped.')
+flags.DEFINE_list(
+    'index_paths', ['tools/nl/embeddings/input/base/_preindex.csv'],
+    'Indexes to match: csv files with a "sentence" column (embeddings or '
+    'preindex csv files), or binary embeddings folders.')
+flags.DEFINE_bool('show_matches', False, 'Print the matched queries.')
+
+
+def _read_queries(path: str) -> List[str]:
+  with open(path) as f:
+    lines = [line.strip() for line in f]
+  return [line for line in lines if line and not line.startswith('#')]
+
+
+def _read_sentences(path: str) -> List[str]:
+  if binary_embeddings.is_binary_embeddings(path):
+    return binary_embeddings.load(path, verify_checksums=False).sentences
+  csv.field_size_limit(sys.maxsize)
+  with open(path) as f:
+    return [row['sentence'] for row in csv.DictReader(f)]
+
+
+def main(_):
+  queries = _read_queries(FLAGS.queries_file)
+  indexes = []
+  for path in FLAGS.index_paths:
+    indexes.append(SentenceIndex(_read_sentences(path)))
+    print(f'{path}: {len(indexes[-1])} distinct sentences')
+
+  matched = [q for q in queries if any(index.lookup(q) for index in indexes)]
+  distinct = set(queries)
+  distinct_matched = set(matched)
+  print(f'\n{len(matched)} of {len(queries)} queries '
+        f'({len(matched) / max(len(queries), 1):.1%}) match exactly')
+  print(f'{len(distinct_matched)} of {len(distinct)} distinct queries '
+        f'({len(distinct_matched) / max(len(distinct), 1):.1%}) match exactly')
+  if FLAGS.show_matches:
+    for query in sorted(distinct_matched):
+      print('  ' + query)
+
+
+if __name__ == '__main__':
+  app.run(main)
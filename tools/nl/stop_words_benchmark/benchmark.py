@@ -0,0 +1,95 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compares the latency of removing stop words by trying every stop word with
+the precompiled stop word matcher, and checks that their outputs match."""
+
+import time
+from typing import Callable, List
+
+from absl import app
+from absl import flags
+
+import shared.lib.constants as constants
+import shared.lib.utils as utils
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string(
+    'queries_file', 'tools/nl/svindex_differ/queryset_vars.csv',
+    'File with one query per line. Lines starting with "#" are skipped.')
+flags.DEFINE_integer('repeat', 10, 'Number of times to go over the queries.')
+
+
+def _read_queries(path: str) -> List[str]:
+  with open(path) as f:
+    lines = [line.strip() for line in f]
+  return [line for line in lines if line and not line.startswith('#')]
+
+
+def _time_us(fn: Callable, num_calls: int) -> float:
+  start = time.perf_counter()
+  fn()
+  return (time.perf_counter() - start) * 1000000 / num_calls
+
+
+def _remove_stop_words_per_word(query: str, stop_words: List[str]) -> str:
+  """remove_stop_words(), trying every stop word."""
+  query = utils.replace_exclusions_with_placeholders(query.lower(),
+                                                     utils._PLACEHOLDER_MAP)
+  query = utils.remove_words(query, stop_words)
+  query = utils.restore_exclusions_with_placeholders(query,
+                                                     utils._PLACEHOLDER_MAP)
+  return ' '.join(query.split())
+
+
+def main(_):
+  queries = _read_queries(FLAGS.queries_file) * FLAGS.repeat
+  stop_words = utils.combine_stop_words()
+  print(f'{len(stop_words)} stop words')
+
+  combine_us = _time_us(lambda: [utils.combine_stop_words() for _ in queries],
+                        len(queries))
+  per_word_us = _time_us(
+      lambda: [_remove_stop_words_per_word(q, stop_words) for q in queries],
+      len(queries))
+  # Warm up, compiling the matcher.
+  utils.remove_stop_words('warm up', stop_words)
+  matcher_us = _time_us(
+      lambda: [utils.remove_stop_words(q, stop_words) for q in queries],
+      len(queries))
+
+  mismatches = []
+  for words in [
+      stop_words,
+      utils.combine_stop_words(
+          constants.HEURISTIC_TYPES_IN_VARIABLES_TOOLFORMER),
+      constants.STOP_WORDS
+  ]:
+    mismatches += [
+        q for q in set(queries)
+        if _remove_stop_words_per_word(q, words) != utils.remove_stop_words(
+            q, words)
+    ]
+
+  print(f'\n{len(queries)} queries, us per query:')
+  print(f'  combine_stop_words:            {combine_us:.1f}')
+  print(f'  trying every stop word:        {per_word_us:.1f}')
+  print(f'  precompiled matcher:           {matcher_us:.1f}')
+  print(f'\nQueries with different outputs: {len(mismatches)}')
+  for q in mismatches:
+    print('  ' + q)
+
+
+if __name__ == '__main__':
+  app.run(main)
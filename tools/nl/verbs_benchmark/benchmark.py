@@ -0,0 +1,86 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compares the verb detection latency of the full and lean spaCy pipelines,
+one query per call, in batches and from the cache."""
+
+import time
+from typing import Callable, List
+
+from absl import app
+from absl import flags
+
+from nl_server.model.attribute_model import AttributeModel
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string(
+    'queries_file', 'tools/nl/loadtest/queryset.csv',
+    'File with one query per line. Lines starting with "#" are skipped.')
+flags.DEFINE_integer('batch_size', 16, 'Number of queries per batch call.')
+
+
+def _read_queries(path: str) -> List[str]:
+  with open(path) as f:
+    lines = [line.strip() for line in f]
+  return [line for line in lines if line and not line.startswith('#')]
+
+
+def _time_ms(fn: Callable, num_calls: int) -> float:
+  start = time.perf_counter()
+  fn()
+  return (time.perf_counter() - start) * 1000 / num_calls
+
+
+def main(_):
+  queries = _read_queries(FLAGS.queries_file)
+  batches = [
+      queries[i:i + FLAGS.batch_size]
+      for i in range(0, len(queries), FLAGS.batch_size)
+  ]
+
+  full = AttributeModel(full_pipeline=True)
+  lean = AttributeModel()
+  print(f'Full pipeline: {full.spacy_model_.pipe_names}')
+  print(f'Lean pipeline: {lean.spacy_model_.pipe_names}')
+  # Warm up.
+  full.spacy_model_('warm up')
+  lean.spacy_model_('warm up')
+
+  # The cache is bypassed by calling the pipelines directly.
+  full_ms = _time_ms(lambda: [full.spacy_model_(q) for q in queries],
+                     len(queries))
+  lean_ms = _time_ms(lambda: [lean.spacy_model_(q) for q in queries],
+                     len(queries))
+  batch_ms = _time_ms(
+      lambda: [list(lean.spacy_model_.pipe(b)) for b in batches], len(queries))
+  lean.detect_verbs_batch(queries)
+  cached_ms = _time_ms(lambda: [lean.detect_verbs(q) for q in queries],
+                       len(queries))
+
+  mismatches = [
+      q for q in queries if full.detect_verbs(q) != lean.detect_verbs(q)
+  ]
+
+  print(f'\n{len(queries)} queries, ms per query:')
+  print(f'  full pipeline, one per call:   {full_ms:.2f}')
+  print(f'  lean pipeline, one per call:   {lean_ms:.2f}')
+  print(f'  lean pipeline, {FLAGS.batch_size} per call:    {batch_ms:.2f}')
+  print(f'  cached:                        {cached_ms:.4f}')
+  print(f'\nQueries with different verbs: {len(mismatches)}')
+  for q in mismatches:
+    print('  ' + q)
+
+
+if __name__ == '__main__':
+  app.run(main)
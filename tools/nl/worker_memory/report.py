@@ -0,0 +1,83 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Reports the memory of each NL server gunicorn worker.
+
+Run on the machine (or in the container) of the server.
+"""
+
+import os
+from typing import List
+
+from absl import app
+from absl import flags
+
+from nl_server.shared_memory import memory_stats
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string('app', 'nl_app:app',
+                    'Command line substring of the server processes.')
+
+_COLUMNS = ['VmRSS', 'Pss', 'Shared_Clean', 'Private_Dirty']
+
+
+def _server_pids(app_name: str) -> List[int]:
+  pids = []
+  for pid in os.listdir('/proc'):
+    if not pid.isdigit() or int(pid) == os.getpid():
+      continue
+    try:
+      with open(f'/proc/{pid}/cmdline', 'rb') as f:
+        cmdline = f.read().replace(b'\0', b' ').decode()
+    except OSError:
+      continue
+    if app_name in cmdline:
+      pids.append(int(pid))
+  return sorted(pids)
+
+
+def _parent_pid(pid: int) -> int:
+  with open(f'/proc/{pid}/stat') as f:
+    # The command in field 2 can have spaces, but is in parentheses.
+    return int(f.read().rsplit(')', 1)[1].split()[1])
+
+
+def main(_):
+  pids = _server_pids(FLAGS.app)
+  if not pids:
+    print(f'No process running {FLAGS.app}')
+    return
+  print('{:>8} {:>8} '.format('pid', 'role') +
+        ' '.join('{:>14}'.format(c + ' MB') for c in _COLUMNS))
+  totals = {c: 0 for c in _COLUMNS}
+  num_workers = 0
+  for pid in pids:
+    # The gunicorn master is the parent of the workers.
+    is_worker = _parent_pid(pid) in pids
+    num_workers += is_worker
+    stats = memory_stats(pid)
+    for c in _COLUMNS:
+      totals[c] += stats.get(c, 0)
+    print('{:>8} {:>8} '.format(pid, 'worker' if is_worker else 'master') +
+          ' '.join(
+              '{:>14.1f}'.format(stats.get(c, 0) / 1024) for c in _COLUMNS))
+  print('{:>17} '.format('total') +
+        ' '.join('{:>14.1f}'.format(totals[c] / 1024) for c in _COLUMNS))
+  # Pss splits shared pages among the processes, so it adds up to the total.
+  print(f'\n{num_workers} workers, total memory (sum of Pss): '
+        f'{totals["Pss"] / 1024:.1f} MB')
+
+
+if __name__ == '__main__':
+  app.run(main)